@@ -3,9 +3,12 @@ __author__ = 'Alexis BOURGET'
 
 import os
 import re
+import webbrowser
+import sqlite3 as sql
 import tkinter as tk
 import tkinter.ttk as ttk
 import tkinter.messagebox as mb
+import tkinter.simpledialog as sd
 # For errors when downloading
 import urllib.error
 
@@ -13,6 +16,18 @@ import utilities.constants as cst
 import utilities.tools as tls
 import utilities.story_writer as sw
 import utilities.data_handler as dh
+import utilities.database_writer as dw
+import utilities.chapter_store as cs
+import utilities.library as lb
+import utilities.storage as stg
+import utilities.epub_writer as ew
+import utilities.reading_server as rs
+import utilities.integrity as itg
+import utilities.trash as tr
+import utilities.sync as sy
+import utilities.library_index as li
+import utilities.facets as fc
+import utilities.statistics as sts
 
 
 class UI(tk.Frame):
@@ -39,11 +54,20 @@ class UI(tk.Frame):
         self.__base_folder = os.getcwd()
 
         try:
-            main_folder = tls.get_settings()[0]
+            settings = tls.get_settings()
         except FileNotFoundError:
+            settings = []
+        # The address the reading server listens on, on the second line (see
+        # constants.READING_SERVER_BIND_ADDRESS)
+        if len(settings) > 1:
+            self.__bind_address = settings[1]
+        else:
+            self.__bind_address = cst.READING_SERVER_BIND_ADDRESS
+        if len(settings) == 0:
             main_folder = tls.popup_settings(self.__master)
-            with open('settings.ffndl', 'w', encoding='utf-8') as f:
-                f.write(main_folder + '\n')
+            self.__save_settings(main_folder)
+        else:
+            main_folder = settings[0]
 
         self.__main_folder = main_folder
         os.chdir(self.__main_folder)
@@ -62,20 +86,73 @@ class UI(tk.Frame):
                 os.remove(f'0/logs/{title}')
                 self.__logger.info(f'Removed {title}')
 
+        # Checked first: a too old SQLite must not make a healthy database be
+        # taken for a corrupted one
+        try:
+            dw.check_sqlite_version()
+        except RuntimeError as err:
+            self.__logger.critical(err)
+            mb.showerror(title='SQLite too old', message=str(err))
+            raise SystemExit(1)
+
         # Initialize the connection to the database
-        self.__database = dh.DataHandler('0/data/ffndl_database.db')
+        database_lost = False
+        try:
+            try:
+                self.__database = dh.DataHandler('0/data/ffndl_database.db')
+            # The database is corrupted: it is set aside and a new one is made,
+            # which can be rebuilt from the files of the library
+            except sql.DatabaseError as err:
+                if not dw.is_corrupted('0/data/ffndl_database.db'):
+                    raise
+                self.__logger.error(f'Corrupted database: {err}')
+                # Its write-ahead log must not be applied to the new one
+                for suffix in ('', '-wal', '-shm'):
+                    if os.path.exists(f'0/data/ffndl_database.db{suffix}'):
+                        os.replace(
+                            f'0/data/ffndl_database.db{suffix}',
+                            f'0/data/ffndl_database.db.corrupted{suffix}'
+                        )
+                self.__database = dh.DataHandler('0/data/ffndl_database.db')
+                database_lost = True
+        # Not corrupted (locked by another program, a migration which failed,
+        # ...): it is left as it is
+        except (sql.Error, dw.MigrationError) as err:
+            self.__logger.critical(f'Unusable database: {err}')
+            mb.showerror(title='Unusable database',
+                         message=f'The database could not be opened, it was '
+                                 f'left as it is: {err}')
+            raise SystemExit(1)
+
+        # The stories in memory, for the lookups of the UI
+        self.__index = li.LibraryIndex(self.__database)
+        # The counts of the values of the stories, for the filter
+        self.__facets = fc.Facets(self.__database)
 
         # Initialize the story writer
-        self.__writer = sw.StoryWriter()
+        self.__writer = sw.StoryWriter(self.__database)
+        # The texts of the chapters, kept by the story writer
+        self.__store = cs.ChapterStore()
+        # Serves the library to the browser, started on demand
+        self.__server = None
+        # Deletes the files of the deleted stories in the background, starting
+        # with what was left from the last time
+        self.__trash = tr.Trash('0/data/ffndl_database.db')
+        self.__trash.wake_up()
 
         # For the left pane
         self.__selectable_stories = []
+        # The values the selectable stories are filtered by, by facet, and
+        # those displayed for the selected facet
+        self.__facet_selection = {facet: set() for facet in cst.FACETS}
+        self.__facet_values = []
         # For the right pane
         self.__selected_stories = []
         self.__selected_var = []
 
         self.__selected_site = tk.StringVar()
         self.__selected_sort = tk.StringVar()
+        self.__selected_facet = tk.StringVar()
         self.__url_entered = tk.StringVar()
 
         # The existing TopLevel windows
@@ -92,9 +169,16 @@ class UI(tk.Frame):
         self.__logger.debug('First sorting and display')
         self.__site_selector.current(0)
         self.__sort_selector.current(6)
+        self.__facet_selector.current(0)
         # The default choices have been made, they are now accounted for
         self.__update_selectable_display()
 
+        if database_lost and mb.askyesno(
+                title='Unusable database',
+                message='The database could not be read and was set aside. '
+                        'Rebuild it from the files of the library ?'):
+            self.__rebuild_database()
+
     @staticmethod
     def __setup_folders():
         """
@@ -113,17 +197,50 @@ class UI(tk.Frame):
             window.destroy()
 
         folder = tls.popup_settings(self)
-        os.chdir(self.__base_folder)
         if folder != '':
-            with open('settings.ffndl', 'w', encoding='utf-8') as f:
-                f.write(folder + '\n')
+            self.__save_settings(folder)
             mb.showinfo(
                 message=f'This change from {self.__main_folder} to {folder}'
                         f' will only take effect once you restart the app.'
             )
-        os.chdir(self.__main_folder)
         self.__logger.debug('Save folder changed')
 
+    def __change_bind_address(self):
+        """
+        Allows the user to choose the address the reading server listens on,
+        to let other computers synchronize from this library
+        """
+        self.__logger.info('Changing the address of the reading server')
+        address = sd.askstring(
+            title='Share the library',
+            prompt="Address the reading server listens on: 'localhost' for "
+                   "this computer only, the address of this computer on the "
+                   "local network, or nothing for all of them.\nNothing is "
+                   "authenticated, only share on a trusted network.",
+            initialvalue=self.__bind_address,
+            parent=self.__master
+        )
+        if address is None:
+            self.__logger.debug('Address change cancelled')
+            return
+
+        self.__bind_address = address.strip()
+        self.__save_settings(self.__main_folder)
+        if self.__server is not None:
+            mb.showinfo(message='This change will only take effect once you '
+                                'restart the app.')
+        self.__logger.debug('Address of the reading server changed')
+
+    def __save_settings(self, folder: str):
+        """
+        Write the settings file, in the folder the app was started from
+
+        :param folder: the save folder
+        """
+        with open(os.path.join(self.__base_folder, 'settings.ffndl'), 'w',
+                  encoding='utf-8') as f:
+            f.write(f'{folder}\n{self.__bind_address}\n')
+
     def __make_menus(self):
         """
         Build the menu for the app
@@ -145,9 +262,19 @@ class UI(tk.Frame):
             label='Download informations',
             command=lambda: self.__handle_stories('informations')
         )
+        menu_stories.add_command(
+            label='Add stories without downloading',
+            command=lambda: self.__handle_stories('register')
+        )
         menu_stories.add_separator()
         menu_stories.add_command(label='Delete stories',
                                  command=lambda: self.__delete_stories())
+        menu_stories.add_separator()
+        # Disabled if SQLite has no FTS5
+        menu_stories.add_command(label='Search',
+                                 command=lambda: self.__search(),
+                                 state=tk.NORMAL if self.__database.can_search()
+                                 else tk.DISABLED)
         menu_bar.add_cascade(label='Stories',
                              menu=menu_stories)
 
@@ -159,10 +286,9 @@ class UI(tk.Frame):
         )
         menu_stats.add_command(label='For each site',
                                command=lambda: self.__each_site_statistics())
-#        NOT IMPLEMENTED YET
-#        menu_stats.add_separator()
-#        menu_stats.add_command(label='General statistics',
-#                               command=self.__general_statistics)
+        menu_stats.add_separator()
+        menu_stats.add_command(label='General statistics',
+                               command=lambda: self.__general_statistics())
         menu_bar.add_cascade(label='Statistics',
                              menu=menu_stats)
 
@@ -180,15 +306,54 @@ class UI(tk.Frame):
         menu_series.add_command(label='Add to',
                                 command=lambda: self.__add_to_series())
         menu_series.add_separator()
+        menu_series.add_command(label='Rename series',
+                                command=lambda: self.__rename_series())
         menu_series.add_command(label='Delete series',
                                 command=lambda: self.__delete_series())
         menu_bar.add_cascade(label='Series',
                              menu=menu_series)
 
+        menu_library = tk.Menu(menu_bar,
+                               tearoff=0)
+        menu_library.add_command(label='Render again',
+                                 command=lambda: self.__render_library())
+        menu_library.add_command(label='Check integrity',
+                                 command=lambda: self.__check_library())
+        menu_library.add_command(label='Rebuild database',
+                                 command=lambda: self.__rebuild_database())
+        menu_library.add_command(label='Read in browser',
+                                 command=lambda: self.__read_in_browser())
+        menu_library.add_command(label='Synchronize from another library',
+                                 command=lambda: self.__synchronize())
+        menu_library.add_separator()
+        menu_library.add_command(
+            label='Pack selected stories',
+            command=lambda: self.__convert_stories(True)
+        )
+        menu_library.add_command(
+            label='Export selected stories as files',
+            command=lambda: self.__convert_stories(False)
+        )
+        menu_bar.add_cascade(label='Library',
+                             menu=menu_library)
+
+        menu_epub = tk.Menu(menu_bar,
+                            tearoff=0)
+        menu_epub.add_command(label='Selected stories',
+                              command=lambda: self.__export_epubs('stories'))
+        menu_epub.add_command(label='Series of selected stories',
+                              command=lambda: self.__export_epubs('series'))
+        menu_epub.add_command(label='Selected site',
+                              command=lambda: self.__export_epubs('site'))
+        menu_bar.add_cascade(label='EPUB',
+                             menu=menu_epub)
+
         menu_settings = tk.Menu(menu_bar,
                                 tearoff=0)
         menu_settings.add_command(label='Change save folder',
                                   command=self.__change_save_folder)
+        menu_settings.add_command(label='Share the library on the network',
+                                  command=self.__change_bind_address)
         menu_bar.add_cascade(label='Settings',
                              menu=menu_settings)
 
@@ -223,6 +388,24 @@ class UI(tk.Frame):
         self.__sort_selector.bind('<<ComboboxSelected>>',
                                   lambda _: self.__select_sort())
 
+        filter_frame = tk.LabelFrame(l_frame, text='Filter', padx=2, pady=2)
+
+        self.__facet_selector = ttk.Combobox(filter_frame,
+                                             textvariable=self.__selected_facet,
+                                             state='readonly')
+        self.__facet_selector['values'] = list(cst.FACETS.keys())
+        self.__facet_selector.bind('<<ComboboxSelected>>',
+                                   lambda _: self.__select_facet())
+
+        # Not exporting its selection, so the selectable stories keep theirs
+        self.__facet_listbox = tk.Listbox(filter_frame, selectmode='multiple',
+                                          height=6, exportselection=False)
+        self.__facet_listbox.bind('<<ListboxSelect>>',
+                                  lambda _: self.__select_facet_values())
+
+        clear_button = tk.Button(filter_frame, text='Clear',
+                                 command=self.__clear_facets)
+
         self.__selectable_listbox = tk.Listbox(l_frame, selectmode='extended')
         self.__selectable_listbox.bind('<Double-1>',
                                        lambda _: self.__selectable_command())
@@ -235,6 +418,11 @@ class UI(tk.Frame):
         self.__sort_selector.pack(fill=tk.X)
         sort_frame.pack(fill=tk.X)
 
+        self.__facet_selector.pack(fill=tk.X)
+        self.__facet_listbox.pack(fill=tk.X)
+        clear_button.pack(anchor=tk.E)
+        filter_frame.pack(fill=tk.X)
+
         self.__selectable_listbox.pack(fill=tk.BOTH, expand=tk.YES)
 
         l_frame.pack(fill=tk.BOTH, expand=tk.YES)
@@ -294,6 +482,9 @@ class UI(tk.Frame):
         """
         self.__logger.info('Selecting a site')
         self.__site_selector.selection_clear()
+        # The values of the facets are not the same from one site to another
+        for values in self.__facet_selection.values():
+            values.clear()
         # Replace at the beginning
         self.__selectable_listbox.see(0)
         self.__logger.debug('Site selected')
@@ -309,6 +500,38 @@ class UI(tk.Frame):
         self.__logger.debug('Sorting method selected')
         self.__update_selectable_display()
 
+    def __select_facet(self):
+        """
+        Allow the user to choose the facet whose values are displayed in the
+        filter
+        """
+        self.__logger.info('Selecting a facet')
+        self.__facet_selector.selection_clear()
+        self.__facet_listbox.see(0)
+        self.__update_facet_display()
+
+    def __select_facet_values(self):
+        """
+        Filter the selectable stories by the values selected for the displayed
+        facet
+        """
+        facet = self.__selected_facet.get()
+        self.__facet_selection[facet] = {
+            self.__facet_values[i] for i in self.__facet_listbox.curselection()
+        }
+        self.__logger.info(f'Filtering by "{facet}": '
+                           f'{self.__facet_selection[facet]}')
+        self.__update_selectable_display()
+
+    def __clear_facets(self):
+        """
+        Display all the stories of the site again
+        """
+        self.__logger.info('Clearing the filter')
+        for values in self.__facet_selection.values():
+            values.clear()
+        self.__update_selectable_display()
+
     def __selectable_command(self):
         """
         Allow the user to select stories from the one already present in the
@@ -322,10 +545,12 @@ class UI(tk.Frame):
         # can't be added twice anyway
         self.__selectable_listbox.selection_clear(0, 'end')
 
+        selected = set(self.__selected_stories)
         for i in indexes:
             url = self.__selectable_stories[i][0]
             title = self.__selectable_stories[i][4]
-            if url not in self.__selected_stories:
+            if url not in selected:
+                selected.add(url)
                 self.__selected_stories.append(url)
                 self.__selected_var.append(f'{title} | {url}')
                 self.__logger.info(f'Selecting: "{url}"')
@@ -399,7 +624,7 @@ class UI(tk.Frame):
         Can download, update or download the informations for the stories in
         the selected list
 
-        :param mode: 'download', 'update' or 'informations'
+        :param mode: 'download', 'update', 'informations' or 'register'
         """
 
         # Prepare the functions to use
@@ -409,6 +634,9 @@ class UI(tk.Frame):
         elif mode == 'informations':
             self.__logger.info('Updating informations')
             writer_func = self.__writer.write_informations
+        elif mode == 'register':
+            self.__logger.info('Adding stories without downloading them')
+            writer_func = self.__writer.register
         # Default mode is update since its the most convenient one
         else:
             self.__logger.info('Updating stories')
@@ -417,7 +645,10 @@ class UI(tk.Frame):
         # The error message must adapt to the different failures
         err_message = 'FAILURE | {} | Reason: {}'
 
-        urls = self.__database.get_column('url', False)
+        # Registering a story or writing its informations does not use the
+        # database: the stories are saved together, a batch at a time
+        batched = mode in ('informations', 'register')
+        pending = []
 
         for i, url in enumerate(self.__selected_stories):
 
@@ -436,12 +667,17 @@ class UI(tk.Frame):
 
                 # Special handling of the situation where the url has never been
                 # saved and the user want only download the informations for it
-                if mode == 'informations' and new_url not in urls:
+                if mode == 'informations' and new_url not in self.__index:
                     self.__selected_var[i] = err_message.format(
                         new_url,
                         'No informations to update, story was never downloaded'
                     )
                     self.__logger.error('No informations to update')
+                elif batched:
+                    writer_func()
+                    pending.append(self.__writer.story)
+                    self.__selected_var[i] = f'Success | {new_url}'
+                    self.__logger.info(f'{mode.title()}: successful')
                 else:
                     # Ensure the story exists in the database even when
                     # not downloaded/updated completely. It will allow the user
@@ -474,26 +710,74 @@ class UI(tk.Frame):
                 self.__logger.debug(f'Handled URL [{i}]: "{url}"')
                 self.__update_display(i)
 
+            if len(pending) >= cst.DATABASE_COMMIT_INTERVAL:
+                self.__database.add_stories(pending)
+                pending = []
+
+        self.__database.add_stories(pending)
+
+        # The statistics already compiled stay up to date
+        self.__update_statistics(self.__sites_of(self.__selected_stories))
+
     def __delete_stories(self):
         """
         Delete the selected stories
         """
+        # Unknown once they are deleted
+        sites = self.__sites_of(self.__selected_stories)
         for i, url in enumerate(self.__selected_stories):
             self.__logger.info(f'Deleting story: "{url}"')
-            # Delete the story folder if necessary
             paths = self.__database.get_value_by_url('path_to_index', url)
+            hashes = [ch[2] for ch in self.__database.get_chapters(url)]
             try:
                 path = paths[0].rsplit('/', 1)[0]
-                for file in os.listdir(path):
-                    os.remove(f'{path}/{file}')
-                os.rmdir(path)
+                # A single rename, the files are deleted in the background
+                if not self.__trash.add_story(f'{path}/'):
+                    # Its folder may only be missing for now (renamed, on a
+                    # drive not mounted...): its row is kept
+                    self.__selected_var[i] = f'Not found on disk | {url}'
+                    self.__logger.error(f'Story not found in "{path}/"')
+                    continue
                 # Delete the entry in the database
                 self.__database.delete_story(url)
+                # Delete the stored chapters no other story uses
+                self.__trash.add_texts(
+                    self.__database.get_unused_hashes(hashes))
                 self.__selected_var[i] = f'Deleted | {url}'
                 self.__logger.debug('Story deleted')
-            except (IndexError, FileNotFoundError):
+            except IndexError:
                 self.__selected_var[i] = f'URL not present in database | {url}'
                 self.__logger.error('Story is not present in database')
+            except OSError as err:
+                self.__selected_var[i] = f'FAILURE | {url} | Reason: {err}'
+                self.__logger.error(f'Could not delete the story: {err}')
+            finally:
+                self.__update_display(i)
+
+        self.__trash.wake_up()
+        self.__update_statistics(sites)
+
+    def __convert_stories(self, packed: bool):
+        """
+        Pack the selected stories in a single file each or export them back to
+        one file per chapter
+
+        :param packed: True to pack them, False to export them
+        """
+        mode = 'Packed' if packed else 'Exported'
+        for i, url in enumerate(self.__selected_stories):
+            self.__logger.info(f'{mode[:-2]}ing story: "{url}"')
+            paths = self.__database.get_value_by_url('path_to_index', url)
+            try:
+                stg.convert(f"{paths[0].rsplit('/', 1)[0]}/", packed)
+                self.__selected_var[i] = f'{mode} | {url}'
+                self.__logger.debug(f'Story {mode.lower()}')
+            except IndexError:
+                self.__selected_var[i] = f'URL not present in database | {url}'
+                self.__logger.error('Story is not present in database')
+            except FileNotFoundError:
+                self.__selected_var[i] = f'Already {mode.lower()} | {url}'
+                self.__logger.error(f'Story already {mode.lower()}')
             finally:
                 self.__update_display(i)
 
@@ -506,94 +790,91 @@ class UI(tk.Frame):
         """
         self.__logger.info(f'Compiling statistics for "{site}"')
 
-        text = ''
-
-        saved_series = self.__database.get_column('series',
-                                                  True,
-                                                  f'site="{site}"')
-        infos = {
-            'authors': len(
-                self.__database.get_column('author', True, f'site="{site}"')
-            ),
-            'universes': len(
-                self.__database.get_column('universe', True, f'site="{site}"')
-            ),
-            'chapters': sum(self.__database.get_column('chapter_count',
-                                                       False,
-                                                       f'site="{site}"'
-                                                       )),
-            'words': sum(self.__database.get_column('word_count',
-                                                    False,
-                                                    f'site="{site}"'
-                                                    )),
-            'read': 0,
-            'unread': 0,
-            'series': len(saved_series) - (1 if '' in saved_series else 0),
-        }
-
-        for i, story in enumerate(self.__database.get_stories_by_site(site)):
-
-            self.__logger.debug(f'Adding "{story[0]} to the statistics"')
-
-            series = '-' if story[13] == '' else f'{story[13]}: n° {story[14]}'
-            # Completed story or not ?
-            status = '<span class="{}">{}</span>'.format(
-                # The classes we want are either 'progress' or 'complete'
-                story[7].lower().replace('in ', ''),
-                # Either 'In Progress' or 'Complete'
-                story[7].title(),
-            )
-            # Has the story been read ?
-            if bool(story[12]):
-                read = '<span class="read">Read</span>'
-                infos['read'] += 1
-            else:
-                read = '<span class="unread">Unread</span>'
-                infos['unread'] += 1
-
-            text += cst.SITE_STATISTICS_TR_TEMPLATE.format(
-                story=story,
-                num=i,
-                read=read,
-                status=status,
-                series=series,
-            )
-
-            self.__logger.debug('Added')
-
-        self.__logger.debug('Compiled')
-
+        # Kept up to date by the database, instead of counted from every story
+        infos = self.__database.get_site_statistics(site)
         # No need to write anything then because there are no saved stories
         # for the selected site
-        if text == '':
+        if infos is None:
             self.__logger.error('No stories saved for this site')
             return
 
         self.__logger.debug('Writing statistics css')
-        with open('0/css/statistics_style.css', 'w', encoding='utf-8') as f:
-            f.write(cst.STATISTICS_CSS)
+        tls.write_file('0/css/statistics_style.css', cst.STATISTICS_CSS)
 
         self.__logger.debug('Writing javascript')
-        with open('0/js/sorting.js', 'w', encoding='utf-8') as f:
-            f.write(cst.STATISTICS_JS)
+        tls.write_file('0/js/sorting.js', cst.STATISTICS_JS)
+
+        # The rows of the stories are written as they are read, between the
+        # two halves of the page, so the stories are never all in memory
+        head, tail = cst.SITE_STATISTICS_TEMPLATE.split('{content}')
 
         self.__logger.debug('Writing statistics')
-        with open(f'{site}_statistics.html', 'w', encoding='utf-8') as f:
-            f.write(cst.SITE_STATISTICS_TEMPLATE.format(
+        with tls.OutputFile(f'{site}_statistics.html') as f:
+            f.write(head.format(
                 site=site,
                 authors=infos['authors'],
                 universes=infos['universes'],
                 chapters=infos['chapters'],
                 words=infos['words'],
-                stories=infos['read'] + infos['unread'],
+                stories=infos['stories'],
                 read=infos['read'],
                 unread=infos['unread'],
                 series=infos['series'],
-                content=text,
             ))
 
+            rows = []
+            for i, story in enumerate(
+                    self.__database.iter_stories_by_site(site)):
+                series = ('-' if story[13] == ''
+                          else f'{story[13]}: n° {story[14]}')
+                # Completed story or not ?
+                status = '<span class="{}">{}</span>'.format(
+                    # The classes we want are either 'progress' or 'complete'
+                    story[7].lower().replace('in ', ''),
+                    # Either 'In Progress' or 'Complete'
+                    story[7].title(),
+                )
+                # Has the story been read ?
+                if bool(story[12]):
+                    read = '<span class="read">Read</span>'
+                else:
+                    read = '<span class="unread">Unread</span>'
+
+                rows.append(cst.SITE_STATISTICS_TR_TEMPLATE.format(
+                    story=story,
+                    num=i,
+                    read=read,
+                    status=status,
+                    series=series,
+                ))
+                # Written by chunks, each write of the file having a cost
+                if len(rows) == cst.STATISTICS_ROWS_BY_WRITE:
+                    f.write(''.join(rows))
+                    rows = []
+
+            f.write(''.join(rows) + tail)
+
         self.__logger.debug('Statistics written')
 
+    def __sites_of(self, urls) -> set:
+        """
+        :param urls: the urls of some stories, saved or not
+        :return: the sites of those saved
+        """
+        return {self.__index.get(url)[2] for url in urls if url in self.__index}
+
+    def __update_statistics(self, sites):
+        """
+        Compile again the statistics of the sites for which they were already
+        compiled. Their numbers are kept up to date by the database, so only
+        the stories are read again
+
+        :param sites: the sites whose stories changed
+        """
+        for site in sites:
+            if os.path.exists(f'{site}_statistics.html'):
+                self.__do_statistics(site)
+
     def __each_site_statistics(self):
         """
         Compile the statistics for each handled site
@@ -601,13 +882,238 @@ class UI(tk.Frame):
         for site in cst.SITES.keys():
             self.__do_statistics(site)
 
-    # TODO: Decides how the general statistics will look
-    # TODO: ensure this function is efficient (not too many SQL calls)
-    def __general_statistics(self, *args):
+    def __general_statistics(self):
         """
         Compile the general statistics (include all the sites)
         """
-        raise NotImplementedError
+        self.__logger.info('Compiling the general statistics')
+
+        self.__logger.debug('Writing statistics css')
+        tls.write_file('0/css/statistics_style.css', cst.STATISTICS_CSS)
+
+        if sts.write_general_statistics(self.__database,
+                                        'general_statistics.html'):
+            self.__logger.debug('Statistics written')
+
+    def __render_library(self):
+        """
+        Write again every story of the library with the current templates and
+        css, without downloading anything
+        """
+        self.__logger.info('Rendering the library')
+
+        def progress(done: int, total: int):
+            self.__master.title(
+                f'{cst.APP_NAME} | Rendering {done:,}/{total:,}'
+            )
+            self.__master.update()
+
+        summary = lb.render_library(self.__database, progress)
+
+        saved = ''.join(f'\n{site}: {saved_bytes:,} bytes saved'
+                        for site, saved_bytes in summary['saved'].items())
+
+        self.__master.title(cst.APP_NAME)
+        mb.showinfo(
+            message=f"{summary['stories']:,} stories rendered, "
+                    f"{summary['changed']:,} files changed.\n"
+                    f"{summary['missing']:,} chapters could not be rendered "
+                    f"and {summary['failed']:,} stories failed (see the logs)."
+                    f"\n{saved}"
+        )
+        self.__logger.debug('Library rendered')
+
+    def __export_epubs(self, scope: str):
+        """
+        Write the EPUB of saved stories, in parallel
+
+        :param scope: 'stories' for the selected stories, 'series' for all the
+                      stories of the series of the selected stories, 'site'
+                      for all the stories of the selected site
+        """
+        self.__logger.info(f'Exporting EPUBs ({scope})')
+
+        if scope == 'site':
+            urls = [story[0] for story in self.__index.stories_by_site(
+                self.__selected_site.get()
+            )]
+        elif scope == 'series':
+            urls = []
+            series = set()
+            for url in self.__selected_stories:
+                if url in self.__index:
+                    series.add(self.__index.get(url)[13])
+            for name in sorted(series - {''}):
+                urls += self.__index.urls_by_series(name)
+        else:
+            urls = list(self.__selected_stories)
+
+        def progress(done: int, total: int):
+            self.__master.title(f'{cst.APP_NAME} | EPUB {done:,}/{total:,}')
+            self.__master.update()
+
+        paths = ew.write_epubs(self.__database, urls, progress)
+
+        for i, url in enumerate(self.__selected_stories):
+            if url in paths:
+                if paths[url] is None:
+                    self.__selected_var[i] = f'EPUB failed | {url}'
+                else:
+                    self.__selected_var[i] = f'EPUB written | {url}'
+                self.__update_display(i)
+
+        self.__master.title(cst.APP_NAME)
+        failed = sum(path is None for path in paths.values())
+        mb.showinfo(
+            message=f'{len(paths) - failed:,} EPUBs written in '
+                    f'"{cst.EPUB_FOLDER}", {failed:,} failed (see the logs).'
+        )
+        self.__logger.debug('EPUBs exported')
+
+    def __check_library(self):
+        """
+        Check that the database and the files of the library agree and, if the
+        user wants it, repair what is wrong
+        """
+        self.__logger.info('Checking the library')
+
+        def progress(done: int, total: int):
+            self.__master.title(f'{cst.APP_NAME} | Checking {done:,}/{total:,}')
+            self.__master.update()
+
+        plan = itg.check_library(self.__database, progress)
+        self.__master.title(cst.APP_NAME)
+
+        if plan.is_empty():
+            mb.showinfo(message='Nothing to repair in the library.')
+            self.__logger.debug('Nothing to repair')
+            return
+
+        # What is deleted is shown first: a directory which is not a story's
+        # must not be lost without the user knowing it
+        deleted = plan.deleted_paths()
+        shown = cst.INTEGRITY_SHOWN_PATHS
+        paths = '\n'.join(deleted[:shown])
+        if len(deleted) > shown:
+            paths += f'\n... and {len(deleted) - shown:,} more (see the logs)'
+        if len(deleted) != 0:
+            paths = f'\n\nDeleted:\n{paths}'
+
+        if not mb.askyesno(title='Repair the library ?',
+                           message=f'{plan}{paths}\n\nRepair the library ?'):
+            self.__logger.debug('Repair cancelled')
+            return
+
+        def progress(done: int, total: int):
+            self.__master.title(
+                f'{cst.APP_NAME} | Repairing {done:,}/{total:,}'
+            )
+            self.__master.update()
+
+        failed = itg.repair(self.__database, plan, progress)
+
+        self.__master.title(cst.APP_NAME)
+        mb.showinfo(message=f'Library repaired, {len(failed):,} stories could '
+                            f'not be repaired (see the logs).')
+        self.__update_selectable_display()
+        self.__logger.debug('Library checked')
+
+    def __rebuild_database(self):
+        """
+        Add to the database the stories saved in the library but missing from
+        it, using their informations files
+        """
+        self.__logger.info('Rebuilding the database')
+
+        def progress(done: int, total: int):
+            self.__master.title(
+                f'{cst.APP_NAME} | Rebuilding {done:,}/{total:,}'
+            )
+            self.__master.update()
+
+        summary = lb.rebuild_database(self.__database, progress)
+
+        self.__master.title(cst.APP_NAME)
+        mb.showinfo(
+            message=f"{summary['stories']:,} stories found, "
+                    f"{summary['added']:,} added to the database and "
+                    f"{summary['failed']:,} could not be read (see the logs)."
+        )
+        self.__update_selectable_display()
+        self.__logger.debug('Database rebuilt')
+
+    def __synchronize(self):
+        """
+        Bring the library up to date with another one, either a save folder or
+        the address of the reading server of another computer
+        """
+        self.__logger.info('Synchronizing the library')
+
+        source = sd.askstring(
+            title='Synchronize',
+            prompt='Save folder or reading server address (http://...) of '
+                   'the other library:',
+            parent=self.__master
+        )
+        if not source:
+            self.__logger.debug('Synchronization cancelled')
+            return
+
+        def progress(done: int, total: int):
+            self.__master.title(
+                f'{cst.APP_NAME} | Synchronizing {done:,}/{total:,}'
+            )
+            self.__master.update()
+
+        try:
+            if re.match(r'https?://', source) is not None:
+                peer = sy.HttpPeer(source)
+            else:
+                peer = sy.DirectoryPeer(source)
+            try:
+                summary = sy.pull(self.__database, peer, progress)
+            finally:
+                peer.close()
+        except (urllib.error.URLError, OSError, ValueError,
+                sql.DatabaseError) as err:
+            self.__logger.error(f'Synchronization failed: {err}')
+            mb.showerror(message=f'The synchronization failed: {err}')
+            return
+        finally:
+            self.__master.title(cst.APP_NAME)
+
+        mb.showinfo(
+            message=f"{summary['stories']:,} stories synchronized: "
+                    f"{summary['files']:,} files and {summary['texts']:,} "
+                    f"stored texts transferred ({summary['bytes']:,} bytes) "
+                    f"and {summary['deleted']:,} files deleted. "
+                    f"{summary['rejected']:,} stories rejected and "
+                    f"{summary['failed']:,} failed (see the logs)."
+        )
+        self.__update_selectable_display()
+        self.__logger.debug('Library synchronized')
+
+    def __read_in_browser(self):
+        """
+        Open the library in the browser, through the reading server which is
+        started the first time. Chapters not downloaded yet are fetched when
+        they are read
+        """
+        self.__logger.info('Opening the library in the browser')
+
+        if self.__server is None:
+            try:
+                self.__server = rs.start_server(host=self.__bind_address)
+            except OSError as err:
+                self.__logger.error(f'Could not start the server: {err}')
+                mb.showerror(message=f'The reading server could not be '
+                                     f'started: {err}')
+                return
+
+        # The server may only listen on the address of the local network
+        host = self.__bind_address or cst.READING_SERVER_HOST
+        webbrowser.open(f'http://{host}:{cst.READING_SERVER_PORT}/')
+        self.__logger.debug('Library opened')
 
     def __read_or_unread(self, mode: str):
         """
@@ -615,9 +1121,8 @@ class UI(tk.Frame):
         :param mode: 'read' or 'unread'
         """
         self.__logger.info(f'Marking selected stories as "{mode.title()}"')
-        urls = self.__database.get_column('url')
         for i, url in enumerate(self.__selected_stories):
-            if url not in urls:
+            if url not in self.__index:
                 self.__selected_var[i] = 'COULD NOT MARK AS {} | {}'.format(
                     mode.upper(),
                     url
@@ -641,40 +1146,47 @@ class UI(tk.Frame):
         """
         self.__logger.info('Adding selected stories to a series')
 
-        # Get the already existing series from the database
-        existing_series = self.__database.get_column('series', True)
+        # Get the already existing series
+        existing_series = self.__index.values('series')
 
         def series_box_command():
 
             series = series_var.get()
             series_box.selection_clear()
 
-            urls = self.__database.get_column('url')
+            # The stories to add, by their index in the selected stories
+            added = {}
             for i, url in enumerate(self.__selected_stories):
 
                 # Ensure the url exists in the database
-                if url not in urls:
-                    self.__selected_var[i] = f'NON DOWNLOADED STORY | {url}'
+                if url not in self.__index:
+                    self.__selected_var[i] = f'NON DOWNLOADED STORY | {url}'
                     self.__logger.error(f'"{url}" not present in database')
                     continue
 
                 # Check if the url is already present in the series
-                urls_in_series = self.__database.get_urls_by_series(series)
-                if url in urls_in_series:
+                if self.__index.get(url)[13] == series:
                     self.__selected_var[i] = f"Already in '{series}' | {url}"
                     self.__logger.info(f'"{url} already in "{series}"')
                     continue
 
-                # The position in the series
-                pos = 0 if series == '' else len(urls_in_series) + 1
+                added[i] = url
 
-                # Update all the relevant informations
-                self.__database.update_by_url('series', series, url)
-                self.__database.update_by_url('position', pos, url)
+            # Update all the relevant informations, the positions following
+            # the order of the stories
+            if series == '':
+                self.__database.remove_from_series(added.values())
+                positions = dict.fromkeys(added.values(), 0)
+            else:
+                positions = self.__database.add_to_series(series,
+                                                          added.values())
+
+            for i, url in added.items():
+                pos = positions[url]
                 self.__selected_var[i] = f"Added to '{series}' in {pos} | {url}"
                 self.__logger.info(f'Added "{url}" in "{series}", n° {pos}')
 
-                self.__update_display(i)
+            self.__update_display(max(added, default=0))
 
         def series_entry_command():
 
@@ -741,6 +1253,74 @@ class UI(tk.Frame):
         series_entry.pack(fill=tk.Y, expand=tk.YES, anchor=tk.CENTER)
         series_box.pack(fill=tk.Y, expand=tk.YES, anchor=tk.CENTER)
 
+    def __rename_series(self):
+        """
+        Allow the user to rename a series, its stories keeping their position
+        """
+        def rename_command():
+
+            series = series_var.get()
+            new_name = entry_var.get().strip()
+
+            if series == '':
+                self.__logger.error('No series to rename selected')
+            elif new_name == '' or new_name in existing_series:
+                self.__logger.error(f'"{series}" cannot be renamed to '
+                                    f'"{new_name}"')
+            else:
+                self.__logger.info(f'Renaming "{series}" to "{new_name}"')
+                self.__database.rename_series(series, new_name)
+                existing_series.remove(series)
+                existing_series.append(new_name)
+                existing_series.sort()
+                series_box['values'] = existing_series
+                series_var.set(new_name)
+                entry_var.set('')
+                self.__logger.info('Series renamed')
+
+                self.__update_selectable_display()
+
+        # Remove the '' series (no series) option from the choice
+        existing_series = sorted(set(self.__index.values('series')) - {''})
+
+        # Ensure there is only one extra window open
+        for window in self.__top_levels:
+            window.destroy()
+
+        # Creating a new window
+        window = tk.Toplevel(self.__master)
+        window.title('Renaming series')
+
+        self.__top_levels.append(window)
+
+        # Ensure there is something to work with
+        if len(existing_series) == 0:
+            tk.Label(window, text='No series to rename').pack()
+            return
+
+        # Creating the combobox to select the series
+        series_var = tk.StringVar()
+        series_box = ttk.Combobox(window,
+                                  textvariable=series_var,
+                                  state='readonly')
+        series_box['values'] = existing_series
+
+        # Creating the part to enter the new name
+        l_frame = tk.LabelFrame(window, text='New name')
+
+        entry_var = tk.StringVar()
+        series_entry = tk.Entry(l_frame, textvariable=entry_var)
+        series_entry.bind('<Return>', lambda _: rename_command())
+
+        rename_button = tk.Button(window,
+                                  text='Rename selected series',
+                                  command=rename_command)
+
+        series_box.pack(fill=tk.Y, expand=tk.YES, anchor=tk.CENTER)
+        l_frame.pack(fill=tk.Y, expand=tk.YES)
+        series_entry.pack(fill=tk.Y, expand=tk.YES, anchor=tk.CENTER)
+        rename_button.pack(anchor=tk.CENTER)
+
     def __delete_series(self):
         """
         Allow the user to delete a series. Do not delete the associated stories
@@ -752,17 +1332,15 @@ class UI(tk.Frame):
 
             self.__logger.info(f'Deleting series "{series}"')
 
-            for url in self.__database.get_urls_by_series(series):
-                self.__database.update_by_url('series', '', url)
-                self.__database.update_by_url('position', 0, url)
+            self.__database.delete_series(series)
 
             self.__logger.info('Series deleted')
 
             self.__update_selectable_display()
 
-        # Get the already existing series from the database
+        # Get the already existing series
         # Remove the '' series (no series) option from the choice
-        existing_series = sorted(self.__database.get_column('series', True))[1:]
+        existing_series = sorted(set(self.__index.values('series')) - {''})
 
         # Ensure there is only one extra window open
         for window in self.__top_levels:
@@ -797,22 +1375,102 @@ class UI(tk.Frame):
         series_box.pack(fill=tk.Y, expand=tk.YES, anchor=tk.CENTER)
         delete_button.pack(anchor=tk.CENTER)
 
-    def __color_selectable_listbox(self, story) -> str:
+    def __search(self):
+        """
+        Allow the user to search the library: the stories by their title,
+        author and summary, then the texts of the chapters if they are indexed
+        (see constants.SEARCH_CHAPTERS). The stories found are selected by
+        double clicking them
+        """
+        # The url of the story of each result displayed
+        results = []
+
+        def search_command():
+
+            searched = search_var.get()
+            self.__logger.info(f'Searching for "{searched}"')
+
+            results.clear()
+            labels = []
+            for url, extract in self.__database.search_stories(searched):
+                story = self.__index.get(url)
+                if story is not None:
+                    results.append(url)
+                    labels.append(f'{story[4]} by {story[3]} | {extract}')
+
+            for url, number, content_hash in self.__database.search_chapters(
+                    searched):
+                story = self.__index.get(url)
+                if story is None:
+                    continue
+                try:
+                    text = tls.html_to_text(self.__store.get(content_hash))
+                except FileNotFoundError:
+                    text = ''
+                results.append(url)
+                labels.append(f'{story[4]}, chapter {number} | '
+                              f'{tls.snippet(text, searched)}')
+
+            tmp_var = tk.StringVar(value=labels)
+            results_box['listvariable'] = tmp_var
+            del labels, tmp_var
+            self.__logger.debug(f'{len(results)} results')
+
+        def select_command():
+
+            selected = set(self.__selected_stories)
+            for i in results_box.curselection():
+                story = self.__index.get(results[i])
+                if story is None or story[0] in selected:
+                    continue
+                selected.add(story[0])
+                self.__selected_stories.append(story[0])
+                self.__selected_var.append(f'{story[4]} | {story[0]}')
+                self.__logger.info(f'Selecting: "{story[0]}"')
+
+            results_box.selection_clear(0, 'end')
+            self.__update_selected_display()
+            self.__update_selectable_display()
+
+        # Ensure there is only one extra window open
+        for window in self.__top_levels:
+            window.destroy()
+
+        # Creating a new window
+        window = tk.Toplevel(self.__master)
+        window.title('Searching the library')
+
+        self.__top_levels.append(window)
+
+        search_var = tk.StringVar()
+        search_entry = tk.Entry(window, textvariable=search_var)
+        search_entry.bind('<Return>', lambda _: search_command())
+
+        results_box = tk.Listbox(window, selectmode='extended', width=100)
+        results_box.bind('<Double-1>', lambda _: select_command())
+        results_box.bind('<Return>', lambda _: select_command())
+
+        search_entry.pack(fill=tk.X)
+        results_box.pack(fill=tk.BOTH, expand=tk.YES)
+        search_entry.focus_set()
+
+    def __color_selectable_listbox(self, story, selected: set) -> str:
         """
         :param story: the list representation of a story (coming from the
         database)
+        :param selected: the urls of the selected stories
         :return: the appropriate color for the situation
         """
         self.__logger.debug('Choosing appropriate color')
 
-        series = story[-2] != ''
+        series = story[13] != ''
 
         # If the story is selected, don't change it's color
-        if story[0] in self.__selected_stories:
+        if story[0] in selected:
             return cst.SELECTED_COLOR
 
         # If the story has been read and is in a series (or not, for either)
-        if story[-3] == 1:
+        if story[12] == 1:
             return cst.SERIES_READ_COLOR if series else cst.READ_COLOR
         else:
             return cst.SERIES_UNREAD_COLOR if series else cst.UNREAD_COLOR
@@ -853,7 +1511,14 @@ class UI(tk.Frame):
         self.__logger.debug(f'Selectable display: "{site}" by "{sort_option}"')
 
         # Prepare the stories
-        self.__selectable_stories = self.__database.get_stories_by_site(site)
+        if any(len(values) != 0 for values in self.__facet_selection.values()):
+            stories = (self.__index.get(url) for url in
+                       self.__facets.urls(site, self.__facet_selection))
+            # A story deleted in between is not indexed anymore
+            self.__selectable_stories = [story for story in stories
+                                         if story is not None]
+        else:
+            self.__selectable_stories = self.__index.stories_by_site(site)
         # Sort the stories
         text = self.__sort_stories(sort_option)
 
@@ -862,12 +1527,13 @@ class UI(tk.Frame):
         colors = []
 
         self.__logger.debug('Selectable display: setup-ing text')
+        selected = set(self.__selected_stories)
         for story in self.__selectable_stories:
             # The series part is adaptable
             series = f'[{story[13]}: {story[14]}]' if story[13] != '' else ''
 
             labels.append(text.format(story=story, series=series))
-            colors.append(self.__color_selectable_listbox(story))
+            colors.append(self.__color_selectable_listbox(story, selected))
         self.__logger.debug('Selectable display: text done')
 
         # Update the values and their colors without moving the position in the
@@ -880,8 +1546,45 @@ class UI(tk.Frame):
         self.__logger.debug('Selectable display: coloring done')
 
         del labels, tmp_var, colors
+        self.__update_facet_display()
         self.__master.update()
 
+    def __update_facet_display(self):
+        """
+        Update the display of the filter: the values of the selected facet
+        for the stories matching the other facets, with their number of stories
+        """
+        site = self.__selected_site.get()
+        facet = self.__selected_facet.get()
+        selected = self.__facet_selection[facet]
+        counts = self.__facets.counts(site, facet, self.__facet_selection)
+
+        # The values selected stay displayed, to be deselected, even without
+        # stories anymore
+        missing = selected - {value for value, _ in counts}
+        counts = [(value, 0) for value in missing] + counts
+        self.__facet_values = [value for value, _ in counts]
+
+        labels = []
+        for value, count in counts:
+            if value is None:
+                label = 'Unknown'
+            elif facet == 'Read':
+                label = 'Read' if value == 1 else 'Unread'
+            elif facet == 'Series' and value == '':
+                label = 'No series'
+            else:
+                label = value
+            labels.append(f'{label} ({count})')
+
+        tmp_var = tk.StringVar(value=labels)
+        self.__facet_listbox['listvariable'] = tmp_var
+        self.__facet_listbox.selection_clear(0, 'end')
+        for i, value in enumerate(self.__facet_values):
+            if value in selected:
+                self.__facet_listbox.selection_set(i)
+        del labels, tmp_var
+
     def __update_selected_display(self):
         """
         Update the display for the right listbox: the selected stories
@@ -2,6 +2,7 @@ __version__ = '2018.07.13'
 __author__ = 'Alexis BOURGET'
 
 import re
+import datetime
 
 import utilities.tools as tls
 
@@ -13,11 +14,13 @@ class FFN(st.Story):
     """
     Represent a story coming from the fanfiction.net website.
     """
+    # The directory of the site's stories, in the save folder
+    # Same as the site but it's not required
+    relative_path = 'fanfiction.net'
+
     def __init__(self, url: str):
 
         self.site = 'fanfiction.net'
-        # Same as self.site but it's not required
-        self.relative_path = 'fanfiction.net'
 
         # Numerical id used to identify stories at fanfiction.net
         self.__num_id = url.split('/')[4]
@@ -182,14 +185,122 @@ class FFN(st.Story):
 
     def get_chapter(self, chapter_num: int) -> str:
 
+        return FFN.fetch_chapter(self.url, self.chapter_count, chapter_num)
+
+    @staticmethod
+    def fetch_chapter(url: str, chapter_count: int, num_chapter: int) -> str:
+
+        # The url is https://www.fanfiction.net/s/{num_id}/1/
         page = tls.get_page(
-            f'https://www.fanfiction.net/s/{self.__num_id}/{chapter_num}/'
+            f'https://www.fanfiction.net/s/{url.split("/")[4]}/{num_chapter}/'
         ).replace('noshade>', 'noshade/>')
 
         page = ffn_cst.CHAP_BEGINNING + page.split(ffn_cst.CHAP_BEGINNING, 1)[1]
-        if self.chapter_count > 1:
+        if chapter_count > 1:
             page = page.split(ffn_cst.CHAP_END_MANY, 1)[0]
         else:
             page = page.split(ffn_cst.CHAP_END_ONE, 1)[0]
 
         return page
+
+    @staticmethod
+    def parse_tokens(tokens: str) -> dict:
+
+        # The curated tokens are made from the tokens before the status was
+        # inserted
+        raw_tokens = tokens.replace('- In Progress - id:', '- id:')
+        return {
+            'word_count': FFN.__get_words_count(tokens),
+            'status': FFN.__get_status(tokens),
+            'language': tokens.split(' - ')[1],
+            'curated_tokens': FFN.__get_curated_tokens(raw_tokens),
+        }
+
+    @staticmethod
+    def parse_details(tokens: str) -> dict:
+        """
+        The tokens are like 'Rated: Fiction T - English - Romance/Drama -
+        [Harry P., Hermione G.] Ron W. - Chapters: 12 - Words: 100,000 -
+        Reviews: 500 - Favs: 1,000 - Follows: 800 - Updated: 7/1/2018 -
+        Published: 1/1/2017 - Status: Complete - id: 123456', the genres, the
+        characters and most values being optional
+        """
+        details = st.Story.parse_details(tokens)
+        parts = tokens.split(' - ')
+
+        details['rating'] = re.sub(ffn_cst.RE_RATING_PREFIX,
+                                   '',
+                                   parts[0]).strip() or None
+
+        values = {}
+        for part in parts[2:]:
+            value = re.fullmatch(ffn_cst.RE_TOKEN_VALUE, part)
+            if value is not None:
+                values[value.group(1)] = value.group(2)
+            # The genres and characters are before the values, only the status
+            # can come after
+            elif len(values) != 0:
+                continue
+            elif re.fullmatch(ffn_cst.RE_GENRES, part) is not None:
+                details['genres'] = part
+            else:
+                details['characters'] = FFN.__parse_characters(part)
+
+        for detail, key in (('reviews', 'Reviews'), ('favorites', 'Favs')):
+            if key in values:
+                details[detail] = int(values[key].replace(',', ''))
+        for detail, key in (('published', 'Published'), ('updated', 'Updated')):
+            if key in values:
+                details[detail] = FFN.__parse_date(values[key])
+
+        return details
+
+    @staticmethod
+    def __parse_characters(text: str) -> list:
+        """
+        :param text: the characters part of the tokens, like
+                     '[Harry P., Hermione G.] Ron W.'
+        :return: the characters as (name, pairing), see
+                 `Story.parse_details()`
+        """
+        characters = []
+        for pairing, names in enumerate(re.findall(ffn_cst.RE_PAIRING, text),
+                                        1):
+            characters.extend((name.strip(), pairing)
+                              for name in names.split(',') if name.strip())
+        for name in re.sub(ffn_cst.RE_PAIRING, ',', text).split(','):
+            if name.strip():
+                characters.append((name.strip(), 0))
+        return characters
+
+    @staticmethod
+    def __parse_date(text: str):
+        """
+        :param text: a date of the tokens
+        :return: the date as YYYY-MM-DD, or None if it cannot be understood
+        """
+        today = datetime.date.today()
+        date = re.fullmatch(ffn_cst.RE_DATE, text)
+        if date is None:
+            if re.fullmatch(ffn_cst.RE_RECENT_DATE, text) is not None:
+                return today.isoformat()
+            return None
+
+        month, day, year = date.groups()
+        try:
+            # The year is omitted for the current one
+            return datetime.date(int(year or today.year),
+                                 int(month),
+                                 int(day)).isoformat()
+        except ValueError:
+            return None
+
+    @staticmethod
+    def sanitize_chapter(chapter_text: str) -> str:
+        """
+        The beginning of the chapter is the (never closed) container of the
+        text on the site
+        """
+        if chapter_text.startswith(ffn_cst.CHAP_BEGINNING):
+            chapter_text = chapter_text[len(ffn_cst.CHAP_BEGINNING):]
+        return st.Story.sanitize_chapter(chapter_text)
@@ -48,3 +48,25 @@ CHAP_END_MANY = ("</div><div style='height:5px'></div>"
 
 # To cut at the end of the html for one chapter.
 CHAP_END_ONE = "</div><div style='height:5px'></div>\n<script>"
+
+# The genres a story can have, to tell them apart from the characters in the
+# tokens
+_GENRES = ('Adventure|Angst|Crime|Drama|Family|Fantasy|Friendship|General|'
+           'Horror|Humor|Hurt/Comfort|Mystery|Parody|Poetry|Romance|Sci-Fi|'
+           'Spiritual|Supernatural|Suspense|Tragedy|Western')
+RE_GENRES = rf'(?:{_GENRES})(?:/(?:{_GENRES}))*'
+
+# To remove what comes before the rating itself, like in 'Rated: Fiction T'
+RE_RATING_PREFIX = r'^(?:Rated: )?(?:Fiction )?'
+
+# To get a value of the tokens, like 'Reviews: 1,234'
+RE_TOKEN_VALUE = r'(\w+): (.*)'
+
+# To get the characters paired together, like in '[Harry P., Hermione G.]'
+RE_PAIRING = r'\[(.*?)\]'
+
+# To get a date of the tokens: 7/1/2018, or 7/1 for the current year
+RE_DATE = r'(\d+)/(\d+)(?:/(\d+))?'
+
+# A date of the tokens less than a day ago, like '3h' or '25m'
+RE_RECENT_DATE = r'\d+[hms](?: ago)?'
@@ -1,6 +1,9 @@
 __version__ = '2018.06.28'
 __author__ = 'Alexis BOURGET'
 
+import utilities.tools as tls
+import utilities.constants as cst
+
 
 class Story:
     """
@@ -14,7 +17,9 @@ class Story:
           a key in the `constants.SITES` dictionary
         :param str url: the url to the relevant web page for the story
         :param str relative_path: name of the folder containing the story's
-          directory. **Should be lower_case**
+          directory. **Should be lower_case**. It is a class attribute: the
+          save folder is scanned without any story (see
+          `storage.story_folders()`)
         :param str story_dir: name of the folder containing the story itself.
           **Should be lower_case**
         :param str author: name of the author
@@ -45,7 +50,7 @@ class Story:
 
         # URL of the story (first chapter of index, depending on the site)
         self.url = url
-        # Path to the story directory from the base directory
+        # Path to the story directory from the base directory, set by the class
         self.relative_path: str
         # Directory containing the story
         self.story_dir: str
@@ -134,3 +139,78 @@ class Story:
         chapter, see constants.CHAPTER_TEMPLATE
         """
         raise NotImplementedError
+
+    @staticmethod
+    def fetch_chapter(url: str, chapter_count: int, num_chapter: int) -> str:
+        """
+        Fetch a chapter of a story without fetching anything else, so the
+        chapters of a story already saved can be written from its row in the
+        database (see `library.LocalStory`)
+
+        :param url: the url of the story (`self.url`)
+        :param chapter_count: the number of chapters in the story
+        :param num_chapter: the number of the chapter wanted
+        :return: the text of the chapter, as returned by `.get_chapter()`
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def sanitize_chapter(chapter_text: str) -> str:
+        """
+        Remove from the text of a chapter the markup which is only the site's
+        presentation (inline styles, redundant attributes, ...) while keeping
+        everything needed to read it as intended.
+
+        It is applied each time a chapter is written, not when it is fetched:
+        the text returned by `get_chapter()` is stored as it is, so improving
+        this method only needs the library to be rendered again.
+
+        By default, `tools.sanitize_html()` is used. Override it to remove the
+        site's own markup first, see ffn_net.py for an example
+
+        :param chapter_text: the text returned by `get_chapter()`
+        :return: the text to write
+        """
+        return tls.sanitize_html(chapter_text)
+
+    @staticmethod
+    def parse_tokens(tokens: str) -> dict:
+        """
+        Find back the properties of a story contained in its tokens, as they
+        are written in its informations file. Used to rebuild the database
+        without fetching anything
+
+        :param tokens: the tokens of the story (`self.tokens`)
+        :return: the 'word_count', 'status', 'language' and 'curated_tokens' of
+                 the story
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def parse_details(tokens: str) -> dict:
+        """
+        Find the details of a story in its tokens as typed values, so they can
+        be saved in their own columns and filtered on. It must accept the
+        curated tokens too (they are all there is for the stories saved before
+        the details existed): what cannot be found is None.
+
+        By default, nothing is found. See ffn_net.py for an example
+
+        :param tokens: the tokens of the story (`self.tokens`), or its curated
+                       tokens
+        :return: the 'rating', the 'genres' (separated by '/'), the
+                 'published' and 'updated' dates (as YYYY-MM-DD), the number
+                 of 'reviews' and 'favorites' (see constants.STORY_DETAILS)
+                 and the 'characters' as (name, pairing): the characters
+                 paired together share the same pairing number, the others
+                 have 0
+        """
+        details = dict.fromkeys(cst.STORY_DETAILS)
+        details['characters'] = []
+        return details
+
+    def get_details(self) -> dict:
+        """
+        :return: the details of the story, see `.parse_details()`
+        """
+        return self.parse_details(self.tokens)
@@ -13,10 +13,12 @@ class UHP(st.Story):
     """
     Represent a story coming from the ultimatehpfanfiction.com website
     """
+    # The directory of the site's stories, in the save folder
+    relative_path = 'uhp-fanfiction'
+
     def __init__(self, url: str):
 
         self.site = 'ultimatehpfanfiction.com'
-        self.relative_path = 'uhp-fanfiction'
 
         # Get the important parts of the URL
         parts = url.split('/')[3:]
@@ -56,12 +58,8 @@ class UHP(st.Story):
             parts = result.group(1).split('/')[1:]
             if pos == parts[2]:
 
-                # Used to access the chapters
-                self.__chapter_link = (
-                    f'{self.url}/{pos}/CHAPTER_NUM/{"/".join(parts[4:])}'
-                )
-
-                # Ensure the URL is unique
+                # Ensure the URL is unique, the 0 being replaced by the number
+                # of a chapter to access it
                 self.url = f'{self.url}/{pos}/0/{"/".join(parts[4:])}'
 
                 self.chapter_count = int(parts[-1])
@@ -99,12 +97,56 @@ class UHP(st.Story):
 
     def get_chapter(self, num_chapter: int) -> str:
 
-        page = tls.get_page(
-            self.__chapter_link.replace('CHAPTER_NUM', str(num_chapter))
-        )
+        return UHP.fetch_chapter(self.url, self.chapter_count, num_chapter)
+
+    @staticmethod
+    def fetch_chapter(url: str, chapter_count: int, num_chapter: int) -> str:
+
+        # The url is https://www.ultimatehpfanfiction.com/{a}/{b}/{pos}/0/...
+        parts = url.split('/')
+        parts[6] = str(num_chapter)
+        page = tls.get_page('/'.join(parts))
 
         # Remove the parts of the page that are not the chapter itself
         page = re.split(uhp_cst.CHAP_BEGINNING, page)[1]
         page = re.split(uhp_cst.CHAP_END, page)[0]
 
         return page
+
+    @staticmethod
+    def parse_tokens(tokens: str) -> dict:
+
+        # The tokens are '{curated_tokens} - Words: {word_count:,}'
+        curated_tokens, word_count = tokens.rsplit(' - Words: ', 1)
+        return {
+            'word_count': int(word_count.replace(',', '')),
+            'status': 'Complete',
+            'language': 'English',
+            'curated_tokens': curated_tokens,
+        }
+
+    @staticmethod
+    def parse_details(tokens: str) -> dict:
+        """
+        The curated tokens are '{timeline} - {characters}', the characters
+        being separated by '/' like in a pairing, and the tokens add
+        ' - Words: {word_count:,}' to them
+        """
+        details = st.Story.parse_details(tokens)
+        curated_tokens = tokens.rsplit(' - Words: ', 1)[0]
+        if ' - ' not in curated_tokens:
+            return details
+
+        names = [name for name in curated_tokens.rsplit(' - ', 1)[1].split('/')
+                 if name != '']
+        pairing = 1 if len(names) > 1 else 0
+        details['characters'] = [(name, pairing) for name in names]
+        return details
+
+    @staticmethod
+    def sanitize_chapter(chapter_text: str) -> str:
+        """
+        The paragraphs are indented with runs of non-breaking spaces
+        """
+        chapter_text = re.sub(uhp_cst.RE_INDENTATION, r'\1', chapter_text)
+        return st.Story.sanitize_chapter(chapter_text)
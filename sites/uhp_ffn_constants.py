@@ -20,3 +20,6 @@ CHAP_BEGINNING = (r"<h1 class='center'>.* - .*</h1>"
 
 # To cut at the end of the chapter by deleting what comes after it
 CHAP_END = r"</div><span class='.*?'><a href='.*?'>"
+
+# To remove the indentation at the beginning of the paragraphs
+RE_INDENTATION = r'(<p[^>]*>|<br\s*/?>)\s*(?:&nbsp;\s*)+'
@@ -0,0 +1,122 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import os
+import tempfile
+import unittest
+
+import utilities.constants as cst
+import utilities.data_handler as dh
+import utilities.database_writer as dw
+import utilities.story_writer as sw
+
+import sites.story as st
+
+# The site of the stories of the tests, never reached
+SITE = 'fake.example'
+# The database of the library, from the save folder
+DATABASE = '0/data/ffndl_database.db'
+
+
+class FakeStory(st.Story):
+    """
+    A story whose url is https://fake.example/{number}. Its chapters are made
+    up, and each of them fetched is counted in `FakeStory.fetched`
+    """
+    relative_path = SITE
+    # The number of chapters of the stories built from now on
+    chapter_count = 3
+    # The chapters fetched, as (url, number)
+    fetched = []
+
+    def __init__(self, url: str):
+
+        super(FakeStory, self).__init__(url)
+        self.__number = url.rsplit('/', 1)[1]
+
+        self.site = SITE
+        self.story_dir = f'story_{self.__number}'
+        self.author = 'Author'
+        self.title = f'Story {self.__number}'
+        self.chapter_count = FakeStory.chapter_count
+        self.chapters = [f'Chapter {i}'
+                         for i in range(1, self.chapter_count + 1)]
+        self.word_count = 1000 * self.chapter_count
+        self.status = 'Complete'
+        self.language = 'English'
+        self.universe = 'Universe'
+        self.tokens = 'Rated: T - English - Complete'
+        self.curated_tokens = 'T - English'
+        self.summary = f'The summary of story {self.__number}'
+
+    def get_informations_title(self) -> str:
+        return f'story-{self.__number}'
+
+    def get_author(self) -> str:
+        return self.author
+
+    def get_universe(self) -> str:
+        return self.universe
+
+    def get_chapter(self, num_chapter: int) -> str:
+        return FakeStory.fetch_chapter(self.url, self.chapter_count,
+                                       num_chapter)
+
+    @staticmethod
+    def fetch_chapter(url: str, chapter_count: int, num_chapter: int) -> str:
+        FakeStory.fetched.append((url, num_chapter))
+        return f'<p>Chapter {num_chapter} of {url}.</p>\n' * 20
+
+
+class LibraryTestCase(unittest.TestCase):
+    """
+    Each test runs in its own empty library, in a temporary directory which
+    is the current working directory, with the stories of FakeStory
+    """
+    def setUp(self):
+
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(folder.name)
+        for name in cst.FOLDERS:
+            os.makedirs(name)
+
+        self.addCleanup(setattr, cst, 'PACKED_STORAGE', cst.PACKED_STORAGE)
+        cst.PACKED_STORAGE = False
+        cst.SITES[SITE] = (FakeStory, r'^https://fake\.example/')
+        self.addCleanup(cst.SITES.pop, SITE)
+        FakeStory.fetched = []
+
+        self.database = dh.DataHandler(DATABASE)
+        # Cleanups are done last in first out: the writer is stopped before
+        # the directory is deleted
+        self.addCleanup(dw.get_writer(DATABASE).close)
+        self.addCleanup(self.database.close)
+
+    def add_story(self, number: int, download=True,
+                  database=None) -> FakeStory:
+        """
+        :param number: the number of the story, in its url
+        :param download: whether the story is downloaded or only registered
+        :param database: the DataHandler of the library, if it is not the
+                         test's one (the story is saved in the current working
+                         directory)
+        :return: the story, added to the database
+        """
+        database = self.database if database is None else database
+        writer = sw.StoryWriter(database)
+        writer.set_url(f'https://fake.example/{number}')
+        database.add_story(writer.story)
+        if download:
+            writer.download()
+        writer.storage.close()
+        return writer.story
+
+    @staticmethod
+    def folder(story: FakeStory) -> str:
+        """
+        :param story: a story of the library
+        :return: its directory, ending with a '/'
+        """
+        return f'{story.relative_path}/{story.story_dir}/'.lower()
@@ -0,0 +1,220 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import os
+import sqlite3 as sql
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+import utilities.constants as cst
+import utilities.data_handler as dh
+import utilities.database_writer as dw
+
+
+class _Gate:
+    """
+    A parameter of a query which holds the writer's thread until it is
+    opened, so the writes asked for meanwhile wait together
+    """
+    def __init__(self):
+
+        self.reached = threading.Event()
+        self.opened = threading.Event()
+
+    def __conform__(self, protocol):
+
+        self.reached.set()
+        self.opened.wait(10)
+        return 0
+
+
+class DatabaseWriterTest(unittest.TestCase):
+    """
+    The writes are grouped in a single transaction, each in its own savepoint
+    """
+    def setUp(self):
+
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.path = os.path.join(folder.name, 'test.db')
+        self.writer = dw.DatabaseWriter(self.path)
+        self.addCleanup(self.writer.close)
+
+        self.statements = []
+        self.writer._DatabaseWriter__conn.set_trace_callback(
+            self.statements.append)
+        self.writer.write(
+            [('execute', 'CREATE TABLE test (value INT UNIQUE)', ())]
+        ).result(10)
+
+    def write_together(self, writes) -> list:
+        """
+        :param writes: the statements of each write
+        :return: the futures of the writes, asked for while the writer was
+                 held, once they are done
+        """
+        gate = _Gate()
+        held = self.writer.write(
+            [('execute', 'INSERT INTO test VALUES (?)', (gate,))])
+        self.assertTrue(gate.reached.wait(10))
+
+        del self.statements[:]
+        futures = [self.writer.write(statements) for statements in writes]
+        gate.opened.set()
+        self.assertEqual(held.result(10), 1)
+        for future in futures:
+            future.exception(10)
+        return futures
+
+    def values(self) -> list:
+        """
+        :return: the values committed in the test table, sorted
+        """
+        conn = sql.connect(self.path)
+        try:
+            return [row[0] for row in
+                    conn.execute('SELECT value FROM test ORDER BY value')]
+        finally:
+            conn.close()
+
+    def test_grouped_commits(self):
+
+        futures = self.write_together(
+            [('execute', 'INSERT INTO test VALUES (?)', (value,))]
+            for value in range(1, 11)
+        )
+
+        self.assertEqual([future.result() for future in futures], [1] * 10)
+        # The held write is committed alone, the others all together
+        self.assertEqual(self.statements.count('COMMIT'), 2)
+        self.assertEqual(self.values(), list(range(11)))
+
+    def test_savepoints(self):
+
+        futures = self.write_together((
+            [('execute', 'INSERT INTO test VALUES (?)', (1,))],
+            # Its first row is rolled back with the failing one
+            [('execute', 'INSERT INTO test VALUES (?)', (2,)),
+             ('execute', 'INSERT INTO test VALUES (?)', (1,))],
+            [('executemany', 'INSERT INTO test VALUES (?)', [(3,), (4,)])],
+        ))
+
+        self.assertEqual(futures[0].result(), 1)
+        self.assertIsInstance(futures[1].exception(), sql.IntegrityError)
+        self.assertEqual(futures[2].result(), 2)
+        self.assertEqual(self.statements.count('COMMIT'), 2)
+        self.assertEqual(self.values(), [0, 1, 3, 4])
+
+
+class MigrationTest(unittest.TestCase):
+    """
+    A database of the first version, with stories in series, is migrated to
+    the last version
+    """
+    FFN_URL = 'https://www.fanfiction.net/s/1/1/'
+    STORIES = (
+        (FFN_URL, 'fanfiction.net/a_1/a_informations.html',
+         'fanfiction.net', 'Author', 'A', 12, 100000, 'Complete', 'English',
+         'Harry Potter', 'A summary',
+         'Fiction T - English - Romance/Drama - [Harry P., Hermione G.] Ron W.',
+         1, 'Saga', 2),
+        ('https://www.fanfiction.net/s/2/1/',
+         'fanfiction.net/b_2/b_informations.html', 'fanfiction.net', 'Author',
+         'B', 3, 20000, 'In Progress', 'English', 'Star Wars', 'B summary',
+         'Fiction K - English - Humor', 0, 'Saga', 1),
+        ('https://www.fanfiction.net/s/3/1/',
+         'fanfiction.net/c_3/c_informations.html', 'fanfiction.net', 'Other',
+         'C', 1, 5000, 'Complete', 'French', 'Harry Potter', 'C summary',
+         'Fiction M - French', 0, '', 0),
+    )
+
+    def setUp(self):
+
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.path = os.path.join(folder.name, 'test.db')
+
+        conn = sql.connect(self.path)
+        for creation in (cst.STORIES_TABLE_CREATION,
+                         cst.CHAPTERS_TABLE_CREATION,
+                         cst.CHAPTERS_HASH_INDEX_CREATION):
+            conn.execute(creation)
+        conn.executemany(f'INSERT INTO stories VALUES ({",".join("?" * 15)})',
+                         self.STORIES)
+        conn.execute('INSERT INTO chapters VALUES (?,?,?,?,?,?,?)',
+                     (self.FFN_URL, 1, 'One', '', 100, None,
+                      cst.CHAPTER_COMPLETE))
+        conn.commit()
+        conn.close()
+
+    def open(self) -> dh.DataHandler:
+        """
+        :return: a DataHandler only reading the test database
+        """
+        database = dh.DataHandler(self.path, read_only=True)
+        self.addCleanup(database.close)
+        return database
+
+    def test_migrations(self):
+
+        dw.DatabaseWriter(self.path).close()
+        database = self.open()
+
+        self.assertEqual(database.get_version(), len(cst.DATABASE_MIGRATIONS))
+        stories = {story[0]: story for story in database.get_stories()}
+        self.assertEqual(len(stories), 3)
+        for row in self.STORIES:
+            # The rows are read as they were, the details added at the end
+            self.assertEqual(stories[row[0]][:15], row)
+        self.assertEqual(stories[self.FFN_URL][15:],
+                         ('T', 'Romance/Drama', None, None, None, None))
+        self.assertEqual(database.get_characters(self.FFN_URL),
+                         [('Ron W.', 0), ('Harry P.', 1), ('Hermione G.', 1)])
+        self.assertEqual(database.get_urls_by_series('Saga'),
+                         ['https://www.fanfiction.net/s/2/1/', self.FFN_URL])
+        self.assertEqual(len(database.get_chapters(self.FFN_URL)), 1)
+
+        self.assertEqual(database.get_site_statistics('fanfiction.net'), {
+            'stories': 3,
+            'chapters': 16,
+            'words': 125000,
+            'read': 1,
+            'unread': 2,
+            'authors': 2,
+            'universes': 2,
+            'series': 1,
+        })
+
+    def test_failed_migration(self):
+
+        def fail(cur: sql.Cursor):
+            raise ValueError('Failed on purpose')
+
+        with unittest.mock.patch.dict(dw._MIGRATION_STEPS, {3: fail}):
+            with self.assertRaises(dw.MigrationError):
+                dw.DatabaseWriter(self.path)
+        self.assertFalse(dw.is_corrupted(self.path))
+
+        conn = sql.connect(self.path)
+        try:
+            # The migrations before it are kept, nothing of it is
+            self.assertEqual(
+                conn.execute('PRAGMA user_version').fetchone()[0], 2)
+            self.assertIsNone(conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name='chapters_search'"
+            ).fetchone())
+            self.assertEqual(
+                conn.execute('SELECT COUNT(*) FROM stories').fetchone()[0], 3)
+        finally:
+            conn.close()
+
+        # Done again the next time
+        dw.DatabaseWriter(self.path).close()
+        self.assertEqual(self.open().get_version(),
+                         len(cst.DATABASE_MIGRATIONS))
+
+
+if __name__ == '__main__':
+    unittest.main()
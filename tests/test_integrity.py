@@ -0,0 +1,108 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import os
+import shutil
+import unittest
+
+import utilities.chapter_store as cs
+import utilities.integrity as itg
+import utilities.storage as stg
+
+from tests.fake_library import FakeStory, LibraryTestCase
+
+
+class IntegrityTest(LibraryTestCase):
+    """
+    integrity.check_library() finds what the database, the files and the
+    chapter store disagree on, and integrity.repair() fixes it, only fetching
+    what is not stored
+    """
+    def setUp(self):
+
+        super(IntegrityTest, self).setUp()
+        self.story = self.add_story(1)
+        self.folder_1 = self.folder(self.story)
+        self.hashes = [chapter[2] for chapter in
+                       self.database.get_chapters(self.story.url)]
+        FakeStory.fetched = []
+
+    def check(self) -> itg.RepairPlan:
+        """
+        :return: the plan to repair the library
+        """
+        return itg.check_library(self.database, workers=2)
+
+    def test_healthy(self):
+
+        self.assertTrue(self.check().is_empty())
+
+    def test_render(self):
+
+        os.remove(f'{self.folder_1}2.html')
+        with open(f'{self.folder_1}3.html', 'a', encoding='utf-8') as f:
+            f.write('<p>Added</p>')
+
+        plan = self.check()
+        self.assertEqual(plan.render, {self.story.url: [2, 3]})
+        self.assertEqual(plan.fetch, {})
+
+        self.assertEqual(itg.repair(self.database, plan), [])
+        self.assertEqual(FakeStory.fetched, [])
+        self.assertTrue(self.check().is_empty())
+
+    def test_fetch_damaged(self):
+
+        store = cs.ChapterStore()
+        with open(store.path(self.hashes[1]), 'wb') as f:
+            f.write(b'Not a stored text')
+        os.remove(f'{self.folder_1}2.html')
+
+        plan = self.check()
+        self.assertEqual(plan.fetch, {self.story.url: [2]})
+        self.assertEqual(plan.damaged_texts, [self.hashes[1]])
+
+        self.assertEqual(itg.repair(self.database, plan), [])
+        self.assertEqual(FakeStory.fetched, [(self.story.url, 2)])
+        self.assertTrue(store.is_intact(self.hashes[1]))
+        self.assertTrue(self.check().is_empty())
+
+    def test_stale(self):
+
+        self.database.update_by_url('read', 1, self.story.url)
+        shutil.rmtree(self.folder_1)
+
+        plan = self.check()
+        self.assertEqual(plan.stale_stories, [self.story.url])
+        # Written again from the stored texts
+        self.assertEqual(plan.fetch, {self.story.url: []})
+        self.assertEqual(plan.render, {self.story.url: [1, 2, 3]})
+
+        self.assertEqual(itg.repair(self.database, plan), [])
+        self.assertEqual(FakeStory.fetched, [])
+        self.assertEqual(self.database.get_story(self.story.url)[12], 1)
+        self.assertTrue(self.check().is_empty())
+
+    def test_orphans(self):
+
+        os.makedirs(f'{FakeStory.relative_path}/unknown')
+        with open(f'{self.folder_1}notes.txt', 'w', encoding='utf-8') as f:
+            f.write('Notes')
+        orphan_text = cs.ChapterStore().add('<p>Used by no chapter</p>')
+
+        plan = self.check()
+        self.assertEqual(plan.orphan_folders,
+                         [f'{FakeStory.relative_path}/unknown/'])
+        self.assertEqual(plan.orphan_files, {self.folder_1: ['notes.txt']})
+        self.assertEqual(plan.orphan_texts,
+                         [cs.ChapterStore().path(orphan_text)])
+
+        self.assertEqual(itg.repair(self.database, plan), [])
+        self.assertFalse(os.path.exists(f'{FakeStory.relative_path}/unknown'))
+        self.assertFalse(stg.LooseStorage(self.folder_1).exists('notes.txt'))
+        self.assertFalse(cs.ChapterStore().has(orphan_text))
+        self.assertTrue(self.check().is_empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import unittest
+
+import utilities.storage as stg
+
+from tests.fake_library import LibraryTestCase
+
+
+class ConvertTest(LibraryTestCase):
+    """
+    storage.convert() moves the files of a story from one storage to the
+    other without changing them
+    """
+    def files(self, storage) -> dict:
+        """
+        :param storage: the storage of a story
+        :return: the content of each of its files, by name
+        """
+        try:
+            return {name: storage.read(name) for name in storage.names()}
+        finally:
+            storage.close()
+
+    def test_round_trip(self):
+
+        folder = self.folder(self.add_story(1))
+        loose = self.files(stg.LooseStorage(folder))
+        self.assertEqual(len(loose), 4)
+
+        stg.convert(folder, True)
+        self.assertFalse(stg.LooseStorage(folder).is_present())
+        self.assertIsInstance(stg.get_storage(folder), stg.PackedStorage)
+        self.assertEqual(self.files(stg.PackedStorage(folder)), loose)
+        self.assertEqual(stg.story_folders(), [folder])
+
+        stg.convert(folder, False)
+        self.assertFalse(stg.PackedStorage(folder).is_present())
+        self.assertEqual(self.files(stg.get_storage(folder)), loose)
+
+    def test_nothing_to_convert(self):
+
+        folder = self.folder(self.add_story(1))
+        with self.assertRaises(FileNotFoundError):
+            stg.convert(folder, False)
+        self.assertTrue(stg.LooseStorage(folder).is_present())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import os
+import unittest
+import contextlib
+
+import utilities.constants as cst
+import utilities.data_handler as dh
+import utilities.database_writer as dw
+import utilities.storage as stg
+import utilities.sync as sy
+
+from tests.fake_library import DATABASE, FakeStory, LibraryTestCase
+
+
+class PullTest(LibraryTestCase):
+    """
+    sync.pull() copies the stories which changed in another library, here a
+    DirectoryPeer, without fetching anything
+    """
+    def setUp(self):
+
+        super(PullTest, self).setUp()
+        self.root = os.path.abspath('other')
+        for name in cst.FOLDERS:
+            os.makedirs(os.path.join(self.root, name))
+
+        with self.in_other_library():
+            self.other = dh.DataHandler(DATABASE)
+            self.addCleanup(dw.get_writer(DATABASE).close)
+            self.addCleanup(self.other.close)
+            self.stories = [self.add_story(number, database=self.other)
+                            for number in (1, 2)]
+        FakeStory.fetched = []
+
+        self.peer = sy.DirectoryPeer(self.root)
+        self.addCleanup(self.peer.close)
+
+    @contextlib.contextmanager
+    def in_other_library(self):
+        """
+        Make the save folder of the other library the current working
+        directory, in the context
+        """
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        try:
+            yield
+        finally:
+            os.chdir(cwd)
+
+    def files(self, folder: str) -> dict:
+        """
+        :param folder: the directory of a story
+        :return: the content of each of its files, by name
+        """
+        storage = stg.get_storage(folder)
+        try:
+            return {name: storage.read(name) for name in storage.names()}
+        finally:
+            storage.close()
+
+    def assertSynchronized(self):
+        """
+        Check that both libraries have the same stories, chapters and files
+        """
+        self.assertEqual(sy.library_manifest(self.database),
+                         sy.library_manifest(self.other))
+        for story in self.stories:
+            folder = self.folder(story)
+            self.assertEqual(self.files(folder),
+                             self.files(os.path.join(self.root, folder)))
+
+    def test_pull(self):
+
+        summary = sy.pull(self.database, self.peer)
+
+        self.assertEqual(summary['stories'], 2)
+        self.assertEqual(summary['failed'], 0)
+        self.assertEqual(summary['files'], 8)
+        self.assertEqual(summary['texts'], 6)
+        self.assertEqual(FakeStory.fetched, [])
+        self.assertSynchronized()
+
+        # Nothing changed since
+        summary = sy.pull(self.database, self.peer)
+        self.assertEqual((summary['stories'], summary['files']), (0, 0))
+
+    def test_changed_story(self):
+
+        sy.pull(self.database, self.peer)
+        self.database.update_by_url('read', 1, self.stories[0].url)
+
+        FakeStory.chapter_count = 4
+        self.addCleanup(setattr, FakeStory, 'chapter_count', 3)
+        with self.in_other_library():
+            self.stories[0] = self.add_story(1, database=self.other)
+
+        summary = sy.pull(self.database, self.peer)
+        self.assertEqual(summary['stories'], 1)
+        # The informations file, the chapter added and the one before it,
+        # which now links to it
+        self.assertEqual(summary['files'], 3)
+        self.assertEqual(summary['texts'], 1)
+        # The read status belongs to each library
+        self.assertEqual(self.database.get_story(self.stories[0].url)[12], 1)
+        self.assertSynchronized()
+
+    def test_failed_story(self):
+
+        failing = self.folder(self.stories[1])
+        read = self.peer.read
+
+        def read_or_fail(folder: str, name: str) -> str:
+            if folder == failing:
+                raise ConnectionResetError('The connection was lost')
+            return read(folder, name)
+
+        self.peer.read = read_or_fail
+        summary = sy.pull(self.database, self.peer)
+
+        self.assertEqual((summary['stories'], summary['failed']), (1, 1))
+        self.assertIsNotNone(self.database.get_story(self.stories[0].url))
+        # Not saved: it is synchronized again the next time
+        self.assertIsNone(self.database.get_story(self.stories[1].url))
+
+        self.peer.read = read
+        summary = sy.pull(self.database, self.peer)
+        self.assertEqual((summary['stories'], summary['failed']), (1, 0))
+        self.assertSynchronized()
+
+
+if __name__ == '__main__':
+    unittest.main()
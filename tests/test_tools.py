@@ -0,0 +1,160 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import io
+import os
+import time
+import tempfile
+import unittest
+import tracemalloc
+
+import utilities.tools as tls
+import utilities.constants as cst
+
+
+class WriteTemplateTest(unittest.TestCase):
+    """
+    tools.write_template() must write exactly what `str.format` produces
+    """
+    def assertSameAsFormat(self, template: str, **values):
+        """
+        :param template: the 'format-able' template
+        :param values: the values of its fields. A list is given as a
+                       generator of its items to write_template() and joined
+                       for `str.format`
+        """
+        expected = template.format(**{
+            name: ''.join(value) if isinstance(value, list) else value
+            for name, value in values.items()
+        })
+        file = io.StringIO()
+        tls.write_template(file, template, **{
+            name: (piece for piece in value) if isinstance(value, list)
+            else value
+            for name, value in values.items()
+        })
+        self.assertEqual(file.getvalue().encode('utf-8'),
+                         expected.encode('utf-8'))
+
+    def test_chapter(self):
+
+        self.assertSameAsFormat(
+            cst.CHAPTER_TEMPLATE,
+            page_title='Title | 2',
+            previous_link='<a href="01.html">Previous</a>',
+            index_link='<a href="title_informations.html">Index</a>',
+            next_link='<a href="03.html">Next</a>',
+            chapter_title='2. Chapter — «two»',
+            chapter_text='<p>Some text</p>\n' * 1000,
+        )
+
+    def test_informations(self):
+
+        table_of_contents = [
+            f"<a class='chapter' href='{str(i + 1).zfill(4)}.html'>"
+            f"Chapter {i + 1}</a>\n"
+            for i in range(5000)
+        ]
+        self.assertSameAsFormat(
+            cst.INFORMATIONS_TEMPLATE,
+            story_title='Title',
+            site='fanfiction.net',
+            author='Author',
+            writing_date='12:00 - 01 January 2018',
+            universe='Universe',
+            url='https://www.fanfiction.net/s/1/1/',
+            summary='A summary with {braces}',
+            tokens='Rated: T - English',
+            chapter_count=5000,
+            table_of_contents=table_of_contents,
+        )
+
+    def test_empty_generator(self):
+
+        self.assertSameAsFormat('<ul>{items}</ul>', items=[])
+
+    def test_fields(self):
+
+        self.assertSameAsFormat(
+            '{{literal}} {story[4]} {count:,} {value!r:>12} {ratio:.0%}',
+            story=('url', 'path', 'site', 'author', 'title'),
+            count=1234567,
+            value='text',
+            ratio=0.5,
+        )
+
+
+@unittest.skipUnless(os.environ.get('FFNDL_BENCHMARK'),
+                     'set FFNDL_BENCHMARK=1 to run the benchmarks')
+class WriteTemplateBenchmark(unittest.TestCase):
+    """
+    The informations file of a synthetic story, written by building its table
+    of contents in a string first then with tools.write_template(). The peak
+    memory used to write it must not depend on the number of chapters. Run
+    with `FFNDL_BENCHMARK=1 python -m unittest -v tests.test_tools`
+    """
+    @staticmethod
+    def write_informations(path: str, chapter_count: int,
+                           stream: bool) -> tuple:
+        """
+        :param path: the file to write
+        :param chapter_count: the number of chapters of the story
+        :param stream: whether the table of contents is streamed
+        :return: the time taken, in seconds, and the peak memory, in bytes
+        """
+        length = len(str(chapter_count))
+        values = {
+            'story_title': 'Title',
+            'site': 'fanfiction.net',
+            'author': 'Author',
+            'writing_date': '12:00 - 01 January 2018',
+            'universe': 'Universe',
+            'url': 'https://www.fanfiction.net/s/1/1/',
+            'summary': 'A summary',
+            'tokens': 'Rated: T - English',
+            'chapter_count': chapter_count,
+        }
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        with open(path, 'w', encoding='utf-8') as f:
+            table_of_contents = (
+                f"<a class='chapter' href='{str(i + 1).zfill(length)}.html'>"
+                f"Chapter {i + 1}</a>\n"
+                for i in range(chapter_count)
+            )
+            if stream:
+                tls.write_template(f, cst.INFORMATIONS_TEMPLATE,
+                                   table_of_contents=table_of_contents,
+                                   **values)
+            else:
+                table = ''
+                for line in table_of_contents:
+                    table += line
+                f.write(cst.INFORMATIONS_TEMPLATE.format(
+                    table_of_contents=table, **values))
+        duration = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return duration, peak
+
+    def test_informations(self):
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'title_informations.html')
+            peaks = {}
+            for chapter_count in (5000, 50000):
+                for stream in (False, True):
+                    duration, peak = self.write_informations(
+                        path, chapter_count, stream)
+                    peaks[chapter_count, stream] = peak
+                    print(f'{chapter_count:,} chapters, '
+                          f'{"streamed" if stream else "built"}: '
+                          f'{duration:.3f} s, {peak // 1024:,} KiB peak')
+
+        self.assertLess(peaks[5000, True] * 10, peaks[5000, False])
+        self.assertLess(peaks[50000, True], peaks[5000, True] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import os
+import unittest
+import unittest.mock
+
+import utilities.constants as cst
+import utilities.chapter_store as cs
+import utilities.storage as stg
+import utilities.trash as tr
+
+from tests.fake_library import DATABASE, LibraryTestCase
+
+
+class _Closed(Exception):
+    """
+    The application was closed while the trash was emptied
+    """
+
+
+class TrashTest(LibraryTestCase):
+    """
+    Everything in the trash is deleted, even if emptying it was interrupted,
+    except the stored texts a chapter still uses
+    """
+    def test_resume(self):
+
+        deleted = self.add_story(1)
+        kept = self.add_story(2)
+        deleted_hashes = [chapter[2] for chapter in
+                          self.database.get_chapters(deleted.url)]
+        kept_hash = self.database.get_chapters(kept.url)[0][2]
+
+        trash = tr.Trash(DATABASE)
+        self.assertTrue(trash.add_story(self.folder(deleted)))
+        self.database.delete_story(deleted.url)
+        # Listed by mistake, or stored again meanwhile: it is still used
+        trash.add_texts(deleted_hashes + [kept_hash])
+        self.assertFalse(trash.add_story(self.folder(deleted)))
+
+        # Interrupted after the first batch of files
+        with unittest.mock.patch.object(cst, 'TRASH_BATCH_SIZE', 2), \
+                unittest.mock.patch('time.sleep', side_effect=_Closed):
+            with self.assertRaises(_Closed):
+                trash.empty()
+        self.assertNotEqual(os.listdir(cst.TRASH_FOLDER), [])
+
+        # The next time the application is started
+        tr.Trash(DATABASE).empty()
+        self.assertEqual(os.listdir(cst.TRASH_FOLDER), [])
+
+        store = cs.ChapterStore()
+        self.assertFalse(any(store.has(content_hash)
+                             for content_hash in deleted_hashes))
+        self.assertTrue(store.is_intact(kept_hash))
+        self.assertFalse(stg.LooseStorage(self.folder(deleted)).is_present())
+        self.assertEqual(len(stg.LooseStorage(self.folder(kept)).names()), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
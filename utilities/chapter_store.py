@@ -0,0 +1,124 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import os
+import zlib
+import hashlib
+
+import utilities.tools as tls
+import utilities.constants as cst
+
+
+class ChapterStore:
+    """
+    Keeps the text of each chapter as returned by `Story.get_chapter()`, before
+    it is put in `constants.CHAPTER_TEMPLATE`. Writing a chapter again (new
+    links, new template, ...) then never needs to fetch it again.
+
+    The texts are compressed and stored by their sha1 (the `content_hash`
+    registered for each chapter of a story in the database), meaning a text is
+    only stored once no matter how many chapters share it. Which story and
+    chapter a text belongs to is known from the chapters table.
+    """
+
+    def __init__(self, folder=cst.RAW_CHAPTERS_FOLDER):
+        """
+        :param folder: the folder containing the stored chapters
+        """
+        self.__logger = tls.setup_logging('ChapterStore')
+        self.folder = folder
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        """
+        :param text: the text of a chapter
+        :return: the hash under which the text is stored
+        """
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def path(self, content_hash: str) -> str:
+        """
+        :param content_hash: the hash of a chapter's text
+        :return: the path to the file in which this text is stored. The files
+                 are split in sub-folders to avoid having too many in one
+        """
+        return f'{self.folder}/{content_hash[:2]}/{content_hash}.z'
+
+    def add(self, text: str) -> str:
+        """
+        Store the text of a chapter if it is not already stored
+
+        :param text: the text of the chapter
+        :return: the hash of the text
+        """
+        content_hash = ChapterStore.text_hash(text)
+        path = self.path(content_hash)
+
+        if not os.path.isfile(path):
+            self.__logger.debug(f'Storing {content_hash}')
+            os.makedirs(path.rsplit('/', 1)[0], exist_ok=True)
+            # Written next to it then renamed to never leave a partial file
+            with open(f'{path}.tmp', 'wb') as f:
+                f.write(zlib.compress(text.encode('utf-8')))
+            os.replace(f'{path}.tmp', path)
+
+        return content_hash
+
+    def has(self, content_hash: str) -> bool:
+        """
+        :param content_hash: the hash of a chapter's text
+        :return: True if the text is stored
+        """
+        return content_hash != '' and os.path.isfile(self.path(content_hash))
+
+    def get(self, content_hash: str) -> str:
+        """
+        :param content_hash: the hash of a chapter's text
+        :return: the text of the chapter
+        :raise: FileNotFoundError if the text is not stored
+        """
+        with open(self.path(content_hash), 'rb') as f:
+            return zlib.decompress(f.read()).decode('utf-8')
+
+    def is_intact(self, content_hash: str) -> bool:
+        """
+        :param content_hash: the hash of a chapter's text
+        :return: True if the text is stored and is still the one with this hash
+        """
+        try:
+            text = self.get(content_hash)
+        except (OSError, zlib.error, UnicodeDecodeError):
+            return False
+        return ChapterStore.text_hash(text) == content_hash
+
+    def hashes(self):
+        """
+        :return: an iterator over the hashes of the stored texts, and the names
+                 of the files which are not stored texts (partial writings),
+                 as tuples (hash or None, path)
+        """
+        try:
+            folders = list(os.scandir(self.folder))
+        except FileNotFoundError:
+            return
+        for folder in folders:
+            if not folder.is_dir():
+                yield None, folder.path
+                continue
+            for file in os.scandir(folder.path):
+                if file.name.endswith('.z'):
+                    yield file.name[:-2], file.path
+                else:
+                    yield None, file.path
+
+    def remove(self, content_hash: str):
+        """
+        Delete a stored text, if it exists
+
+        :param content_hash: the hash of the chapter's text
+        """
+        self.__logger.debug(f'Removing {content_hash}')
+        try:
+            os.remove(self.path(content_hash))
+        except FileNotFoundError:
+            self.__logger.debug(f'{content_hash} was not stored')
@@ -55,6 +55,24 @@ SORT_OPTIONS = {
 }
 
 
+# The facets by which the selectable stories can be narrowed, with their column
+# in the stories table ('characters' being the characters table)
+FACETS = {
+    'Universe': 'universe',
+    'Language': 'language',
+    'Status': 'status',
+    'Read': 'read',
+    'Series': 'series',
+    'Rating': 'rating',
+    'Characters': 'characters',
+}
+
+
+# The number of paths listed when asking to repair the library, before they
+# are deleted (all of them are in the logs)
+INTEGRITY_SHOWN_PATHS = 20
+
+
 ################################################################################
 # FILE HANDLING AND LOGGING PART
 
@@ -64,8 +82,33 @@ FOLDERS = (
     '0/data',
     '0/js',
     '0/css',
+    '0/raw',
+    '0/epub',
+    '0/trash',
 )
 
+# Whether the stories are saved packed in a single file each instead of one file
+# per chapter (see utilities/storage.py). Only applies to stories not already
+# saved: the others keep their storage until converted
+PACKED_STORAGE = False
+
+# The extension of the file in which a story is packed, next to its directory
+PACKED_STORAGE_EXTENSION = '.sqlite'
+
+# Folder where the text of each chapter is kept as it was fetched, before being
+# put in a CHAPTER_TEMPLATE (see utilities/chapter_store.py)
+RAW_CHAPTERS_FOLDER = '0/raw'
+# The hash of a stored text (see ChapterStore.text_hash())
+RE_CONTENT_HASH = r'[0-9a-f]{40}'
+
+# Folder in which the deleted stories are moved before their files are
+# actually deleted in the background (see utilities/trash.py)
+TRASH_FOLDER = '0/trash'
+# The files are deleted by batches, with a pause between each to leave the
+# disk to the rest of the application
+TRASH_BATCH_SIZE = 100
+TRASH_PAUSE = 0.05
+
 # Name for the file where the logs will be written
 # There is one file per day
 # Note that if the date pass while the app is used, the file will not be changed
@@ -90,11 +133,19 @@ MAX_LOG_FILE = 2
 ################################################################################
 # SQL PART
 
+# The oldest version of SQLite able to run the queries of the program: the
+# upserts (see STORIES_UPSERT and the triggers of the statistics) need 3.24
+SQLITE_MIN_VERSION = (3, 24, 0)
+
 # To create the SQL table used to store all the necessary informations for both
 # the statistics and the UI
 # 0: url, 1: path_to_index, 2: site, 3: author, 4: title, 5: chapter_count
 # 6: word_count, 7: status, 8: language, 9: universe, 10: summary,
 # 11: curated_tokens, 12: read, 13: series, 14: position
+# Added by DATABASE_MIGRATIONS: 15: rating, 16: genres, 17: published,
+# 18: updated, 19: reviews, 20: favorites
+# Since the series have their own tables, series and position are only in the
+# rows of the stories read through STORIES_VIEW_CREATION, which keep this order
 STORIES_TABLE_CREATION = '''CREATE TABLE stories (\
 url TEXT PRIMARY KEY, \
 path_to_index TEXT, \
@@ -113,6 +164,420 @@ series TEXT, \
 position INT\
 )'''
 
+# The settings of the connection to the database. In WAL mode, the readers (the
+# reading server's threads for example) do not block the writer, and a commit
+# only appends to the log instead of rewriting the database's pages
+DATABASE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    # Safe in WAL mode: a crash can only lose the last commits, not corrupt
+    'PRAGMA synchronous=NORMAL',
+    # Not temp_store=MEMORY: the journal of a savepoint (see
+    # utilities/database_writer.py) would be kept in memory, which gets slower
+    # and slower the more rows a write changes
+    # In KiB when negative
+    'PRAGMA cache_size=-16000',
+    # Off by default, needed for the series (see SERIES_MEMBERS_TABLE_CREATION)
+    'PRAGMA foreign_keys=ON',
+)
+
+# The settings of the connections only reading the database, one for each
+# DataHandler (see utilities/database_writer.py for the one writing in it)
+DATABASE_READER_PRAGMAS = (
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',
+)
+
+# The number of parameters a query can have, at least (older versions of
+# SQLite do not accept more)
+DATABASE_MAX_PARAMETERS = 999
+
+# The maximum number of writes waiting for the writer of the database which
+# are done together, in a single transaction
+DATABASE_WRITER_BATCH_SIZE = 256
+
+# The details of a story parsed from its tokens (see Story.parse_details()),
+# in the order of their columns in the stories table
+STORY_DETAILS = (
+    'rating',
+    'genres',
+    'published',
+    'updated',
+    'reviews',
+    'favorites',
+)
+
+# To add a story or update it if it is already present, while keeping the
+# values entered by the user: read (the series are in their own tables)
+STORIES_UPSERT = f'''INSERT INTO stories VALUES ({",".join("?" * 19)}) \
+ON CONFLICT (url) DO UPDATE SET \
+path_to_index=excluded.path_to_index, \
+site=excluded.site, \
+author=excluded.author, \
+title=excluded.title, \
+chapter_count=excluded.chapter_count, \
+word_count=excluded.word_count, \
+status=excluded.status, \
+language=excluded.language, \
+universe=excluded.universe, \
+summary=excluded.summary, \
+curated_tokens=excluded.curated_tokens, \
+rating=excluded.rating, \
+genres=excluded.genres, \
+published=excluded.published, \
+updated=excluded.updated, \
+reviews=excluded.reviews, \
+favorites=excluded.favorites'''
+
+# The number of stories after which the stories added together are committed
+# (see DataHandler.add_stories()): a crash only loses the last ones, while the
+# cost of the commits stays negligible
+DATABASE_COMMIT_INTERVAL = 500
+
+# To create the indexes of the stories table, so listing the stories of a site
+# (sorted by title) is a range scan instead of a scan of the whole table. Also
+# created on existing databases
+STORIES_INDEXES_CREATION = (
+    'CREATE INDEX IF NOT EXISTS stories_site ON stories (site, title)',
+    'CREATE INDEX IF NOT EXISTS stories_author ON stories (author)',
+    'CREATE INDEX IF NOT EXISTS stories_universe ON stories (universe)',
+    'CREATE INDEX IF NOT EXISTS stories_read ON stories (read)',
+)
+
+# To create the SQL table keeping track of each chapter written for a story.
+# It is used to know what is missing or has changed when updating a story and
+# to resume an interrupted download.
+# 0: url (of the story), 1: number, 2: title, 3: content_hash (sha1 of the
+# chapter's text), 4: byte_size (of the chapter's file), 5: fetched_at,
+# 6: status (CHAPTER_PENDING or CHAPTER_COMPLETE)
+CHAPTERS_TABLE_CREATION = '''CREATE TABLE chapters (\
+url TEXT, \
+number INT, \
+title TEXT, \
+content_hash TEXT, \
+byte_size INT, \
+fetched_at TEXT, \
+status TEXT, \
+PRIMARY KEY (url, number)\
+)'''
+
+# To find the chapters with a given content hash, notably to know if a raw
+# chapter is still used by any story
+CHAPTERS_HASH_INDEX_CREATION = '''CREATE INDEX chapters_hash \
+ON chapters (content_hash)'''
+
+# To create the SQL table of the characters of each story, one row for each
+# character. The characters paired together share the same pairing number,
+# those in no pairing have 0
+# 0: url (of the story), 1: name, 2: pairing
+CHARACTERS_TABLE_CREATION = '''CREATE TABLE characters (\
+url TEXT, \
+name TEXT, \
+pairing INT, \
+PRIMARY KEY (url, name)\
+)'''
+
+# To keep the full-text index of the stories up to date (see
+# STORIES_SEARCH_CREATION)
+STORIES_SEARCH_TRIGGERS = (
+    'CREATE TRIGGER stories_search_insert AFTER INSERT ON stories BEGIN '
+    'INSERT INTO stories_search (rowid, url, title, author, summary) '
+    'VALUES (new.rowid, new.url, new.title, new.author, new.summary); END',
+    # The upserts of the stories update them even when nothing changed
+    'CREATE TRIGGER stories_search_update AFTER UPDATE OF title, author, '
+    'summary ON stories WHEN old.title IS NOT new.title '
+    'OR old.author IS NOT new.author OR old.summary IS NOT new.summary BEGIN '
+    'UPDATE stories_search SET title=new.title, author=new.author, '
+    'summary=new.summary WHERE rowid=old.rowid; END',
+    'CREATE TRIGGER stories_search_delete AFTER DELETE ON stories BEGIN '
+    'DELETE FROM stories_search WHERE rowid=old.rowid; END',
+)
+
+# The full-text index of the stories (see DataHandler.search_stories()), its
+# rowids being those of the stories table
+STORIES_SEARCH_CREATION = (
+    'CREATE VIRTUAL TABLE stories_search USING fts5('
+    'url UNINDEXED, title, author, summary)',
+    'INSERT INTO stories_search (rowid, url, title, author, summary) '
+    'SELECT rowid, url, title, author, summary FROM stories',
+) + STORIES_SEARCH_TRIGGERS
+
+# The full-text index of the texts of the chapters (see
+# DataHandler.index_chapter_text()), without their content: a text is indexed
+# once under the rowid given to its hash, whichever chapters use it. The texts
+# no chapter uses anymore are never found since the chapters are joined
+CHAPTERS_SEARCH_CREATION = (
+    'CREATE VIRTUAL TABLE chapters_search USING fts5(text, content=\'\')',
+    'CREATE TABLE chapters_search_texts ('
+    'id INTEGER PRIMARY KEY, content_hash TEXT UNIQUE NOT NULL)',
+)
+
+# To create the SQL tables of the series: their names, by id, and the position
+# of the stories in them, a story being in one series at most. Deleting a story
+# or a series deletes its memberships
+# 0: id, 1: name
+SERIES_TABLE_CREATION = '''CREATE TABLE series (\
+id INTEGER PRIMARY KEY, \
+name TEXT UNIQUE NOT NULL\
+)'''
+# 0: url (of the story), 1: series (its id), 2: position
+SERIES_MEMBERS_TABLE_CREATION = '''CREATE TABLE series_members (\
+url TEXT PRIMARY KEY REFERENCES stories (url) ON DELETE CASCADE, \
+series INTEGER NOT NULL REFERENCES series (id) ON DELETE CASCADE, \
+position INT NOT NULL\
+)'''
+
+# A series without stories does not exist anymore
+SERIES_MEMBERS_TRIGGERS = tuple(
+    f'CREATE TRIGGER series_members_{event.split()[0].lower()} AFTER {event} '
+    f'ON series_members WHEN NOT EXISTS '
+    f'(SELECT 1 FROM series_members WHERE series=old.series) BEGIN '
+    f'DELETE FROM series WHERE id=old.series; END'
+    for event in ('DELETE', 'UPDATE OF series')
+)
+
+# The stories as they were before the series had their own tables (see
+# STORIES_TABLE_CREATION), '' and 0 being the series and position of the
+# stories in none. Every row of a story is read from it
+STORIES_VIEW_CREATION = '''CREATE VIEW stories_view AS SELECT \
+stories.url, stories.path_to_index, stories.site, stories.author, \
+stories.title, stories.chapter_count, stories.word_count, stories.status, \
+stories.language, stories.universe, stories.summary, stories.curated_tokens, \
+stories.read, \
+COALESCE(series.name, '') AS series, \
+COALESCE(series_members.position, 0) AS position, \
+stories.rating, stories.genres, stories.published, stories.updated, \
+stories.reviews, stories.favorites \
+FROM stories \
+LEFT JOIN series_members ON series_members.url=stories.url \
+LEFT JOIN series ON series.id=series_members.series'''
+
+# To create the SQL tables of the statistics of each site (see
+# DataHandler.get_site_statistics()), kept up to date by
+# SITE_STATISTICS_TRIGGERS: its totals, and the number of stories having each
+# author, universe and series ('' for those without one, except the series)
+# 0: site, 1: stories, 2: chapters, 3: words, 4: read (the number of stories)
+SITE_STATISTICS_TABLE_CREATION = '''CREATE TABLE site_statistics (\
+site TEXT PRIMARY KEY, \
+stories INT NOT NULL, \
+chapters INT NOT NULL, \
+words INT NOT NULL, \
+read INT NOT NULL\
+)'''
+# 0: site, 1: kind ('author', 'universe' or 'series'), 2: value (the series'
+# id), 3: stories
+SITE_VALUES_TABLE_CREATION = '''CREATE TABLE site_values (\
+site TEXT, \
+kind TEXT, \
+value, \
+stories INT NOT NULL, \
+PRIMARY KEY (site, kind, value)\
+) WITHOUT ROWID'''
+
+# To fill the statistics of the sites from the stories already saved
+SITE_STATISTICS_FILLING = (
+    'INSERT INTO site_statistics SELECT site, COUNT(*), '
+    'SUM(COALESCE(chapter_count, 0)), SUM(COALESCE(word_count, 0)), '
+    'SUM(COALESCE(read, 0)!=0) FROM stories GROUP BY site',
+    "INSERT INTO site_values SELECT site, 'author', COALESCE(author, ''), "
+    "COUNT(*) FROM stories GROUP BY 1, 3",
+    "INSERT INTO site_values SELECT site, 'universe', COALESCE(universe, ''), "
+    "COUNT(*) FROM stories GROUP BY 1, 3",
+    "INSERT INTO site_values SELECT stories.site, 'series', "
+    "series_members.series, COUNT(*) FROM series_members "
+    "JOIN stories ON stories.url=series_members.url GROUP BY 1, 3",
+)
+
+# The statements of the triggers adding ({sign} being 1) or removing (-1) a
+# story, the {row} new or old, to the statistics of its site
+SITE_STATISTICS_COUNT = (
+    'INSERT INTO site_statistics VALUES ({row}.site, {sign}, '
+    '{sign}*COALESCE({row}.chapter_count, 0), '
+    '{sign}*COALESCE({row}.word_count, 0), '
+    '{sign}*(COALESCE({row}.read, 0)!=0)) ON CONFLICT (site) DO UPDATE SET '
+    'stories=stories+excluded.stories, chapters=chapters+excluded.chapters, '
+    'words=words+excluded.words, read=read+excluded.read; '
+    "INSERT INTO site_values VALUES ({row}.site, 'author', "
+    "COALESCE({row}.author, ''), {sign}) ON CONFLICT (site, kind, value) "
+    "DO UPDATE SET stories=stories+excluded.stories; "
+    "INSERT INTO site_values VALUES ({row}.site, 'universe', "
+    "COALESCE({row}.universe, ''), {sign}) ON CONFLICT (site, kind, value) "
+    "DO UPDATE SET stories=stories+excluded.stories; "
+    "INSERT INTO site_values SELECT {row}.site, 'series', series, {sign} "
+    "FROM series_members WHERE url={row}.url ON CONFLICT (site, kind, value) "
+    "DO UPDATE SET stories=stories+excluded.stories; "
+)
+# The statements of the triggers deleting what the old row of a story counted
+# for, if no story counts for it anymore
+SITE_STATISTICS_CLEANING = (
+    "DELETE FROM site_values WHERE site=old.site AND kind='author' "
+    "AND value=COALESCE(old.author, '') AND stories=0; "
+    "DELETE FROM site_values WHERE site=old.site AND kind='universe' "
+    "AND value=COALESCE(old.universe, '') AND stories=0; "
+    "DELETE FROM site_values WHERE site=old.site AND kind='series' "
+    "AND value=(SELECT series FROM series_members WHERE url=old.url) "
+    "AND stories=0; "
+    'DELETE FROM site_statistics WHERE site=old.site AND stories=0; '
+)
+# The statements of the triggers adding ({sign} being 1) or removing (-1) a
+# membership, the {row} new or old, to the statistics of the site of its story
+SITE_STATISTICS_SERIES_COUNT = (
+    "INSERT INTO site_values SELECT site, 'series', {row}.series, {sign} "
+    "FROM stories WHERE url={row}.url ON CONFLICT (site, kind, value) "
+    "DO UPDATE SET stories=stories+excluded.stories; "
+)
+
+# The statement of the triggers deleting the old series of a membership from
+# the statistics of the site of its story, if no story of the site is in it
+SITE_STATISTICS_SERIES_CLEANING = (
+    "DELETE FROM site_values WHERE site=(SELECT site FROM stories "
+    "WHERE url=old.url) AND kind='series' AND value=old.series "
+    "AND stories=0; "
+)
+
+# To keep the statistics of the sites up to date, whatever changes the stories
+# or the series. The memberships of a story are deleted before it, so the
+# series it was in are still known to be of its site
+SITE_STATISTICS_TRIGGERS = (
+    f'CREATE TRIGGER site_statistics_insert AFTER INSERT ON stories BEGIN '
+    f'{SITE_STATISTICS_COUNT.format(row="new", sign=1)}END',
+    # The upserts of the stories update them even when nothing changed
+    f'CREATE TRIGGER site_statistics_update AFTER UPDATE OF site, author, '
+    f'universe, chapter_count, word_count, read ON stories '
+    f'WHEN old.site IS NOT new.site OR old.author IS NOT new.author '
+    f'OR old.universe IS NOT new.universe '
+    f'OR old.chapter_count IS NOT new.chapter_count '
+    f'OR old.word_count IS NOT new.word_count '
+    f'OR old.read IS NOT new.read BEGIN '
+    f'{SITE_STATISTICS_COUNT.format(row="old", sign=-1)}'
+    f'{SITE_STATISTICS_COUNT.format(row="new", sign=1)}'
+    f'{SITE_STATISTICS_CLEANING}END',
+    'CREATE TRIGGER site_statistics_before_delete BEFORE DELETE ON stories '
+    'BEGIN DELETE FROM series_members WHERE url=old.url; END',
+    f'CREATE TRIGGER site_statistics_delete AFTER DELETE ON stories BEGIN '
+    f'{SITE_STATISTICS_COUNT.format(row="old", sign=-1)}'
+    f'{SITE_STATISTICS_CLEANING}END',
+    f'CREATE TRIGGER site_statistics_series_insert AFTER INSERT '
+    f'ON series_members BEGIN '
+    f'{SITE_STATISTICS_SERIES_COUNT.format(row="new", sign=1)}END',
+    f'CREATE TRIGGER site_statistics_series_update AFTER UPDATE OF series '
+    f'ON series_members WHEN old.series!=new.series BEGIN '
+    f'{SITE_STATISTICS_SERIES_COUNT.format(row="old", sign=-1)}'
+    f'{SITE_STATISTICS_SERIES_COUNT.format(row="new", sign=1)}'
+    f'{SITE_STATISTICS_SERIES_CLEANING}END',
+    f'CREATE TRIGGER site_statistics_series_delete AFTER DELETE '
+    f'ON series_members BEGIN '
+    f'{SITE_STATISTICS_SERIES_COUNT.format(row="old", sign=-1)}'
+    f'{SITE_STATISTICS_SERIES_CLEANING}END',
+)
+
+# The changes made to the database since its first version, in order. Each is
+# applied once, in a single transaction, the version of the database being
+# kept in its user_version (see utilities/database_writer.py)
+DATABASE_MIGRATIONS = (
+    # 1: the details of the stories, in their own columns and table instead of
+    # only in their tokens
+    (
+        'ALTER TABLE stories ADD COLUMN rating TEXT',
+        'ALTER TABLE stories ADD COLUMN genres TEXT',
+        'ALTER TABLE stories ADD COLUMN published TEXT',
+        'ALTER TABLE stories ADD COLUMN updated TEXT',
+        'ALTER TABLE stories ADD COLUMN reviews INT',
+        'ALTER TABLE stories ADD COLUMN favorites INT',
+        'CREATE INDEX stories_rating ON stories (rating)',
+        'CREATE INDEX stories_updated ON stories (updated)',
+        'CREATE INDEX stories_word_count ON stories (word_count)',
+        CHARACTERS_TABLE_CREATION,
+        'CREATE INDEX characters_name ON characters (name, pairing)',
+    ),
+    # 2: the facets (see constants.FACETS) of the stories of a site are
+    # counted from an index only, and a character's stories are found from it
+    (
+        'CREATE INDEX stories_site_universe ON stories (site, universe)',
+        'CREATE INDEX stories_site_language ON stories (site, language)',
+        'CREATE INDEX stories_site_status ON stories (site, status)',
+        'CREATE INDEX stories_site_read ON stories (site, read)',
+        'CREATE INDEX stories_site_series ON stories (site, series)',
+        'CREATE INDEX stories_site_rating ON stories (site, rating)',
+        'DROP INDEX characters_name',
+        'CREATE INDEX characters_name ON characters (name, pairing, url)',
+    ),
+    # 3: the full-text search of the stories and the chapters
+    STORIES_SEARCH_CREATION + CHAPTERS_SEARCH_CREATION,
+    # 4: the series in their own tables instead of the series and position
+    # columns of the stories table. SQLite cannot drop columns, the table is
+    # copied without them (its rowids kept for the full-text index)
+    (
+        SERIES_TABLE_CREATION,
+        "INSERT INTO series (name) SELECT DISTINCT series FROM stories "
+        "WHERE series!=''",
+        "CREATE TEMP TABLE old_series AS SELECT url, series, position "
+        "FROM stories WHERE series!=''",
+        'CREATE TABLE stories_new (url TEXT PRIMARY KEY, path_to_index TEXT, '
+        'site TEXT, author TEXT, title TEXT, chapter_count INT, '
+        'word_count INT, status TEXT, language TEXT, universe TEXT, '
+        'summary TEXT, curated_tokens TEXT, read INT, rating TEXT, '
+        'genres TEXT, published TEXT, updated TEXT, reviews INT, '
+        'favorites INT)',
+        'INSERT INTO stories_new (rowid, url, path_to_index, site, author, '
+        'title, chapter_count, word_count, status, language, universe, '
+        'summary, curated_tokens, read, rating, genres, published, updated, '
+        'reviews, favorites) SELECT rowid, url, path_to_index, site, author, '
+        'title, chapter_count, word_count, status, language, universe, '
+        'summary, curated_tokens, read, rating, genres, published, updated, '
+        'reviews, favorites FROM stories',
+        # Its indexes and triggers with it
+        'DROP TABLE stories',
+        'ALTER TABLE stories_new RENAME TO stories',
+        SERIES_MEMBERS_TABLE_CREATION,
+        'CREATE INDEX series_members_series '
+        'ON series_members (series, position)',
+        'INSERT INTO series_members SELECT old_series.url, series.id, '
+        'COALESCE(old_series.position, 0) FROM old_series '
+        'JOIN series ON series.name=old_series.series',
+        'DROP TABLE old_series',
+        STORIES_VIEW_CREATION,
+        'CREATE INDEX stories_rating ON stories (rating)',
+        'CREATE INDEX stories_updated ON stories (updated)',
+        'CREATE INDEX stories_word_count ON stories (word_count)',
+        'CREATE INDEX stories_site_universe ON stories (site, universe)',
+        'CREATE INDEX stories_site_language ON stories (site, language)',
+        'CREATE INDEX stories_site_status ON stories (site, status)',
+        'CREATE INDEX stories_site_read ON stories (site, read)',
+        'CREATE INDEX stories_site_rating ON stories (site, rating)',
+    ) + SERIES_MEMBERS_TRIGGERS + STORIES_SEARCH_TRIGGERS,
+    # 5: the statistics of each site, kept up to date instead of computed
+    # again from every story
+    (
+        SITE_STATISTICS_TABLE_CREATION,
+        SITE_VALUES_TABLE_CREATION,
+    ) + SITE_STATISTICS_FILLING + SITE_STATISTICS_TRIGGERS,
+)
+
+# To create the SQL table of a packed story (see utilities/storage.py), in which
+# each of its files is saved compressed
+# 0: name, 1: hash (sha1 of the content), 2: size (of the content), 3: data
+PACKED_FILES_TABLE_CREATION = '''CREATE TABLE IF NOT EXISTS files (\
+name TEXT PRIMARY KEY, \
+hash TEXT, \
+size INT, \
+data BLOB\
+)'''
+
+# Whether the texts of the chapters are indexed for the search as they are
+# written (the stories are always). The chapters written before are indexed
+# when the library is rendered again
+SEARCH_CHAPTERS = False
+# The number of stories and of chapters found by a search, the best ones
+SEARCH_RESULTS = 50
+# The number of words around what was found shown for each result
+SEARCH_SNIPPET_WORDS = 12
+
+# The status of a chapter in the chapters table
+# Pending: it is being written or has to be written again
+CHAPTER_PENDING = 'pending'
+# Complete: the file was entirely written
+CHAPTER_COMPLETE = 'complete'
+
 
 ################################################################################
 # CHAPTER PART (HTML + CSS)
@@ -121,6 +586,20 @@ position INT\
 # CHAPTER_TEMPLATE string below
 LINK_BASE = "<a class='{}' href='{}.html'>{}</a>"
 
+# The {previous_link} or {next_link} when no such chapter exists
+NO_LINK_BASE = "<a class='{}'>Nothing more this way</a>"
+
+# To find the {chapter_text} in an already written chapter
+RE_CHAPTER_TEXT = (
+    r"<span class='text'>\n(.*)\n</span>\n\n<hr size=1 noshade/>"
+)
+
+# To find the {previous_link} and {next_link} in an already written chapter,
+# whether they point to a chapter or not. Used to update them without writing
+# the whole chapter again
+RE_PREVIOUS_LINK = r"<a class='previous'(?: href='[^']*')?>.*?</a>"
+RE_NEXT_LINK = r"<a class='next'(?: href='[^']*')?>.*?</a>"
+
 
 # The CSS for each story file and the informations file.
 # Do not hesitate to change the max-width to suit your needs
@@ -301,6 +780,7 @@ a:hover, .chapter:hover {
 #   the tokens or the chapters (without the <ul> and </ul> markers)
 # It is used when writing the informations for a story in the StoryWriter class
 # (see utilities/story_writer.py)
+# NOTE: RE_WRITING_DATE (below) must be updated if {writing_date} is moved
 INFORMATIONS_TEMPLATE = '''\
 <!DOCTYPE html>
 <html>
@@ -354,9 +834,32 @@ INFORMATIONS_TEMPLATE = '''\
 '''
 
 
+# To find the {writing_date} in an already written informations file
+RE_WRITING_DATE = r"<span class='infos'>(\d\d:\d\d - \d\d \w+ \d+)</span>"
+
+# To find the values used to write an informations file, save for the
+# {table_of_contents} (see RE_TABLE_OF_CONTENTS). To be used with re.DOTALL
+RE_INFORMATIONS_FILE = (
+    r"<title>(?P<story_title>.*?) \| Informations</title>.*?"
+    r'<a class=\'infos\' href="../../(?P<site>.*?)_statistics.html">.*?'
+    r"<h1>.*?</h1>.*?<div class='container'>\n"
+    r"<span class='infos'>(?P<author>.*?)</span>\n"
+    r"<span class='infos'>(?P<universe>.*?)</span>.*?"
+    r"<a class='url' href='(?P<url>.*?)'>.*?"
+    r"<p>(?P<summary>.*?)</p>\n\n<p><em>(?P<tokens>.*?)</em></p>.*?"
+    r"<p><strong>Chapters \((?P<chapter_count>[\d,]+)\):</strong></p>"
+)
+
+# To find each chapter in the {table_of_contents} of an informations file
+RE_TABLE_OF_CONTENTS = r"<a class='chapter' href='(\d+).html'>(.*?)</a>\n"
+
+
 ################################################################################
 # STATISTICS PART
 
+# The number of stories whose rows are written together in the statistics
+STATISTICS_ROWS_BY_WRITE = 500
+
 SITE_STATISTICS_TR_TEMPLATE = '''
 <tr>
     <td onclick="sortTable(0)">
@@ -428,6 +931,56 @@ Unread: {unread:,} - Series: {series:,}</p>
 '''
 
 
+# The number of stories read at a time for the general statistics (see
+# utilities/statistics.py)
+STATISTICS_CHUNK_ROWS = 5000
+
+# The ranges of word counts of the general statistics: each bound is the start
+# of a range, the first one starting at 0
+STATISTICS_WORDS_BOUNDS = (1000, 5000, 10000, 50000, 100000, 500000)
+
+# The number of authors in the general statistics, those with the most stories
+STATISTICS_TOP_AUTHORS = 25
+
+GENERAL_STATISTICS_TABLE_TEMPLATE = '''
+<h2>{title}</h2>
+<table class="general-table">
+<thead>
+<tr>{headers}</tr>
+</thead>
+<tbody>
+{rows}
+</tbody>
+</table>
+'''
+
+
+GENERAL_STATISTICS_TEMPLATE = '''
+<!DOCTYPE html>
+<html>
+
+<head>
+    <meta http-equiv="Content-Type" content="text/html; charset=utf-8">
+    <meta name="viewport" content="initial-scale=1">
+    <base>
+    <title>Statistics | General</title>
+    <link rel="stylesheet" href="0/css/statistics_style.css">
+</head>
+<body>
+
+<div class="general">
+    <h1>Statistics | General</h1>
+    <p>Sites: {sites:,} - Authors: {authors:,} - Universes: {universes:,} - \
+Chapters: {chapters:,} - Words: {words:,} - Stories: {stories:,} - Complete: \
+{complete} - Read: {read:,} - Unread: {unread:,} ({backlog:,} words)</p>
+</div>
+<hr size=1 noshade/>
+{tables}
+</body>
+</html>
+'''
+
+
 # If the statistics are not properly displayed on your phone/tablet, modify
 # the pixel value in this constant
 STATISTICS_CSS = '''
@@ -447,6 +1000,7 @@ strong {
     color: #FFFFFF;
 }
 .read, .complete { background-color: #346b35; }
+.general-table { margin: 0 auto 2%; }
 .unread, .progress { background-color: #961010; }
 table { border-collapse: collapse; }
 th {
@@ -602,3 +1156,248 @@ function sortTable(n) {
     delete cellLength;
 }
 '''
+
+
+################################################################################
+# EPUB PART (see utilities/epub_writer.py)
+
+# Folder in which the EPUB files are written, one sub-folder per site
+EPUB_FOLDER = '0/epub'
+
+# The elements of XHTML which have no content, written <br/>
+EPUB_VOID_ELEMENTS = frozenset((
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+    'param', 'source', 'track', 'wbr',
+))
+
+# What can be the name of an element or an attribute in the XHTML of an EPUB:
+# those with a prefix (like <o:p>) would need their namespace to be declared
+RE_XML_NAME = r'[A-Za-z_][\w.-]*'
+
+# The BCP 47 code of each language, by its name on the sites. The stories in
+# any other language are marked as undetermined
+EPUB_LANGUAGES = {
+    'Afrikaans': 'af',
+    'Albanian': 'sq',
+    'Arabic': 'ar',
+    'Bulgarian': 'bg',
+    'Catalan': 'ca',
+    'Chinese': 'zh',
+    'Croatian': 'hr',
+    'Czech': 'cs',
+    'Danish': 'da',
+    'Dutch': 'nl',
+    'English': 'en',
+    'Esperanto': 'eo',
+    'Estonian': 'et',
+    'Farsi': 'fa',
+    'Filipino': 'fil',
+    'Finnish': 'fi',
+    'French': 'fr',
+    'German': 'de',
+    'Greek': 'el',
+    'Hebrew': 'he',
+    'Hindi': 'hi',
+    'Hungarian': 'hu',
+    'Icelandic': 'is',
+    'Indonesian': 'id',
+    'Italian': 'it',
+    'Japanese': 'ja',
+    'Korean': 'ko',
+    'Latin': 'la',
+    'Lithuanian': 'lt',
+    'Malay': 'ms',
+    'Norwegian': 'no',
+    'Polish': 'pl',
+    'Portuguese': 'pt',
+    'Punjabi': 'pa',
+    'Romanian': 'ro',
+    'Russian': 'ru',
+    'Serbian': 'sr',
+    'Slovak': 'sk',
+    'Slovenian': 'sl',
+    'Spanish': 'es',
+    'Swedish': 'sv',
+    'Thai': 'th',
+    'Turkish': 'tr',
+    'Ukrainian': 'uk',
+    'Vietnamese': 'vi',
+}
+EPUB_UNKNOWN_LANGUAGE = 'und'
+
+# The first file of any EPUB, stored without compression
+EPUB_MIMETYPE = 'application/epub+zip'
+
+EPUB_CONTAINER = '''\
+<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+'''
+
+# The package file: metadata, list of the files and reading order.
+# {manifest} and {spine} are made of EPUB_OPF_ITEM and EPUB_OPF_ITEMREF, one
+# per chapter. All the values must be escaped for XML
+EPUB_CONTENT_OPF = '''\
+<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="2.0" unique-identifier="url">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:opf="http://www.idpf.org/2007/opf">
+    <dc:identifier id="url">{url}</dc:identifier>
+    <dc:title>{title}</dc:title>
+    <dc:creator opf:role="aut">{author}</dc:creator>
+    <dc:language>{language}</dc:language>
+    <dc:publisher>{site}</dc:publisher>
+    <dc:subject>{universe}</dc:subject>
+    <dc:description>{summary}</dc:description>
+  </metadata>
+  <manifest>
+    <item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>
+    <item id="css" href="style.css" media-type="text/css"/>
+    <item id="informations" href="informations.xhtml" media-type="application/xhtml+xml"/>
+{manifest}\
+  </manifest>
+  <spine toc="ncx">
+    <itemref idref="informations"/>
+{spine}\
+  </spine>
+</package>
+'''
+
+EPUB_OPF_ITEM = ('    <item id="c{num}" href="{num}.xhtml" '
+                 'media-type="application/xhtml+xml"/>\n')
+
+EPUB_OPF_ITEMREF = '    <itemref idref="c{num}"/>\n'
+
+# The table of contents. {nav_points} is made of EPUB_NCX_NAVPOINT, one per
+# chapter. All the values must be escaped for XML
+EPUB_NCX = '''\
+<?xml version="1.0" encoding="UTF-8"?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+  <head>
+    <meta name="dtb:uid" content="{url}"/>
+  </head>
+  <docTitle><text>{title}</text></docTitle>
+  <navMap>
+    <navPoint id="informations" playOrder="1">
+      <navLabel><text>Informations</text></navLabel>
+      <content src="informations.xhtml"/>
+    </navPoint>
+{nav_points}\
+  </navMap>
+</ncx>
+'''
+
+EPUB_NCX_NAVPOINT = '''\
+    <navPoint id="c{num}" playOrder="{order}">
+      <navLabel><text>{title}</text></navLabel>
+      <content src="{num}.xhtml"/>
+    </navPoint>
+'''
+
+EPUB_CSS = '''\
+body { text-align: justify; }
+h1 { text-align: center; }
+.tokens { font-style: italic; }
+'''
+
+# The first page of the EPUB. {title}, {author} and {universe} must be escaped
+# for XML, {summary} and {tokens} are kept as they are in the informations file
+EPUB_INFORMATIONS_TEMPLATE = '''\
+<?xml version="1.0" encoding="UTF-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head>
+  <title>{title}</title>
+  <link rel="stylesheet" type="text/css" href="style.css"/>
+</head>
+<body>
+<h1>{title}</h1>
+<p>{author} - {universe}</p>
+<p><a href="{url}">{url}</a></p>
+<p>{summary}</p>
+<p class="tokens">{tokens}</p>
+</body>
+</html>
+'''
+
+# A chapter of the EPUB. {chapter_title} must be escaped for XML, {chapter_text}
+# is the text of the chapter as returned by Story.get_chapter()
+EPUB_CHAPTER_TEMPLATE = '''\
+<?xml version="1.0" encoding="UTF-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head>
+  <title>{chapter_title}</title>
+  <link rel="stylesheet" type="text/css" href="style.css"/>
+</head>
+<body>
+<h1>{chapter_title}</h1>
+{chapter_text}
+</body>
+</html>
+'''
+
+# Written instead of a chapter which is neither stored nor written
+EPUB_MISSING_CHAPTER = '<p>This chapter could not be found in the library.</p>'
+
+
+################################################################################
+# READING SERVER PART (see utilities/reading_server.py)
+
+READING_SERVER_HOST = 'localhost'
+READING_SERVER_PORT = 8000
+# The address the server listens on, by default. Only this computer can read the
+# library: to let other computers synchronize from it (see utilities/sync.py),
+# the user sets it to the address of this computer on the local network, or to
+# '' for all of them (Settings > Share the library on the network, saved in
+# settings.ffndl). Nothing is authenticated, so only on a trusted network
+READING_SERVER_BIND_ADDRESS = 'localhost'
+
+# The files served besides those of the stories registered in the database: the
+# statistics, the css and the javascript. The logs, the database and anything
+# else in the save folder are never served
+RE_READING_SERVER_FILES = r'[\w.-]+_statistics\.html|0/(css|js)/[\w.-]+'
+
+# The css and javascript only change with a new version of the application.
+# The pages are always revalidated (using their ETag) since they change with
+# each update
+READING_SERVER_STATIC_CACHE = 'public, max-age=86400'
+READING_SERVER_PAGE_CACHE = 'no-cache'
+
+# The home page of the reading server. {sites} is made of
+# READING_SERVER_SITE_TEMPLATE, one per site with saved stories
+READING_SERVER_INDEX_TEMPLATE = '''\
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <title>{app_name}</title>
+</head>
+<body>
+<h1>{app_name}</h1>
+<ul>
+{sites}</ul>
+</body>
+</html>
+'''
+
+READING_SERVER_SITE_TEMPLATE = \
+    '<li><a href="{site}_statistics.html">{site}</a> ({count} stories)</li>\n'
+
+
+################################################################################
+# SANITIZATION PART (see tools.sanitize_html() and Story.sanitize_chapter())
+
+# Attributes kept in the text of the chapters, any other one is removed
+SANITIZE_ATTRIBUTES = {
+    'href', 'src', 'alt', 'title', 'align', 'colspan', 'rowspan', 'dir', 'lang',
+}
+
+# Style properties kept in the text of the chapters: those changing the
+# meaning of the text. Any other is the site's presentation
+SANITIZE_STYLES = {
+    'text-align', 'text-decoration', 'font-style', 'font-weight',
+}
+
+# Tags with no meaning without attributes, removed when they have none left
+SANITIZE_UNWRAPPED = {'span', 'font'}
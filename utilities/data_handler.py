@@ -1,10 +1,21 @@
 __version__ = '2018.07.13'
 __author__ = 'Alexis BOURGET'
 
+import os
 import sqlite3 as sql
+import datetime
+import itertools
+import threading
+import urllib.request
 
 import utilities.tools as tls
 import utilities.constants as cst
+import utilities.database_writer as dw
+
+# The functions to call when stories change, by absolute path to the database
+# (see DataHandler.subscribe())
+_LISTENERS = {}
+_LISTENERS_LOCK = threading.Lock()
 
 
 class DataHandler:
@@ -14,34 +25,138 @@ class DataHandler:
 
     URLs are the primary key for this database (it seems logical that
     to one url correspond one story)
-    """
-    def __init__(self, database_file: str):
 
+    A DataHandler only reads the database with its own connection, which
+    makes it usable in any thread as long as each thread has its own: every
+    write goes through the only writer of the database (see
+    utilities/database_writer.py), and is committed when the method returns.
+
+    Every value is given to SQLite as a parameter, never inserted in the query
+    itself: the queries are prepared once and cached by the connection, and a
+    title or url containing quotes cannot break them. Only column names, which
+    come from the program itself, are part of the queries
+
+    The rows of the stories are read from the stories_view view, which adds
+    their series and position (see constants.STORIES_VIEW_CREATION): they are
+    changed with `.add_to_series()` and the other methods of the series
+    """
+    def __init__(self, database_file: str, read_only=False):
+        """
+        :param database_file: the path to the database, created if needed
+        :param read_only: only read the database, which must exist: it is
+                          neither created nor migrated, and every write fails
+                          (like the database of another library)
+        :raise: sqlite3.DatabaseError if the database is unusable
+                database_writer.MigrationError if it could not be migrated
+        """
         self.__logger = tls.setup_logging('DataHandler')
 
-        # Connection to the database
-        self.__conn = sql.connect(database_file)
+        # The writes go through the only writer of the database, shared by all
+        # the DataHandlers (and threads) using it. It also sets the database up
+        self.__writer = None if read_only else dw.get_writer(database_file)
+
+        self.__path = os.path.abspath(database_file)
+
+        # Connection to the database, only to read it: each DataHandler has
+        # its own, and never waits for the writer (see constants)
+        uri = urllib.request.pathname2url(self.__path)
+        self.__conn = sql.connect(f'file:{uri}?mode=ro', uri=True)
         # Cursor
         self.__cur = self.__conn.cursor()
 
-        try:
-            self.__cur.execute(cst.STORIES_TABLE_CREATION)
-        # Error if the table already exists
-        except sql.OperationalError as err:
-            self.__logger.debug(f'DataHandler: {err}')
-        else:
-            self.__conn.commit()
-            self.__logger.info('Database setup-ed')
+        for pragma in cst.DATABASE_READER_PRAGMAS:
+            self.__cur.execute(pragma)
+
+        # Without FTS5 in SQLite, the search is not set up (see
+        # DatabaseWriter.__setup_search())
+        self.__cur.execute("SELECT 1 FROM sqlite_master "
+                           "WHERE name='stories_search_insert'")
+        self.__searchable = self.__cur.fetchone() is not None
+
+    def __write(self, *statements) -> int:
+        """
+        Execute some statements in a single transaction, through the writer of
+        the database, and wait for them to be committed
+
+        :param statements: the statements, as (method, query, parameters) where
+                           method is 'execute' or 'executemany'
+        :return: the number of rows changed
+        :raise: sqlite3.Error if the statements failed
+        """
+        if self.__writer is None:
+            raise sql.OperationalError('The database is opened read-only')
+        return self.__writer.write(statements).result()
+
+    def subscribe(self, listener):
+        """
+        Be told of the changes to the stories of the database, whichever
+        DataHandler makes them
+
+        :param listener: a function called, in the thread which made the
+                         change, with the url and the new row of each story
+                         changed (None if it was deleted)
+        """
+        with _LISTENERS_LOCK:
+            _LISTENERS.setdefault(self.__path, []).append(listener)
+
+    def unsubscribe(self, listener):
+        """
+        :param listener: a function given to `.subscribe()`, which is not
+                         called anymore
+        """
+        with _LISTENERS_LOCK:
+            _LISTENERS.get(self.__path, []).remove(listener)
+
+    def get_version(self) -> int:
+        """
+        :return: the version of the database, the number of migrations done
+                 (see constants.DATABASE_MIGRATIONS)
+        """
+        self.__cur.execute('PRAGMA user_version')
+        return self.__cur.fetchone()[0]
+
+    def close(self):
+        """
+        Close the connection of the DataHandler, which cannot be used anymore.
+        The writer of the database is shared by all the DataHandlers, it keeps
+        running
+        """
+        self.__conn.close()
+
+    def __notify(self, urls):
+        """
+        Call the listeners with the new rows of the stories changed
+
+        :param urls: the urls of the stories changed
+        """
+        with _LISTENERS_LOCK:
+            listeners = list(_LISTENERS.get(self.__path, []))
+        if len(listeners) == 0:
+            return
+
+        urls = list(dict.fromkeys(urls))
+        rows = {}
+        for i in range(0, len(urls), cst.DATABASE_MAX_PARAMETERS):
+            chunk = urls[i:i + cst.DATABASE_MAX_PARAMETERS]
+            self.__cur.execute(
+                f'SELECT * FROM stories_view WHERE url IN '
+                f'({",".join("?" * len(chunk))})',
+                chunk
+            )
+            rows.update((row[0], row) for row in self.__cur.fetchall())
+
+        for url in urls:
+            for listener in listeners:
+                listener(url, rows.get(url))
 
     def add_story(self, st_obj):
         """
-        Adds a story to the database, deleting any previous save of it. If the
+        Adds a story to the database, replacing any previous save of it. If the
         story is already present, it keeps the following values to ensure a
         smooth experience by not making the user enter them again:
 
             - read
-            - series
-            - position
+            - series and position (which are in their own tables)
 
         It is also used to update stories since it cost almost nothing to do it
         this way instead of choosing what to update
@@ -50,35 +165,57 @@ class DataHandler:
                       the Story class.
         """
         self.__logger.info(f'Saving "{st_obj.title}" ("{st_obj.url}")')
-        # Defaults values
-        read = False
-        series = ''
-        position = 0
-        # Ensure the previous entry is deleted if necessary while saving all
-        # user-entered values
-        command = 'SELECT read, series, position FROM stories WHERE url="{}"'
-        self.__cur.execute(command.format(st_obj.url))
-        try:
-            self.__logger.debug('Recuperating older values for continuity')
-            result = self.__cur.fetchmany(1)
-            # Getting older values to ensure continuity
-            read = bool(result[0][0])
-            series = str(result[0][1])
-            position = int(result[0][2])
-        except IndexError:
-            self.__logger.debug('No older values were found')
-        else:
-            self.__logger.debug('Story was already saved: deleting it')
-            self.__cur.execute(f'DELETE FROM stories WHERE url="{st_obj.url}"')
-            self.__logger.debug('Story deleted')
+        self.add_stories((st_obj,))
+        self.__logger.debug('Story added')
+
+    def add_stories(self, st_objs, commit_every=None) -> int:
+        """
+        Adds or updates many stories at once, like `.add_story()` does for one.
+        Each story is a single statement (see constants.STORIES_UPSERT) and
+        they are committed together, so adding thousands of stories costs one
+        write to the disk instead of thousands
+
+        :param st_objs: the stories to add, objects inheriting from the Story
+                        class. Can be a generator
+        :param commit_every: the number of stories after which the changes are
+                             committed. By default, they are all committed
+                             together at the end
+        :return: the number of stories saved
+        """
+        self.__logger.info('Saving stories')
+        st_objs = iter(st_objs)
+        saved = 0
+        while True:
+            batch = [self.__story_row(st_obj)
+                     for st_obj in itertools.islice(st_objs, commit_every)]
+            if len(batch) == 0:
+                break
+            self.__write(
+                ('executemany', cst.STORIES_UPSERT, [row for row, _ in batch]),
+                *self.__characters_statements(
+                    (row[0], characters) for row, characters in batch
+                )
+            )
+            self.__notify(row[0] for row, _ in batch)
+            saved += len(batch)
+            self.__logger.debug(f'{saved} stories saved')
+
+        return saved
 
+    def __story_row(self, st_obj) -> tuple:
+        """
+        :param st_obj: a story, an object inheriting from the Story class
+        :return: its row in the stories table, with the default read status
+                 (only used if it is not already saved), and its characters as
+                 (name, pairing)
+        """
         # To avoid any surprises later on
         if st_obj.status.lower() not in ['complete', 'in progress']:
             self.__logger.debug('Unknown status, setting it to "In Progress"')
             st_obj.status = 'In Progress'
 
-        command = 'INSERT INTO stories VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)'
-        values = (
+        details = st_obj.get_details()
+        row = (
             st_obj.url,
             # path_to_index
             '{}/{}/{}_informations.html'.format(
@@ -96,24 +233,108 @@ class DataHandler:
             st_obj.universe,
             st_obj.summary,
             st_obj.curated_tokens,
-            read,
-            series,
-            position,
+            # read
+            False,
         )
+        row += tuple(details[column] for column in cst.STORY_DETAILS)
+        return row, details['characters']
 
-        self.__cur.execute(command, values)
-        self.__conn.commit()
-        self.__logger.debug('Story added')
+    @staticmethod
+    def __characters_statements(characters) -> tuple:
+        """
+        :param characters: the url and characters, as (name, pairing), of each
+                           story
+        :return: the statements replacing the characters of the stories
+        """
+        characters = list(characters)
+        return (
+            ('executemany',
+             'DELETE FROM characters WHERE url=?',
+             [(url,) for url, _ in characters]),
+            # A character can be given twice by the site
+            ('executemany',
+             'INSERT OR IGNORE INTO characters VALUES (?,?,?)',
+             [(url, name, pairing)
+              for url, story_characters in characters
+              for name, pairing in story_characters]),
+        )
+
+    def restore_stories(self, stories, characters=None) -> int:
+        """
+        Insert many stories at once, in a single transaction. The stories
+        already present are left as they are (with their read status and
+        series)
+
+        :param stories: the rows of the stories, as in the stories table
+        :param characters: the characters of the stories as (name, pairing),
+                           by url
+        :return: the number of stories inserted
+        """
+        self.__logger.info('Restoring stories')
+        stories = list(stories)
+        characters = {} if characters is None else characters
+        inserted = self.__write((
+            'executemany',
+            f'INSERT OR IGNORE INTO stories VALUES ({",".join("?" * 19)})',
+            [tuple(story[:13]) + tuple(story[15:]) for story in stories]
+        ))
+        # Those of the stories already present are left as they are too
+        members = [(story[0], story[14], story[13]) for story in stories
+                   if story[13] != '']
+        self.__write(
+            ('executemany',
+             'INSERT OR IGNORE INTO characters VALUES (?,?,?)',
+             [(url, name, pairing)
+              for url, story_characters in characters.items()
+              for name, pairing in story_characters]),
+            ('executemany',
+             'INSERT OR IGNORE INTO series (name) VALUES (?)',
+             [(series,) for _, _, series in members]),
+            ('executemany',
+             'INSERT OR IGNORE INTO series_members (url, series, position) '
+             'SELECT ?, id, ? FROM series WHERE name=?',
+             members),
+            # Those created for stories already in another series
+            ('execute',
+             'DELETE FROM series WHERE id NOT IN '
+             '(SELECT series FROM series_members)',
+             ()),
+        )
+        self.__notify(story[0] for story in stories)
+        self.__logger.debug(f'{inserted} stories restored')
+        return inserted
+
+    def save_story_row(self, story: tuple, characters=()):
+        """
+        Save the row of a story as it is in another library. Like with
+        `.add_story()`, the read status, series and position of the story are
+        kept if it was already present
+
+        :param story: the row of the story, as in the stories table
+        :param characters: the characters of the story, as (name, pairing)
+        """
+        self.__logger.info(f'Saving the row of "{story[0]}"')
+        self.__write(
+            ('execute',
+             cst.STORIES_UPSERT,
+             tuple(story[:12]) + (False,) + tuple(story[15:])),
+            *self.__characters_statements(((story[0], characters),))
+        )
+        self.__notify((story[0],))
+        self.__logger.debug('Row saved')
 
     def delete_story(self, url: str):
         """
-        Deletes the given url
+        Deletes the given url. It is removed from its series too, which is
+        deleted if it was its last story
 
         :param url: url of the story to be deleted completely from the database
         """
         self.__logger.info(f'Deleting "{url}" from the database')
-        self.__cur.execute(f'DELETE FROM stories WHERE url="{url}"')
-        self.__conn.commit()
+        self.__write(('execute', 'DELETE FROM stories WHERE url=?', (url,)),
+                     ('execute', 'DELETE FROM chapters WHERE url=?', (url,)),
+                     ('execute', 'DELETE FROM characters WHERE url=?', (url,)))
+        self.__notify((url,))
         self.__logger.debug(f'Deleted')
 
     def get_value_by_url(self, column: str, url: str) -> list:
@@ -126,7 +347,8 @@ class DataHandler:
                  the wanted value in position [0]
         """
         self.__logger.info(f'Getting "{column}" for "{url}"')
-        self.__cur.execute(f'SELECT {column} FROM stories WHERE url="{url}"')
+        self.__cur.execute(f'SELECT {column} FROM stories_view WHERE url=?',
+                           (url,))
         values = [elem[0] for elem in self.__cur.fetchall()]
         self.__logger.debug(f'Got: {values}')
         return values
@@ -135,78 +357,707 @@ class DataHandler:
         """
         Update a value for a given url
 
-        :param column: the column in which the value should be updated
+        :param column: the column in which the value should be updated, of the
+                       stories table (see `.add_to_series()` for the series)
         :param value: the new value to use
         :param url: the url for which this change should take place
         """
         self.__logger.info(f'Setting "{column}" to {value} for "{url}"')
-        if type(value) == str:
-            # Ensure there is no bug with the sql
-            value = value.replace('"', "'")
-            cmd = f'UPDATE stories SET {column}="{value}" WHERE url="{url}"'
-            self.__logger.debug('Special handling is required')
-        else:
+        if type(value) != str:
             value = int(value)
-            cmd = f'UPDATE stories SET {column}={value} WHERE url="{url}"'
-            self.__logger.debug('No special handling required')
 
-        self.__cur.execute(cmd)
-        self.__conn.commit()
+        self.__write(('execute',
+                      f'UPDATE stories SET {column}=? WHERE url=?',
+                      (value, url)))
+        self.__notify((url,))
         self.__logger.debug('Set')
 
     def get_column(self, column: str, distinct=False, where=None) -> list:
         """
         Get the values for a given column from the database
 
-        :param column: the wanted column (must be present in the stories table)
+        :param column: the wanted column (must be present in the stories view)
         :param distinct: all the values or only the distinct one ?
-        :param where: to select more precisely. Should follow the pattern:
-            {column for the where}={value} if the value is numeric/boolean
-            {column for the where}="{value}" if it is a string
+        :param where: to select more precisely, the value wanted for some other
+                      columns, like {'site': site}
         :return: the different values for the wanted column
         """
         self.__logger.info(
             f'Getting "{column}" with distinct={distinct} WHERE {where}'
         )
         if distinct:
-            command = f'SELECT DISTINCT {column} FROM stories'
+            command = f'SELECT DISTINCT {column} FROM stories_view'
         else:
-            command = f'SELECT {column} FROM stories'
+            command = f'SELECT {column} FROM stories_view'
 
-        if where is not None:
-            command += f' WHERE {where}'
+        values = ()
+        if where:
+            command += ' WHERE ' + ' AND '.join(f'{where_column}=?'
+                                                for where_column in where)
+            values = tuple(where.values())
 
-        self.__cur.execute(command)
+        self.__cur.execute(command, values)
         values = [elem[0] for elem in self.__cur.fetchall()]
         self.__logger.debug(f'Got: {values}')
         return values
 
-    def get_stories_by_site(self, site: str) -> list:
+    def get_stories(self) -> list:
+        """
+        Get all the stories of the database
+
+        :return: the list containing the stories, unsorted
         """
-        Get the stories coming from 'site' and **append** them in 'to_list'.
-        Modify 'to_list' in place (like list.sort() does).
+        self.__logger.info('Getting all the stories')
+        self.__cur.execute('SELECT * FROM stories_view')
+        stories = self.__cur.fetchall()
+        self.__logger.debug(f'Got {len(stories)} stories')
+        return stories
+
+    def get_story(self, url: str):
+        """
+        Get the story whose url is 'url'
 
-        Be sure to empty 'to_list' before, because no check is done.
+        :param url: the url of the story
+        :return: its row, or None if it is not in the database
+        """
+        self.__logger.info(f'Getting the story: "{url}"')
+        self.__cur.execute('SELECT * FROM stories_view WHERE url=?', (url,))
+        story = self.__cur.fetchone()
+        self.__logger.debug(f'Got: {story}')
+        return story
+
+    def get_story_by_folder(self, folder: str):
+        """
+        Get the story saved in 'folder'
+
+        :param folder: the story's directory, {relative_path}/{story_dir}/
+        :return: its row, or None if no story is saved there
+        """
+        self.__logger.info(f'Getting the story saved in: "{folder}"')
+        self.__cur.execute(
+            'SELECT * FROM stories_view WHERE substr(path_to_index, 1, ?)=?',
+            (len(folder), folder.lower())
+        )
+        story = self.__cur.fetchone()
+        self.__logger.debug(f'Got: {story}')
+        return story
+
+    def get_stories_by_site(self, site: str) -> list:
+        """
+        Get the stories coming from 'site'
 
         :param site: the site to check for
         :return: the list containing the stories, sorted by title
         """
         self.__logger.info(f'Getting the stories for site: "{site}"')
-        self.__cur.execute(f'SELECT * FROM stories WHERE site="{site}"')
-        # Sort the stories by title
-        stories = sorted(self.__cur.fetchall(), key=lambda st: st[4])
+        # Already sorted by title in the index on (site, title)
+        self.__cur.execute(
+            'SELECT * FROM stories_view WHERE site=? ORDER BY title', (site,)
+        )
+        stories = self.__cur.fetchall()
         self.__logger.debug(f'Got: {stories}')
         return stories
 
+    def iter_stories_by_site(self, site: str):
+        """
+        Like `.get_stories_by_site()`, but the stories are read one at a time,
+        as they are used, instead of all being kept in memory
+
+        :param site: the site to check for
+        :return: a generator of the stories, sorted by title
+        """
+        self.__logger.info(f'Reading the stories for site: "{site}"')
+        # Its own cursor, so other queries can be made while iterating
+        cur = self.__conn.cursor()
+        try:
+            yield from cur.execute(
+                'SELECT * FROM stories_view WHERE site=? ORDER BY title',
+                (site,)
+            )
+        finally:
+            cur.close()
+
+    def iter_columns(self, columns, size: int):
+        """
+        Read some columns of every story, a chunk of rows at a time: only the
+        rows of one chunk are ever in memory
+
+        :param columns: the wanted columns of the stories table, or SQL
+                        expressions of them
+        :param size: the number of rows in a chunk
+        :return: a generator of the chunks, as lists of rows
+        """
+        self.__logger.info(f'Reading {", ".join(columns)} of every story')
+        # Its own cursor, so other queries can be made while iterating
+        cur = self.__conn.cursor()
+        try:
+            cur.execute(f'SELECT {", ".join(columns)} FROM stories')
+            chunk = cur.fetchmany(size)
+            while len(chunk) != 0:
+                yield chunk
+                chunk = cur.fetchmany(size)
+        finally:
+            cur.close()
+
+    def get_site_statistics(self, site: str):
+        """
+        Get the statistics of a site, kept up to date by the database itself
+        as the stories change (see constants.SITE_STATISTICS_TRIGGERS)
+
+        :param site: the site to check for
+        :return: None if the site has no stories, else its numbers of stories,
+                 chapters, words, read and unread stories, authors, universes
+                 and series, by name
+        """
+        self.__logger.info(f'Getting the statistics of "{site}"')
+        self.__cur.execute(
+            "SELECT stories, chapters, words, read, "
+            "(SELECT COUNT(*) FROM site_values "
+            "WHERE site=site_statistics.site AND kind='author'), "
+            "(SELECT COUNT(*) FROM site_values "
+            "WHERE site=site_statistics.site AND kind='universe'), "
+            "(SELECT COUNT(*) FROM site_values "
+            "WHERE site=site_statistics.site AND kind='series') "
+            "FROM site_statistics WHERE site=?",
+            (site,)
+        )
+        row = self.__cur.fetchone()
+        if row is None:
+            self.__logger.debug('No stories')
+            return None
+
+        statistics = dict(zip(('stories', 'chapters', 'words', 'read',
+                               'authors', 'universes', 'series'), row))
+        statistics['unread'] = statistics['stories'] - statistics['read']
+        self.__logger.debug(f'Got: {statistics}')
+        return statistics
+
     def get_urls_by_series(self, series: str) -> list:
         """
         Get the urls belonging to a given series
 
         :param series: the series to check for
-        :return: the urls belonging to this series, unsorted
+        :return: the urls belonging to this series, by position
         """
         self.__logger.info(f'Getting the stories for series: "{series}"')
-        self.__cur.execute(f'SELECT url FROM stories WHERE series="{series}"')
+        self.__cur.execute(
+            'SELECT url FROM series_members '
+            'WHERE series=(SELECT id FROM series WHERE name=?) '
+            'ORDER BY position',
+            (series,)
+        )
         stories = [elem[0] for elem in self.__cur.fetchall()]
         self.__logger.debug(f'Got: {stories}')
         return stories
+
+    def add_to_series(self, series: str, urls) -> dict:
+        """
+        Add stories at the end of a series, in order, creating it if needed.
+        They leave the series they were in
+
+        :param series: the name of the series, not ''
+        :param urls: the urls of the stories. Those already in the series stay
+                     where they are
+        :return: the position of each story in the series, by url
+        :raise: sqlite3.IntegrityError if a story is not saved
+        """
+        urls = list(dict.fromkeys(urls))
+        self.__logger.info(f'Adding {len(urls)} stories to "{series}"')
+        self.__write(
+            ('execute',
+             'INSERT OR IGNORE INTO series (name) VALUES (?)',
+             (series,)),
+            ('executemany',
+             'INSERT INTO series_members (url, series, position) '
+             'SELECT ?, id, (SELECT COALESCE(MAX(position), 0) + 1 '
+             'FROM series_members WHERE series=series.id) '
+             'FROM series WHERE name=? '
+             'ON CONFLICT (url) DO UPDATE SET '
+             'series=excluded.series, position=excluded.position '
+             'WHERE series_members.series!=excluded.series',
+             [(url, series) for url in urls]),
+        )
+        self.__notify(urls)
+
+        self.__cur.execute(
+            f'SELECT url, position FROM series_members '
+            f'WHERE url IN ({",".join("?" * len(urls))})',
+            urls
+        )
+        positions = dict(self.__cur.fetchall())
+        self.__logger.debug(f'Added: {positions}')
+        return positions
+
+    def remove_from_series(self, urls):
+        """
+        Remove stories from their series, which is deleted once it has no
+        stories anymore
+
+        :param urls: the urls of the stories, in a series or not
+        """
+        urls = list(urls)
+        self.__logger.info(f'Removing {len(urls)} stories from their series')
+        self.__write(('executemany',
+                      'DELETE FROM series_members WHERE url=?',
+                      [(url,) for url in urls]))
+        self.__notify(urls)
+
+    def rename_series(self, series: str, new_name: str):
+        """
+        Rename a series, its stories keeping their position
+
+        :param series: the current name of the series
+        :param new_name: its new name, not used by another series
+        :raise: sqlite3.IntegrityError if the new name is already used
+        """
+        self.__logger.info(f'Renaming "{series}" to "{new_name}"')
+        urls = self.get_urls_by_series(series)
+        self.__write(('execute',
+                      'UPDATE series SET name=? WHERE name=?',
+                      (new_name, series)))
+        self.__notify(urls)
+
+    def delete_series(self, series: str):
+        """
+        Delete a series, not its stories
+
+        :param series: the name of the series
+        """
+        self.__logger.info(f'Deleting the series "{series}"')
+        urls = self.get_urls_by_series(series)
+        # Its stories are removed from it by their foreign key
+        self.__write(('execute', 'DELETE FROM series WHERE name=?', (series,)))
+        self.__notify(urls)
+
+    def get_characters(self, url: str) -> list:
+        """
+        Get the characters of a story
+
+        :param url: the url of the story
+        :return: the characters as (name, pairing), by pairing then name
+        """
+        self.__logger.info(f'Getting the characters of "{url}"')
+        self.__cur.execute(
+            'SELECT name, pairing FROM characters WHERE url=? '
+            'ORDER BY pairing, name',
+            (url,)
+        )
+        characters = self.__cur.fetchall()
+        self.__logger.debug(f'Got: {characters}')
+        return characters
+
+    def get_all_characters(self) -> dict:
+        """
+        Get the characters of every story, in a single query
+
+        :return: the characters of each story by url, as returned by
+                 `.get_characters()`
+        """
+        self.__logger.info('Getting all the characters')
+        self.__cur.execute('SELECT url, name, pairing FROM characters '
+                           'ORDER BY url, pairing, name')
+        characters = {}
+        for url, *character in self.__cur:
+            characters.setdefault(url, []).append(tuple(character))
+        self.__logger.debug(f'Got the characters of {len(characters)} stories')
+        return characters
+
+    @staticmethod
+    def __facets_conditions(site: str, filters: dict) -> tuple:
+        """
+        :param site: the site of the stories
+        :param filters: the values wanted for some columns of the stories table,
+                        one of them being enough, by column. For 'series',
+                        the names of the series ('' for none), and for
+                        'characters', the names of characters all in the
+                        stories
+        :return: the conditions on the stories table and their values
+        """
+        conditions = ['stories.site=?']
+        values = [site]
+        for column, wanted in filters.items():
+            wanted = list(wanted)
+            if column == 'characters':
+                conditions.extend(
+                    'stories.url IN (SELECT url FROM characters WHERE name=?)'
+                    for _ in wanted
+                )
+                values.extend(wanted)
+                continue
+
+            if column == 'series':
+                names = [name for name in wanted if name != '']
+                condition = (
+                    f'stories.url IN (SELECT url FROM series_members '
+                    f'JOIN series ON series.id=series_members.series '
+                    f'WHERE series.name IN ({",".join("?" * len(names))}))'
+                )
+                if '' in wanted:
+                    condition = (f'({condition} OR stories.url NOT IN '
+                                 f'(SELECT url FROM series_members))')
+                conditions.append(condition)
+                values.extend(names)
+                continue
+
+            condition = f'stories.{column} IN ({",".join("?" * len(wanted))})'
+            # NULL is equal to nothing, not even itself
+            if None in wanted:
+                condition = f'({condition} OR stories.{column} IS NULL)'
+            conditions.append(condition)
+            values.extend(wanted)
+
+        return ' AND '.join(conditions), values
+
+    def count_facet(self, site: str, column: str, filters: dict) -> list:
+        """
+        Count the stories of a site by their value for a column
+
+        :param site: the site of the stories
+        :param column: a column of the stories table, 'series' to count the
+                       stories of each series or 'characters' to count those of
+                       each character
+        :param filters: the values wanted for other columns, see
+                        `.get_urls_by_facets()`
+        :return: the values and the number of stories having each, as
+                 (value, count)
+        """
+        self.__logger.debug(f'Counting "{column}" for "{site}": {filters}')
+        conditions, values = self.__facets_conditions(site, filters)
+        if column == 'characters':
+            self.__cur.execute(
+                f'SELECT characters.name, COUNT(*) FROM characters '
+                f'JOIN stories ON stories.url=characters.url '
+                f'WHERE {conditions} GROUP BY characters.name',
+                values
+            )
+        elif column == 'series':
+            self.__cur.execute(
+                f'SELECT COALESCE(series.name, \'\'), COUNT(*) FROM stories '
+                f'LEFT JOIN series_members ON series_members.url=stories.url '
+                f'LEFT JOIN series ON series.id=series_members.series '
+                f'WHERE {conditions} GROUP BY 1',
+                values
+            )
+        else:
+            self.__cur.execute(
+                f'SELECT {column}, COUNT(*) FROM stories '
+                f'WHERE {conditions} GROUP BY {column}',
+                values
+            )
+        return self.__cur.fetchall()
+
+    def get_urls_by_facets(self, site: str, filters: dict) -> list:
+        """
+        Get the stories of a site having the wanted values
+
+        :param site: the site of the stories
+        :param filters: the values wanted for some columns of the stories table,
+                        one of them being enough, by column. For 'series' and
+                        'characters', see `.__facets_conditions()`
+        :return: the urls of the stories, sorted by title
+        """
+        self.__logger.info(f'Getting the stories of "{site}" for: {filters}')
+        conditions, values = self.__facets_conditions(site, filters)
+        self.__cur.execute(
+            f'SELECT url FROM stories WHERE {conditions} ORDER BY title',
+            values
+        )
+        urls = [elem[0] for elem in self.__cur.fetchall()]
+        self.__logger.debug(f'Got {len(urls)} stories')
+        return urls
+
+    def find_stories(self, characters=(), paired=False, min_words=None,
+                     updated_since=None, **columns) -> list:
+        """
+        Get the stories matching all the given criteria, each of them being
+        answered by an index, like the complete stories pairing Harry and
+        Hermione over 100k words updated this year:
+
+            find_stories(('Harry P.', 'Hermione G.'), paired=True,
+                         min_words=100000, updated_since='2018-01-01',
+                         status='Complete')
+
+        :param characters: the names of characters all in the stories
+        :param paired: whether those characters must be paired together
+        :param min_words: the minimum number of words of the stories
+        :param updated_since: the earliest date of their last update, as
+                              YYYY-MM-DD
+        :param columns: the value wanted for some columns of the stories table
+        :return: the rows of the stories, sorted by title
+        """
+        self.__logger.info(f'Finding stories: {characters} (paired={paired}),'
+                           f' {min_words} words, updated since '
+                           f'{updated_since}, {columns}')
+        conditions = [f'{column}=?' for column in columns]
+        values = list(columns.values())
+        if min_words is not None:
+            conditions.append('word_count>=?')
+            values.append(min_words)
+        if updated_since is not None:
+            conditions.append('updated>=?')
+            values.append(updated_since)
+        if len(characters) != 0:
+            # Each character is only once in a story: having them all is
+            # having as many rows as there are characters (in the same pairing)
+            conditions.append(
+                f'url IN (SELECT url FROM characters '
+                f'WHERE name IN ({",".join("?" * len(characters))})'
+                f'{" AND pairing>0" if paired else ""} '
+                f'GROUP BY url{", pairing" if paired else ""} '
+                f'HAVING COUNT(*)=?)'
+            )
+            values.extend(characters)
+            values.append(len(set(characters)))
+
+        command = 'SELECT * FROM stories_view'
+        if len(conditions) != 0:
+            command += f' WHERE {" AND ".join(conditions)}'
+        self.__cur.execute(f'{command} ORDER BY title', values)
+        stories = self.__cur.fetchall()
+        self.__logger.debug(f'Got {len(stories)} stories')
+        return stories
+
+    @staticmethod
+    def __match_query(text: str) -> str:
+        """
+        :param text: the words searched, as typed by the user
+        :return: the FTS5 query finding the texts containing all the words, the
+                 last one possibly not typed entirely
+        """
+        # Quoted, nothing typed is taken for the syntax of FTS5
+        terms = ['"' + word.replace('"', '""') + '"' for word in text.split()]
+        terms[-1] += '*'
+        return ' '.join(terms)
+
+    def can_search(self) -> bool:
+        """
+        :return: False if SQLite has no FTS5: nothing can be searched, and
+                 nothing is indexed
+        """
+        return self.__searchable
+
+    def search_stories(self, text: str, limit=None) -> list:
+        """
+        Search the stories by their title, author and summary, the title
+        counting the most
+
+        :param text: the words searched, all of them in each story found
+        :param limit: the number of stories to get, constants.SEARCH_RESULTS by
+                      default
+        :return: the url of the best stories and an extract of what was found,
+                 as (url, snippet), the best first
+        """
+        self.__logger.info(f'Searching the stories for "{text}"')
+        if text.strip() == '' or not self.__searchable:
+            return []
+        self.__cur.execute(
+            'SELECT url, snippet(stories_search, -1, \'[\', \']\', \'…\', ?) '
+            'FROM stories_search WHERE stories_search MATCH ? '
+            'ORDER BY bm25(stories_search, 0, 10, 5, 1) LIMIT ?',
+            (cst.SEARCH_SNIPPET_WORDS, DataHandler.__match_query(text),
+             cst.SEARCH_RESULTS if limit is None else limit)
+        )
+        stories = self.__cur.fetchall()
+        self.__logger.debug(f'Found {len(stories)} stories')
+        return stories
+
+    def search_chapters(self, text: str, limit=None) -> list:
+        """
+        Search the texts of the chapters indexed (see `.index_chapter_text()`)
+
+        :param text: the words searched, all of them in each chapter found
+        :param limit: the number of texts to get, constants.SEARCH_RESULTS by
+                      default. A text can be used by several chapters
+        :return: the best chapters, as (url, number, content_hash), the best
+                 first
+        """
+        self.__logger.info(f'Searching the chapters for "{text}"')
+        if text.strip() == '' or not self.__searchable:
+            return []
+        # Ranked and limited in the full-text index itself, which is faster
+        self.__cur.execute(
+            'SELECT chapters.url, chapters.number, chapters.content_hash '
+            'FROM (SELECT rowid, rank FROM chapters_search '
+            'WHERE chapters_search MATCH ? ORDER BY rank LIMIT ?) AS found '
+            'JOIN chapters_search_texts '
+            'ON chapters_search_texts.id=found.rowid '
+            'JOIN chapters '
+            'ON chapters.content_hash=chapters_search_texts.content_hash '
+            'ORDER BY found.rank, chapters.url, chapters.number',
+            (DataHandler.__match_query(text),
+             cst.SEARCH_RESULTS if limit is None else limit)
+        )
+        chapters = self.__cur.fetchall()
+        self.__logger.debug(f'Found {len(chapters)} chapters')
+        return chapters
+
+    def index_chapter_text(self, content_hash: str, text: str):
+        """
+        Add the text of a chapter to the full-text index, if it is not already
+
+        :param content_hash: the sha1 of the chapter's text
+        :param text: the text to index, without HTML (see tools.html_to_text())
+        """
+        if not self.__searchable:
+            return
+
+        self.__cur.execute(
+            'SELECT 1 FROM chapters_search_texts WHERE content_hash=?',
+            (content_hash,)
+        )
+        if self.__cur.fetchone() is not None:
+            return
+
+        self.__logger.debug(f'Indexing {content_hash}')
+        self.__write(
+            ('execute',
+             'INSERT OR IGNORE INTO chapters_search_texts (content_hash) '
+             'VALUES (?)',
+             (content_hash,)),
+            # Only if the hash was not inserted meanwhile by another thread
+            ('execute',
+             'INSERT INTO chapters_search (rowid, text) '
+             'SELECT id, ? FROM chapters_search_texts '
+             'WHERE content_hash=? AND changes()=1',
+             (text, content_hash)),
+        )
+
+    def get_chapters(self, url: str) -> list:
+        """
+        Get the chapters registered for a story
+
+        :param url: the url of the story
+        :return: the chapters as tuples (number, title, content_hash, byte_size,
+                 fetched_at, status), sorted by number
+        """
+        self.__logger.info(f'Getting the chapters for "{url}"')
+        self.__cur.execute(
+            'SELECT number, title, content_hash, byte_size, fetched_at, status '
+            'FROM chapters WHERE url=? ORDER BY number',
+            (url,)
+        )
+        chapters = self.__cur.fetchall()
+        self.__logger.debug(f'Got {len(chapters)} chapters')
+        return chapters
+
+    def get_all_chapters(self) -> dict:
+        """
+        Get the chapters registered for every story, in a single query
+
+        :return: the chapters of each story by url, as returned by
+                 `.get_chapters()`
+        """
+        self.__logger.info('Getting all the chapters')
+        self.__cur.execute(
+            'SELECT url, number, title, content_hash, byte_size, fetched_at, '
+            'status FROM chapters ORDER BY url, number'
+        )
+        chapters = {}
+        for url, *chapter in self.__cur:
+            chapters.setdefault(url, []).append(tuple(chapter))
+        self.__logger.debug(f'Got the chapters of {len(chapters)} stories')
+        return chapters
+
+    def add_chapter(self, url: str, number: int, title: str,
+                    content_hash: str, byte_size: int, status: str,
+                    fetched_at=None):
+        """
+        Register a chapter of a story, replacing any previous entry for it
+
+        :param url: the url of the story
+        :param number: the number of the chapter
+        :param title: the title of the chapter
+        :param content_hash: the sha1 of the chapter's text
+        :param byte_size: the size of the chapter's file, in bytes
+        :param status: either cst.CHAPTER_PENDING or cst.CHAPTER_COMPLETE
+        :param fetched_at: when the chapter's text was fetched (ISO format).
+                           Now by default
+        """
+        self.__logger.debug(f'Setting chapter {number} of "{url}" as {status}')
+        if fetched_at is None:
+            fetched_at = datetime.datetime.now().isoformat(timespec='seconds')
+        self.__write((
+            'execute',
+            'INSERT OR REPLACE INTO chapters VALUES (?,?,?,?,?,?,?)',
+            (url, number, title, content_hash, byte_size, fetched_at, status)
+        ))
+
+    def set_chapters(self, url: str, chapters):
+        """
+        Replace all the chapters registered for a story, in a single
+        transaction
+
+        :param url: the url of the story
+        :param chapters: the chapters, as returned by `.get_chapters()`
+        """
+        self.__logger.debug(f'Setting the chapters of "{url}"')
+        self.__write(
+            ('execute', 'DELETE FROM chapters WHERE url=?', (url,)),
+            ('executemany',
+             'INSERT INTO chapters VALUES (?,?,?,?,?,?,?)',
+             [(url, *chapter) for chapter in chapters]),
+        )
+
+    def set_chapters_size(self, url: str, sizes: dict):
+        """
+        Update the size registered for the files of some chapters, when they
+        were modified without fetching the chapters again
+
+        :param url: the url of the story
+        :param sizes: the new size of the file of each chapter, in bytes, by
+                      chapter number
+        """
+        self.__logger.debug(f'Setting the size of {len(sizes)} chapters')
+        self.__write((
+            'executemany',
+            'UPDATE chapters SET byte_size=? WHERE url=? AND number=?',
+            [(byte_size, url, number) for number, byte_size in sizes.items()]
+        ))
+
+    def mark_chapters_pending(self, url: str, numbers):
+        """
+        Mark the given chapters as pending: they are to be written again. Does
+        nothing for chapters which were never registered
+
+        :param url: the url of the story
+        :param numbers: the numbers of the chapters
+        """
+        self.__logger.debug(f'Marking chapters as pending for "{url}"')
+        self.__write((
+            'executemany',
+            'UPDATE chapters SET status=? WHERE url=? AND number=?',
+            [(cst.CHAPTER_PENDING, url, number) for number in numbers]
+        ))
+
+    def delete_chapters(self, url: str, frm=1):
+        """
+        Delete the chapters of a story from the database
+
+        :param url: the url of the story
+        :param frm: the first chapter to delete, the following ones are deleted
+                    too. By default, all the chapters are deleted
+        """
+        self.__logger.info(f'Deleting chapters from {frm} for "{url}"')
+        self.__write(('execute',
+                      'DELETE FROM chapters WHERE url=? AND number>=?',
+                      (url, frm)))
+
+    def get_unused_hashes(self, hashes) -> list:
+        """
+        Get the content hashes which no chapter uses anymore, notably to know
+        which raw chapters can be deleted
+
+        :param hashes: the content hashes to check
+        :return: those which are not registered for any chapter
+        """
+        self.__logger.info('Getting unused content hashes')
+        unused = []
+        for content_hash in set(hashes):
+            self.__cur.execute(
+                'SELECT 1 FROM chapters WHERE content_hash=? LIMIT 1',
+                (content_hash,)
+            )
+            if self.__cur.fetchone() is None:
+                unused.append(content_hash)
+        self.__logger.debug(f'Got {len(unused)} unused hashes')
+        return unused
@@ -0,0 +1,375 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import os
+import queue
+import threading
+import sqlite3 as sql
+import urllib.request
+import concurrent.futures as cf
+
+import utilities.tools as tls
+import utilities.constants as cst
+
+# The writer of each database, by process and absolute path to the database
+_WRITERS = {}
+_WRITERS_LOCK = threading.Lock()
+
+
+class MigrationError(Exception):
+    """
+    A migration of the database failed (see constants.DATABASE_MIGRATIONS).
+    It was rolled back: the database is left as it was, healthy, and must not
+    be taken for a corrupted one
+    """
+
+
+def is_corrupted(database_file: str) -> bool:
+    """
+    Tell whether a database which could not be opened is actually corrupted,
+    rather than locked by another program or unreadable
+
+    :param database_file: the path to the database
+    :return: True if it is not a database or fails its integrity check
+    """
+    uri = urllib.request.pathname2url(os.path.abspath(database_file))
+    try:
+        conn = sql.connect(f'file:{uri}?mode=ro', uri=True)
+        try:
+            result = conn.execute('PRAGMA integrity_check').fetchall()
+        finally:
+            conn.close()
+    # Locked, missing or not readable: nothing says it is corrupted
+    except sql.OperationalError:
+        return False
+    except sql.DatabaseError:
+        return True
+    return result != [('ok',)]
+
+
+def check_sqlite_version():
+    """
+    Check that the version of SQLite used by Python can run the queries of the
+    program. An older one would fail on a perfectly healthy database
+
+    :raise: RuntimeError if it is older than constants.SQLITE_MIN_VERSION
+    """
+    if sql.sqlite_version_info < cst.SQLITE_MIN_VERSION:
+        raise RuntimeError(
+            f'SQLite {".".join(map(str, cst.SQLITE_MIN_VERSION))} or higher '
+            f'is needed, Python uses SQLite {sql.sqlite_version}. Install a '
+            f'version of Python which comes with a newer one'
+        )
+
+
+def _parse_details(cur: sql.Cursor):
+    """
+    Fill the details of the stories already saved from their curated tokens.
+    Those not part of the curated tokens (the dates and counts, notably) are
+    filled when the story is updated
+
+    :param cur: a cursor of the database, in the migration's transaction
+    """
+    # Registers the sites in constants.SITES
+    import utilities.story_writer
+
+    cur.execute('SELECT url, site, curated_tokens FROM stories')
+    stories = cur.fetchall()
+    rows = []
+    characters = []
+    for url, site, curated_tokens in stories:
+        try:
+            details = cst.SITES[site][0].parse_details(curated_tokens)
+        except (KeyError, AttributeError, IndexError, ValueError):
+            continue
+        rows.append(tuple(details[column] for column in cst.STORY_DETAILS) +
+                    (url,))
+        characters.extend((url, name, pairing)
+                          for name, pairing in details['characters'])
+
+    cur.executemany(
+        f'UPDATE stories SET '
+        f'{", ".join(f"{column}=?" for column in cst.STORY_DETAILS)} '
+        f'WHERE url=?',
+        rows
+    )
+    cur.executemany('INSERT OR IGNORE INTO characters VALUES (?,?,?)',
+                    characters)
+
+
+# What cannot be done in SQL when migrating the database, by version reached
+# (see constants.DATABASE_MIGRATIONS)
+_MIGRATION_STEPS = {1: _parse_details}
+
+# The statements of the migrations making the full-text search, skipped if
+# SQLite has no FTS5 (see DatabaseWriter.__setup_search())
+_SEARCH_STATEMENTS = frozenset(cst.STORIES_SEARCH_CREATION +
+                               cst.CHAPTERS_SEARCH_CREATION)
+
+
+def _has_fts5(cur: sql.Cursor) -> bool:
+    """
+    :param cur: a cursor of a connection to SQLite
+    :return: True if SQLite has the FTS5 extension, needed by the full-text
+             search. Some builds lack it
+    """
+    try:
+        cur.execute('CREATE VIRTUAL TABLE temp.fts5_check USING fts5(text)')
+    except sql.OperationalError:
+        return False
+    cur.execute('DROP TABLE temp.fts5_check')
+    return True
+
+
+class DatabaseWriter:
+    """
+    The only connection allowed to write in a database. It belongs to a
+    thread which executes the writes asked by every other thread, one after
+    the other, so no thread ever waits on a lock of SQLite.
+
+    The writes waiting when the thread is free are done together, in a single
+    transaction: the more threads write at the same time, the less commits
+    there are. Each write is in its own savepoint, so one failing does not
+    cancel the others.
+    """
+    def __init__(self, database_file: str):
+        """
+        :param database_file: the path to the database, created if needed
+        :raise: sqlite3.DatabaseError if the database is unusable
+                MigrationError if it could not be migrated
+                RuntimeError if SQLite is too old (see check_sqlite_version())
+        """
+        self.__logger = tls.setup_logging('DatabaseWriter')
+        check_sqlite_version()
+
+        # Transactions are handled manually, see .__execute()
+        self.__conn = sql.connect(database_file,
+                                  isolation_level=None,
+                                  check_same_thread=False)
+        try:
+            self.__setup()
+        except (sql.Error, MigrationError):
+            self.__conn.close()
+            raise
+        # To know if the database was replaced since (see get_writer())
+        self.__stat = os.stat(database_file)
+
+        self.__queue = queue.Queue()
+        threading.Thread(target=self.__run, daemon=True).start()
+
+    def __setup(self):
+        """
+        Set the database up, before the thread starts: its settings, tables and
+        indexes
+
+        :raise: MigrationError if a migration failed, rolled back
+        """
+        cur = self.__conn.cursor()
+        for pragma in cst.DATABASE_PRAGMAS:
+            cur.execute(pragma)
+
+        for table_creation in (cst.STORIES_TABLE_CREATION,
+                               cst.CHAPTERS_TABLE_CREATION,
+                               cst.CHAPTERS_HASH_INDEX_CREATION):
+            try:
+                cur.execute(table_creation)
+            # Error if the table already exists
+            except sql.OperationalError as err:
+                self.__logger.debug(f'DatabaseWriter: {err}')
+            else:
+                self.__logger.info('Database setup-ed')
+
+        fts5 = _has_fts5(cur)
+        cur.execute('PRAGMA user_version')
+        version = cur.fetchone()[0]
+        for version, migration in enumerate(
+                cst.DATABASE_MIGRATIONS[version:], version + 1):
+            self.__logger.info(f'Migrating the database to version {version}')
+            cur.execute('BEGIN')
+            try:
+                for statement in migration:
+                    if fts5 or statement not in _SEARCH_STATEMENTS:
+                        cur.execute(statement)
+                if version in _MIGRATION_STEPS:
+                    _MIGRATION_STEPS[version](cur)
+                cur.execute(f'PRAGMA user_version={version}')
+            # Whatever failed, the migration is cancelled
+            except Exception as err:
+                cur.execute('ROLLBACK')
+                raise MigrationError(
+                    f'The migration of the database to version {version} '
+                    f'failed: {err}'
+                ) from err
+            cur.execute('COMMIT')
+
+        # Also done for the databases created before the indexes existed, and
+        # after the migrations which copy the stories table without them
+        for index_creation in cst.STORIES_INDEXES_CREATION:
+            cur.execute(index_creation)
+
+        self.__setup_search(cur, fts5)
+
+    def __setup_search(self, cur: sql.Cursor, fts5: bool):
+        """
+        Make the full-text search match the SQLite in use. Without FTS5, there
+        are neither search tables nor the triggers filling them: a trigger
+        using them would make every write to the stories fail. They are made
+        as soon as SQLite has FTS5
+
+        :param cur: a cursor of the writer's connection
+        :param fts5: whether SQLite has FTS5
+        """
+        cur.execute("SELECT name FROM sqlite_master WHERE name IN "
+                    "('stories_search', 'stories_search_insert')")
+        names = {row[0] for row in cur.fetchall()}
+
+        if not fts5:
+            self.__logger.warning('SQLite has no FTS5, nothing can be searched')
+            statements = [f'DROP TRIGGER stories_search_{trigger}'
+                          for trigger in ('insert', 'update', 'delete')
+                          if 'stories_search_insert' in names]
+        elif 'stories_search' not in names:
+            statements = (cst.STORIES_SEARCH_CREATION +
+                          cst.CHAPTERS_SEARCH_CREATION)
+        # Its triggers were dropped while SQLite had no FTS5: it is filled again
+        elif 'stories_search_insert' not in names:
+            statements = (('DELETE FROM stories_search',) +
+                          cst.STORIES_SEARCH_CREATION[1:])
+        else:
+            statements = []
+        if len(statements) == 0:
+            return
+
+        self.__logger.info('Setting the full-text search up')
+        cur.execute('BEGIN')
+        try:
+            for statement in statements:
+                cur.execute(statement)
+        except sql.Error:
+            cur.execute('ROLLBACK')
+            raise
+        cur.execute('COMMIT')
+
+    def write(self, statements) -> cf.Future:
+        """
+        Ask for some statements to be executed in a single transaction
+
+        :param statements: the statements, as (method, query, parameters) where
+                           method is 'execute' or 'executemany'
+        :return: a future whose result is the number of rows changed, set once
+                 they are committed
+        """
+        future = cf.Future()
+        self.__queue.put((list(statements), future))
+        return future
+
+    def close(self):
+        """
+        Stop the writer once the writes already asked for are done
+        """
+        self.__queue.put(None)
+
+    def is_writing_in(self, database_file: str) -> bool:
+        """
+        :param database_file: the path to the database
+        :return: False if the database was deleted or replaced since the writer
+                 was started
+        """
+        try:
+            return os.path.samestat(self.__stat, os.stat(database_file))
+        except FileNotFoundError:
+            return False
+
+    def __run(self):
+        """
+        Executed in the thread of the writer: execute the writes as they come,
+        those waiting being grouped in the same transaction
+        """
+        closing = False
+        while not closing:
+            requests = [self.__queue.get()]
+            while len(requests) < cst.DATABASE_WRITER_BATCH_SIZE:
+                try:
+                    requests.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in requests:
+                closing = True
+                requests.remove(None)
+                if len(requests) == 0:
+                    break
+
+            self.__logger.debug(f'Writing {len(requests)} requests')
+            try:
+                results = self.__execute(requests)
+            except sql.Error as err:
+                self.__logger.error(f'Could not commit: {err}')
+                for _, future in requests:
+                    if not future.done():
+                        future.set_exception(err)
+                continue
+
+            for (_, future), result in zip(requests, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+        self.__conn.close()
+        self.__logger.debug('Writer stopped')
+
+    def __execute(self, requests: list) -> list:
+        """
+        :param requests: the statements and future of each write
+        :return: the number of rows changed by each write (by its statements
+                 themselves), or the error it raised
+        :raise: sqlite3.Error if the transaction could not be committed
+        """
+        cur = self.__conn.cursor()
+        results = []
+        cur.execute('BEGIN')
+        try:
+            for statements, _ in requests:
+                changes = 0
+                cur.execute('SAVEPOINT write')
+                try:
+                    for method, query, parameters in statements:
+                        getattr(cur, method)(query, parameters)
+                        # Without the rows changed by the triggers and the
+                        # foreign keys, -1 if the statement changes none
+                        changes += max(cur.rowcount, 0)
+                # Whatever the error, it is the caller's: the thread goes on
+                except Exception as err:
+                    cur.execute('ROLLBACK TO write')
+                    results.append(err)
+                else:
+                    results.append(changes)
+                cur.execute('RELEASE write')
+            cur.execute('COMMIT')
+        except sql.Error:
+            if self.__conn.in_transaction:
+                cur.execute('ROLLBACK')
+            raise
+
+        return results
+
+
+def get_writer(database_file: str) -> DatabaseWriter:
+    """
+    :param database_file: the path to the database
+    :return: the writer of the database, started on the first call or if the
+             database was replaced since
+    :raise: sqlite3.DatabaseError if the database is unusable
+            MigrationError if it could not be migrated
+    """
+    # A child process does not inherit the thread of its parent's writer
+    key = (os.getpid(), os.path.abspath(database_file))
+    with _WRITERS_LOCK:
+        writer = _WRITERS.get(key)
+        if writer is None or not writer.is_writing_in(database_file):
+            if writer is not None:
+                writer.close()
+            writer = DatabaseWriter(database_file)
+            _WRITERS[key] = writer
+        return writer
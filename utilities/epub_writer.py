@@ -0,0 +1,269 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import io
+import os
+import re
+import html
+import zipfile
+import html.parser
+import xml.sax.saxutils as saxutils
+import concurrent.futures as cf
+
+import utilities.tools as tls
+import utilities.constants as cst
+import utilities.library as lb
+
+
+def _escape(text: str) -> str:
+    """
+    :param text: a text coming from a site, which may contain HTML entities
+    :return: the same text, escaped for XML
+    """
+    return html.escape(html.unescape(text), quote=True)
+
+
+class _XHTMLWriter(html.parser.HTMLParser):
+    """
+    Write the HTML of the sites as well-formed XHTML, which e-readers expect:
+    every entity is decoded then the text escaped for XML, the attributes are
+    all given a quoted value, the void elements are closed and so are the
+    elements the sites leave open
+    """
+    def __init__(self):
+
+        super(_XHTMLWriter, self).__init__(convert_charrefs=True)
+        self.__parts = []
+        # The elements opened and not closed yet
+        self.__open = []
+
+    def to_xhtml(self, text: str) -> str:
+        """
+        :param text: some HTML
+        :return: the same, as XHTML
+        """
+        self.feed(text)
+        self.close()
+        self.__parts.extend(f'</{tag}>' for tag in reversed(self.__open))
+        return ''.join(self.__parts)
+
+    def handle_starttag(self, tag, attrs):
+
+        start = self.__start(tag, attrs)
+        if start is None:
+            return
+        if tag in cst.EPUB_VOID_ELEMENTS:
+            self.__parts.append(f'{start}/>')
+        else:
+            self.__parts.append(f'{start}>')
+            self.__open.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+
+        start = self.__start(tag, attrs)
+        if start is not None:
+            self.__parts.append(f'{start}/>')
+
+    def handle_endtag(self, tag):
+
+        # An element closed without being opened is ignored
+        if tag not in self.__open:
+            return
+        # Those opened inside it and left open are closed with it
+        while True:
+            opened = self.__open.pop()
+            self.__parts.append(f'</{opened}>')
+            if opened == tag:
+                break
+
+    def handle_data(self, data):
+
+        self.__parts.append(saxutils.escape(data))
+
+    @staticmethod
+    def __start(tag: str, attrs: list):
+        """
+        :param tag: the name of the element
+        :param attrs: its attributes, as (name, value), the value being None
+                      for the minimized ones
+        :return: the start of its tag, without the closing '>', or None if the
+                 name cannot be used in XML (the element is then left out)
+        """
+        if re.fullmatch(cst.RE_XML_NAME, tag) is None:
+            return None
+        attributes = {}
+        for name, value in attrs:
+            if re.fullmatch(cst.RE_XML_NAME, name) is not None:
+                # <option selected> is <option selected="selected">
+                attributes.setdefault(name, name if value is None else value)
+        return '<{}{}'.format(
+            tag,
+            ''.join(f' {name}={saxutils.quoteattr(value)}'
+                    for name, value in attributes.items())
+        )
+
+
+def _to_xhtml(text: str) -> str:
+    """
+    :param text: the text of a chapter, or any HTML from a site
+    :return: the text, as well-formed XHTML
+    """
+    return _XHTMLWriter().to_xhtml(text)
+
+
+def _open_text(epub: zipfile.ZipFile, name: str) -> io.TextIOWrapper:
+    """
+    :param epub: the EPUB being written
+    :param name: the name of a file inside it
+    :return: the file, opened to write text directly in the archive
+    """
+    return io.TextIOWrapper(epub.open(name, 'w'), encoding='utf-8')
+
+
+def write_epub(story: tuple, chapters=None) -> str:
+    """
+    Write the EPUB of a saved story, in `constants.EPUB_FOLDER`. The chapters
+    are read and written in the archive one at a time, so the memory used does
+    not depend on the size of the story
+
+    :param story: the story's row in the stories table
+    :param chapters: the chapters registered for the story, as returned by
+                     `DataHandler.get_chapters()`
+    :return: the path to the EPUB
+    """
+    logger = tls.setup_logging('epub')
+    local_story = lb.LocalStory(story, chapters)
+    logger.info(f'Writing EPUB for "{local_story.url}"')
+
+    folder = f'{cst.EPUB_FOLDER}/{local_story.relative_path}'
+    os.makedirs(folder, exist_ok=True)
+    # The story's directory is unique, unlike its title
+    path = f'{folder}/{local_story.story_dir}.epub'
+
+    length = len(str(local_story.chapter_count))
+    numbers = [str(num).zfill(length)
+               for num in range(1, local_story.chapter_count + 1)]
+    if len(local_story.chapters) == 0:
+        local_story.chapters = [local_story.title]
+    titles = [_escape(title) for title in local_story.chapters]
+
+    metadata = {
+        'url': _escape(local_story.url),
+        'title': _escape(local_story.title),
+        'author': _escape(local_story.author),
+        # A BCP 47 code, not the name given by the site
+        'language': cst.EPUB_LANGUAGES.get(local_story.language,
+                                           cst.EPUB_UNKNOWN_LANGUAGE),
+        'site': _escape(local_story.site),
+        'universe': _escape(local_story.universe),
+        'summary': _escape(re.sub(r'<.*?>', '', local_story.summary)),
+    }
+
+    # Written next to it then renamed to never leave a partial EPUB
+    with zipfile.ZipFile(f'{path}.tmp', 'w', zipfile.ZIP_DEFLATED) as epub:
+        # Must be first and not compressed
+        epub.writestr(zipfile.ZipInfo('mimetype'), cst.EPUB_MIMETYPE)
+        epub.writestr('META-INF/container.xml', cst.EPUB_CONTAINER)
+        epub.writestr('OEBPS/style.css', cst.EPUB_CSS)
+
+        with _open_text(epub, 'OEBPS/content.opf') as f:
+            tls.write_template(
+                f,
+                cst.EPUB_CONTENT_OPF,
+                manifest=(cst.EPUB_OPF_ITEM.format(num=num)
+                          for num in numbers),
+                spine=(cst.EPUB_OPF_ITEMREF.format(num=num)
+                       for num in numbers),
+                **metadata
+            )
+
+        with _open_text(epub, 'OEBPS/toc.ncx') as f:
+            tls.write_template(
+                f,
+                cst.EPUB_NCX,
+                nav_points=(
+                    cst.EPUB_NCX_NAVPOINT.format(num=num,
+                                                 order=order,
+                                                 title=title)
+                    for order, (num, title) in enumerate(zip(numbers, titles),
+                                                         2)
+                ),
+                **metadata
+            )
+
+        with _open_text(epub, 'OEBPS/informations.xhtml') as f:
+            tls.write_template(
+                f,
+                cst.EPUB_INFORMATIONS_TEMPLATE,
+                title=metadata['title'],
+                author=metadata['author'],
+                universe=metadata['universe'],
+                url=metadata['url'],
+                summary=_to_xhtml(local_story.summary),
+                tokens=_to_xhtml(local_story.tokens),
+            )
+
+        for chapter_num, (num, title) in enumerate(zip(numbers, titles), 1):
+            try:
+                chapter_text = local_story.sanitize_chapter(
+                    local_story.get_chapter(chapter_num)
+                )
+            except (FileNotFoundError, AttributeError):
+                logger.error(f'Chapter {chapter_num} is missing')
+                chapter_text = cst.EPUB_MISSING_CHAPTER
+            with _open_text(epub, f'OEBPS/{num}.xhtml') as f:
+                tls.write_template(f,
+                                   cst.EPUB_CHAPTER_TEMPLATE,
+                                   chapter_title=title,
+                                   chapter_text=_to_xhtml(chapter_text))
+
+    os.replace(f'{path}.tmp', path)
+    local_story.storage.close()
+
+    logger.debug('EPUB written')
+    return path
+
+
+def write_epubs(database, urls, progress=None, workers=None) -> dict:
+    """
+    Write the EPUBs of many saved stories (a whole site or series for
+    example) in parallel, on a pool of processes
+
+    :param database: the DataHandler of the library
+    :param urls: the urls of the stories
+    :param progress: a function called with (done, total) each time a story
+                     is handled
+    :param workers: the number of processes to use, by default the number of
+                    CPUs
+    :return: the path to the EPUB of each story by url, None for those which
+             failed
+    """
+    logger = tls.setup_logging('epub')
+    urls = list(urls)
+    logger.info(f'Writing {len(urls)} EPUBs')
+
+    paths = {}
+    with cf.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for url in urls:
+            story = database.get_story(url)
+            if story is None:
+                logger.error(f'"{url}" is not present in database')
+                paths[url] = None
+                continue
+            futures[executor.submit(write_epub, story,
+                                    database.get_chapters(url))] = url
+
+        for done, future in enumerate(cf.as_completed(futures), 1):
+            url = futures[future]
+            try:
+                paths[url] = future.result()
+            except (OSError, AttributeError, ValueError) as err:
+                logger.error(f'Could not write the EPUB of "{url}": {err}')
+                paths[url] = None
+
+            if progress is not None:
+                progress(done, len(futures))
+
+    logger.debug('EPUBs written')
+    return paths
@@ -0,0 +1,98 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import threading
+
+import utilities.tools as tls
+import utilities.constants as cst
+
+
+class Facets:
+    """
+    Narrow the stories of a site by their values for some facets (see
+    constants.FACETS): any of the values selected for a facet is enough, but
+    the story must match every facet. For the characters, the story must have
+    all those selected.
+
+    The counts shown for a facet are those of the stories matching the other
+    facets, so selecting a value never empties the other values of the same
+    facet. They are computed in SQL and kept until the database changes
+    (followed through `DataHandler.subscribe()`).
+    """
+    def __init__(self, database):
+        """
+        :param database: a DataHandler of the library, only used in the thread
+                         which created the Facets
+        """
+        self.__logger = tls.setup_logging('Facets')
+        self.__database = database
+
+        # The changes can come from other threads
+        self.__lock = threading.Lock()
+        # The counts by site, facet and selection of the other facets
+        self.__counts = {}
+        database.subscribe(self.__on_change)
+
+    def counts(self, site: str, facet: str, selection: dict) -> list:
+        """
+        :param site: the site of the stories
+        :param facet: one of the keys of constants.FACETS
+        :param selection: the values selected, by facet
+        :return: the values of the facet for the stories matching the other
+                 facets, with the number of stories having each, as
+                 (value, count) sorted by value
+        """
+        filters = Facets.__filters(selection, facet)
+        key = (site, facet, frozenset((column, frozenset(values))
+                                      for column, values in filters.items()))
+        with self.__lock:
+            counts = self.__counts.get(key)
+        if counts is not None:
+            return counts
+
+        self.__logger.debug(f'Counting "{facet}" for "{site}"')
+        counts = sorted(
+            self.__database.count_facet(site, cst.FACETS[facet], filters),
+            # None cannot be compared to anything
+            key=lambda value_count: (value_count[0] is not None,
+                                     value_count[0])
+        )
+        with self.__lock:
+            self.__counts[key] = counts
+        return counts
+
+    def urls(self, site: str, selection: dict) -> list:
+        """
+        :param site: the site of the stories
+        :param selection: the values selected, by facet
+        :return: the urls of the stories matching every facet, sorted by title
+        """
+        return self.__database.get_urls_by_facets(site,
+                                                  Facets.__filters(selection))
+
+    @staticmethod
+    def __filters(selection: dict, ignored=None) -> dict:
+        """
+        :param selection: the values selected, by facet
+        :param ignored: a facet whose values are not to be taken into account
+        :return: the values wanted, by column
+        """
+        return {cst.FACETS[facet]: values
+                for facet, values in selection.items()
+                if facet != ignored and len(values) != 0}
+
+    def __on_change(self, url: str, story):
+        """
+        Called by the DataHandlers when a story changed: the counts of its site
+        are computed again when needed
+
+        :param url: the url of the story
+        :param story: its new row, None if it was deleted
+        """
+        with self.__lock:
+            # The site of a deleted story is not known anymore
+            if story is None:
+                self.__counts.clear()
+                return
+            for key in [key for key in self.__counts if key[0] == story[2]]:
+                del self.__counts[key]
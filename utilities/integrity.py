@@ -0,0 +1,295 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import os
+import urllib.error
+import concurrent.futures as cf
+
+import utilities.tools as tls
+import utilities.constants as cst
+import utilities.chapter_store as cs
+import utilities.story_writer as sw
+import utilities.library as lb
+import utilities.storage as stg
+
+
+class RepairPlan:
+    """
+    What `check_library()` found wrong in the library and what `repair()`
+    will do about it:
+
+        - render: the chapters whose file is missing or damaged but whose text
+          is stored, written again without fetching anything, by url
+        - fetch: the chapters whose file is missing or damaged and whose text
+          is not stored, fetched again, by url. A story whose informations
+          file is missing is also fetched, with no chapter if none is missing
+        - extra_chapters: the stories with chapters registered beyond their
+          chapter count, by url with the first extra chapter
+        - stale_stories: the urls of the stories saved nowhere on disk. Their
+          row is kept (read status, series, chapters...) and they are written
+          again, as part of `fetch`: their stored texts are used, only what is
+          not stored is fetched
+        - orphan_folders: the directories of the stories which are not in the
+          database, deleted
+        - orphan_files: the files of a story which are neither its chapters nor
+          its informations, by directory, deleted
+        - damaged_texts: the stored texts which do not match their hash,
+          deleted (the chapters using them are fetched again if needed)
+        - orphan_texts: the paths in the chapter store which no chapter uses,
+          deleted
+    """
+    def __init__(self):
+
+        self.render = {}
+        self.fetch = {}
+        self.extra_chapters = {}
+        self.stale_stories = []
+        self.orphan_folders = []
+        self.orphan_files = {}
+        self.damaged_texts = []
+        self.orphan_texts = []
+
+    def __str__(self) -> str:
+
+        return (
+            f'Chapters to write again: '
+            f'{sum(len(ch) for ch in self.render.values()):,}\n'
+            f'Chapters to fetch again: '
+            f'{sum(len(ch) for ch in self.fetch.values()):,} '
+            f'(in {len(self.fetch):,} stories)\n'
+            f'Stories with extra chapters: {len(self.extra_chapters):,}\n'
+            f'Stories saved nowhere, written again: '
+            f'{len(self.stale_stories):,}\n'
+            f'Orphan directories: {len(self.orphan_folders):,}\n'
+            f'Orphan files: '
+            f'{sum(len(f) for f in self.orphan_files.values()):,}\n'
+            f'Damaged stored texts: {len(self.damaged_texts):,}\n'
+            f'Orphan stored texts: {len(self.orphan_texts):,}'
+        )
+
+    def deleted_paths(self) -> list:
+        """
+        :return: the paths of what the repair deletes, the directories of the
+                 stories ending with a '/', sorted
+        """
+        store = cs.ChapterStore()
+        return sorted(
+            self.orphan_folders +
+            [f'{folder}{name}'
+             for folder, names in self.orphan_files.items() for name in names] +
+            [store.path(content_hash) for content_hash in self.damaged_texts] +
+            self.orphan_texts
+        )
+
+    def is_empty(self) -> bool:
+        """
+        :return: True if nothing needs to be repaired
+        """
+        return not any((self.render, self.fetch, self.extra_chapters,
+                        self.stale_stories, self.orphan_folders,
+                        self.orphan_files, self.damaged_texts,
+                        self.orphan_texts))
+
+
+def _check_story(story: tuple, chapters: list, store: cs.ChapterStore) -> dict:
+    """
+    Check a story against its files. Executed in the threads of
+    check_library()
+
+    :param story: the story's row in the stories table
+    :param chapters: its chapters, as returned by `DataHandler.get_chapters()`
+    :param store: the ChapterStore
+    :return: what is wrong with the story: 'stale', the chapters to 'render'
+             and to 'fetch', whether its 'informations' are missing, the
+             'extra' chapters, the 'orphan_files' and the 'damaged_texts'
+    """
+    folder, informations = story[1].rsplit('/', 1)
+    storage = stg.get_storage(f'{folder}/')
+    result = {
+        'stale': False,
+        'render': [],
+        'fetch': [],
+        'informations': False,
+        'extra': None,
+        'orphan_files': [],
+        'damaged_texts': [],
+    }
+
+    try:
+        # Every file is missing: the story is written again
+        if not storage.is_present():
+            result['stale'] = True
+            names = set()
+        else:
+            names = set(storage.names())
+        result['informations'] = informations not in names
+
+        chapter_count = story[5]
+        length = len(str(chapter_count))
+        registered = {chapter[0]: chapter for chapter in chapters}
+        if len(chapters) != 0 and chapters[-1][0] > chapter_count:
+            result['extra'] = chapter_count + 1
+
+        kept = {informations}
+        for chapter_num in range(1, chapter_count + 1):
+            file = f'{str(chapter_num).zfill(length)}.html'
+            kept.add(file)
+            chapter = registered.get(chapter_num)
+
+            # Hashing the stored text is what takes time, and what is done in
+            # parallel
+            intact = chapter is not None and chapter[2] != '' and \
+                store.is_intact(chapter[2])
+            if chapter is not None and chapter[2] != '' and not intact and \
+                    store.has(chapter[2]):
+                result['damaged_texts'].append(chapter[2])
+
+            if chapter is None or chapter[5] != cst.CHAPTER_COMPLETE or \
+                    file not in names or storage.size(file) != chapter[3]:
+                result['render' if intact else 'fetch'].append(chapter_num)
+
+        result['orphan_files'] = sorted(names - kept)
+    finally:
+        storage.close()
+
+    return result
+
+
+def check_library(database, progress=None, workers=None) -> RepairPlan:
+    """
+    Check that the database, the files of the stories and the chapter store
+    agree, the stories being checked in parallel by a pool of threads (most of
+    the time is spent reading and hashing files)
+
+    :param database: the DataHandler of the library
+    :param progress: a function called with (done, total) each time a story
+                     is checked
+    :param workers: the number of threads to use
+    :return: the plan to repair the library
+    """
+    logger = tls.setup_logging('integrity')
+    logger.info('Checking the library')
+
+    plan = RepairPlan()
+    store = cs.ChapterStore()
+    stories = database.get_stories()
+    all_chapters = database.get_all_chapters()
+    folders = {story[0]: f"{story[1].rsplit('/', 1)[0]}/" for story in stories}
+
+    with cf.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_check_story,
+                            story,
+                            all_chapters.get(story[0], []),
+                            store): story[0]
+            for story in stories
+        }
+
+        for done, future in enumerate(cf.as_completed(futures), 1):
+            url = futures[future]
+            try:
+                result = future.result()
+            except (OSError, ValueError) as err:
+                logger.error(f'Could not check "{url}": {err}')
+                continue
+
+            if result['stale']:
+                plan.stale_stories.append(url)
+            if result['render']:
+                plan.render[url] = result['render']
+            if result['fetch'] or result['informations']:
+                plan.fetch[url] = result['fetch']
+            if result['extra'] is not None:
+                plan.extra_chapters[url] = result['extra']
+            if result['orphan_files']:
+                plan.orphan_files[folders[url]] = result['orphan_files']
+            plan.damaged_texts.extend(result['damaged_texts'])
+
+            if progress is not None:
+                progress(done, len(futures))
+
+    plan.damaged_texts = sorted(set(plan.damaged_texts))
+    known = set(folders.values())
+    plan.orphan_folders = [folder for folder in stg.story_folders()
+                           if folder.lower() not in known]
+
+    used = {chapter[2]
+            for chapters in all_chapters.values() for chapter in chapters}
+    plan.orphan_texts = [path for content_hash, path in store.hashes()
+                         if content_hash not in used]
+
+    logger.info(f'Library checked:\n{plan}')
+    for path in plan.deleted_paths():
+        logger.info(f'To delete: {path}')
+    return plan
+
+
+def repair(database, plan: RepairPlan, progress=None) -> list:
+    """
+    Apply a repair plan. Only the chapters in `plan.fetch` are fetched, the
+    stories one after the other
+
+    :param database: the DataHandler of the library
+    :param plan: the plan returned by `check_library()`
+    :param progress: a function called with (done, total) each time a story
+                     is repaired
+    :return: the urls of the stories which could not be repaired
+    """
+    logger = tls.setup_logging('integrity')
+    logger.info('Repairing the library')
+
+    store = cs.ChapterStore()
+    writer = sw.StoryWriter(database)
+    failed = []
+
+    # What is deleted first, so nothing is written again for nothing
+    for content_hash in plan.damaged_texts:
+        store.remove(content_hash)
+    for path in plan.orphan_texts:
+        os.remove(path)
+    for folder in plan.orphan_folders:
+        for storage in (stg.PackedStorage(folder), stg.LooseStorage(folder)):
+            if storage.is_present():
+                storage.delete()
+        logger.debug(f'Deleted: {folder}')
+    for folder, names in plan.orphan_files.items():
+        storage = stg.get_storage(folder)
+        for name in names:
+            storage.remove(name)
+        storage.close()
+    for url, first_chapter in plan.extra_chapters.items():
+        database.delete_chapters(url, first_chapter)
+
+    stories = sorted(set(plan.render) | set(plan.fetch))
+    for done, url in enumerate(stories, 1):
+        logger.info(f'Repairing "{url}"')
+        try:
+            if url in plan.fetch:
+                writer.set_url(url)
+                database.add_story(writer.story)
+                # The chapters only needing to be written again are not fetched
+                # if their text is stored
+                writer.write_chapters(
+                    chapter_num for chapter_num
+                    in sorted(plan.fetch[url] + plan.render.get(url, []))
+                    if chapter_num <= writer.story.chapter_count
+                )
+            else:
+                story = database.get_story(url)
+                # The stored texts are used, nothing is fetched
+                writer.set_story(lb.LocalStory(story,
+                                               database.get_chapters(url)))
+                writer.write_chapters(plan.render[url])
+        except (urllib.error.URLError, ConnectionError, OSError,
+                AttributeError, ValueError, IndexError) as err:
+            logger.error(f'Could not repair "{url}": {err}')
+            failed.append(url)
+
+        if progress is not None:
+            progress(done, len(stories))
+
+    if writer.storage is not None:
+        writer.storage.close()
+
+    logger.debug(f'Library repaired, {len(failed)} stories failed')
+    return failed
@@ -0,0 +1,370 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import re
+import concurrent.futures as cf
+
+import utilities.tools as tls
+import utilities.constants as cst
+import utilities.story_writer as sw
+import utilities.chapter_store as cs
+import utilities.storage as stg
+
+import sites.story as st
+
+
+class LocalStory(st.Story):
+    """
+    Represent a story already saved in the library, built only from what is
+    on disk and in the database: nothing is fetched, unless asked to for the
+    chapters neither stored nor written.
+
+    The properties come from the story's row in the database and the titles
+    of the chapters from the chapters table. Its informations file is only
+    read for what the database does not have (the links to the author and
+    universe, the tokens as the site wrote them) and for the titles of the
+    chapters not registered yet: if it cannot be parsed, the values of the
+    row are used instead. The chapters come from the ChapterStore or, if
+    their text is not stored, from their already written file. Both files
+    are read from the story's storage, whether it is packed or not.
+    """
+    def __init__(self, story: tuple, chapters=None, fetch=False):
+        """
+        :param story: the story's row in the stories table
+        :param chapters: the chapters registered for the story, as returned
+                         by `DataHandler.get_chapters()`
+        :param fetch: whether the chapters neither stored nor written are
+                      fetched from the site, alone
+        """
+        super(LocalStory, self).__init__(story[0])
+
+        self.site = story[2]
+        self.author = story[3]
+        self.title = story[4]
+        self.chapter_count = story[5]
+        self.word_count = story[6]
+        self.status = story[7]
+        self.language = story[8]
+        self.universe = story[9]
+        self.summary = story[10]
+        self.curated_tokens = story[11]
+
+        # path_to_index is {relative_path}/{story_dir}/{title}_informations.html
+        self.path_to_index = story[1]
+        self.relative_path, self.story_dir, file_title = \
+            self.path_to_index.rsplit('/', 2)
+        self.__informations_title = file_title[:-len('_informations.html')]
+
+        chapters = [] if chapters is None else chapters
+        self.__hashes = {number: content_hash
+                         for number, _, content_hash, *_ in chapters}
+        self.__fetch = fetch
+        self.__store = cs.ChapterStore()
+        self.storage = stg.get_storage(
+            f'{self.relative_path}/{self.story_dir}/'
+        )
+
+        self.__author = self.author
+        self.__universe = self.universe
+        self.tokens = self.curated_tokens
+        titles = {number: title for number, title, *_ in chapters
+                  if number <= self.chapter_count}
+        self.__read_informations(file_title, titles)
+        self.chapters = [titles.get(number, self.title)
+                         for number in range(1, self.chapter_count + 1)]
+
+    def __read_informations(self, file_title: str, titles: dict):
+        """
+        Complete the story with its informations file, if it can be parsed
+
+        :param file_title: the name of the informations file
+        :param titles: the titles of the chapters by number, the missing ones
+                       are added
+        """
+        try:
+            page = self.storage.read(file_title)
+        except (OSError, UnicodeDecodeError):
+            return
+
+        informations = re.search(cst.RE_INFORMATIONS_FILE, page, re.DOTALL)
+        if informations is not None:
+            self.__author = informations.group('author')
+            self.__universe = informations.group('universe')
+            self.tokens = informations.group('tokens')
+
+        # Only for the stories saved before their chapters were registered
+        if len(titles) < self.chapter_count:
+            for number, title in enumerate(
+                    re.findall(cst.RE_TABLE_OF_CONTENTS, page), 1):
+                if number <= self.chapter_count:
+                    titles.setdefault(number, title[1])
+
+    def get_informations_title(self) -> str:
+        return self.__informations_title
+
+    def get_author(self) -> str:
+        return self.__author
+
+    def get_universe(self) -> str:
+        return self.__universe
+
+    def __site_class(self):
+        """
+        :return: the class of the story's site
+        :raise: KeyError if the site is not supported anymore
+        """
+        return cst.SITES[self.site][0]
+
+    def sanitize_chapter(self, chapter_text: str) -> str:
+        """
+        Sanitize the chapter as its site does
+        """
+        try:
+            site_class = self.__site_class()
+        except KeyError:
+            return st.Story.sanitize_chapter(chapter_text)
+        return site_class.sanitize_chapter(chapter_text)
+
+    def parse_details(self, tokens: str) -> dict:
+        """
+        Parse the details as its site does
+        """
+        try:
+            site_class = self.__site_class()
+        except KeyError:
+            return st.Story.parse_details(tokens)
+        return site_class.parse_details(tokens)
+
+    def get_chapter(self, num_chapter: int) -> str:
+        """
+        :raise: FileNotFoundError if the chapter's text is neither stored nor
+                written, and is not fetched
+                AttributeError if the chapter's file cannot be read
+                Internet related errors if the connection fails
+        """
+        try:
+            return self.__store.get(self.__hashes[num_chapter])
+        except (KeyError, FileNotFoundError):
+            pass
+
+        length = len(str(self.chapter_count))
+        try:
+            page = self.storage.read(f'{str(num_chapter).zfill(length)}.html')
+        except FileNotFoundError:
+            if not self.__fetch or self.site not in cst.SITES:
+                raise
+            return self.__site_class().fetch_chapter(self.url,
+                                                     self.chapter_count,
+                                                     num_chapter)
+        return re.search(cst.RE_CHAPTER_TEXT, page, re.DOTALL).group(1)
+
+
+def _render_story(story: tuple, chapters: list) -> tuple:
+    """
+    Write again the informations and the chapters of a story from what is on
+    disk. Executed in the processes of render_library()
+
+    :param story: the story's row in the stories table
+    :param chapters: the chapters registered for the story
+    :return: the story's url, the size of each chapter's file by number, the
+             number of files changed, the chapters which could not be written
+             and the bytes saved by sanitizing the chapters
+    """
+    local_story = LocalStory(story, chapters)
+    writer = sw.StoryWriter(None)
+    writer.set_story(local_story)
+
+    # Already written by render_library()
+    changed = int(writer.write_informations(css=False))
+    sizes = {}
+    missing = []
+    for chapter_num in range(1, local_story.chapter_count + 1):
+        try:
+            chapter_text = local_story.get_chapter(chapter_num)
+        except (FileNotFoundError, AttributeError):
+            missing.append(chapter_num)
+            continue
+        sizes[chapter_num], written = writer.render_chapter(chapter_num,
+                                                            chapter_text)
+        changed += int(written)
+
+    writer.storage.close()
+    local_story.storage.close()
+    return (local_story.url, sizes, changed, missing,
+            writer.saved_bytes[local_story.site])
+
+
+def render_library(database, progress=None, workers=None) -> dict:
+    """
+    Write again every informations file and chapter of the library, using the
+    current templates, without fetching anything. The stories are handled in
+    parallel by a pool of processes and only the files whose content changes
+    are actually written.
+
+    Every chapter of every story is still read and rendered to know whether
+    its file changes: only the writes are saved, not the work, so rendering
+    an up to date library takes about as long as rendering a stale one.
+
+    :param database: the DataHandler of the library
+    :param progress: a function called with (done, total) each time a story
+                     is handled
+    :param workers: the number of processes to use, by default the number of
+                    CPUs
+    :return: a summary with the number of 'stories', 'changed' files,
+             'missing' chapters and 'failed' stories, and the bytes 'saved' by
+             sanitizing the chapters, by site
+    """
+    logger = tls.setup_logging('library')
+    logger.info('Rendering the library')
+
+    # The css is written once here instead of once per story
+    tls.write_file('0/css/chapter_style.css', cst.CHAPTER_CSS)
+    tls.write_file('0/css/informations_style.css', cst.INFORMATIONS_CSS)
+
+    stories = database.get_stories()
+    all_chapters = database.get_all_chapters()
+    summary = {
+        'stories': len(stories),
+        'changed': 0,
+        'missing': 0,
+        'failed': 0,
+        'saved': {},
+    }
+
+    with cf.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        sites = {}
+        for story in stories:
+            futures[executor.submit(_render_story, story,
+                                    all_chapters.get(story[0], []))] = story[0]
+            sites[story[0]] = story[2]
+
+        for done, future in enumerate(cf.as_completed(futures), 1):
+            try:
+                url, sizes, changed, missing, saved = future.result()
+            except (OSError, AttributeError, ValueError) as err:
+                logger.error(f'Could not render "{futures[future]}": {err}')
+                summary['failed'] += 1
+            else:
+                # Else the next update would consider them modified
+                database.set_chapters_size(url, sizes)
+                summary['changed'] += changed
+                summary['missing'] += len(missing)
+                site = sites[url]
+                summary['saved'][site] = summary['saved'].get(site, 0) + saved
+                if len(missing) != 0:
+                    logger.error(f'"{url}": chapters {missing} are missing')
+
+            if progress is not None:
+                progress(done, len(stories))
+
+    logger.debug(f'Library rendered: {summary}')
+    return summary
+
+
+def _parse_story(folder: str):
+    """
+    Build back the row of a story in the stories table from its informations
+    file. Executed in the processes of rebuild_database(): the story has no
+    row to take the values from, so if the file does not match the current
+    template the story cannot be parsed
+
+    :param folder: the story's directory, ending with a '/'
+    :return: the row and the characters, as (name, pairing), or None if the
+             story cannot be parsed
+    """
+    storage = stg.get_storage(folder)
+    try:
+        names = [name for name in storage.names()
+                 if name.endswith('_informations.html')]
+        if len(names) != 1:
+            return None
+        page = storage.read(names[0])
+    except (OSError, UnicodeDecodeError):
+        return None
+    finally:
+        storage.close()
+
+    informations = re.search(cst.RE_INFORMATIONS_FILE, page, re.DOTALL)
+    if informations is None:
+        return None
+
+    try:
+        site_class = cst.SITES[informations.group('site')][0]
+        values = site_class.parse_tokens(informations.group('tokens'))
+        details = site_class.parse_details(informations.group('tokens'))
+    except (KeyError, AttributeError, IndexError, ValueError):
+        return None
+
+    return (
+        informations.group('url'),
+        f'{folder}{names[0]}'.lower(),
+        informations.group('site'),
+        # Both can be links to the site
+        re.sub(r'<.*?>', '', informations.group('author')),
+        informations.group('story_title'),
+        int(informations.group('chapter_count').replace(',', '')),
+        values['word_count'],
+        values['status'],
+        values['language'],
+        re.sub(r'<.*?>', '', informations.group('universe')),
+        informations.group('summary'),
+        values['curated_tokens'],
+        # The user-entered values cannot be found back
+        False,
+        '',
+        0,
+    ) + tuple(details[column] for column in cst.STORY_DETAILS), \
+        details['characters']
+
+
+def rebuild_database(database, progress=None, workers=None) -> dict:
+    """
+    Add to the database every story saved in the library, using only their
+    informations files: nothing is fetched. The files are parsed in parallel
+    by a pool of processes and the stories inserted in a single transaction.
+
+    The stories already in the database are kept as they are. Whether a
+    story was read and its series cannot be found back. The chapters are
+    registered again during the next update of each story.
+
+    :param database: the DataHandler of the library
+    :param progress: a function called with (done, total) each time a story
+                     is parsed
+    :param workers: the number of processes to use, by default the number of
+                    CPUs
+    :return: a summary with the number of 'stories' found, 'added' to the
+             database and which 'failed' to be parsed
+    """
+    logger = tls.setup_logging('library')
+    logger.info('Rebuilding the database')
+
+    folders = stg.story_folders()
+    stories = []
+    characters = {}
+    failed = 0
+
+    with cf.ProcessPoolExecutor(max_workers=workers) as executor:
+        # Parsing a file is quick: the folders are sent in batches
+        results = executor.map(_parse_story,
+                               folders,
+                               chunksize=max(1, len(folders) // 256))
+        for done, (folder, result) in enumerate(zip(folders, results), 1):
+            if result is None:
+                logger.error(f'Could not parse the story in "{folder}"')
+                failed += 1
+            else:
+                stories.append(result[0])
+                characters[result[0][0]] = result[1]
+
+            if progress is not None and (done % 100 == 0 or
+                                         done == len(folders)):
+                progress(done, len(folders))
+
+    summary = {
+        'stories': len(folders),
+        'added': database.restore_stories(stories, characters),
+        'failed': failed,
+    }
+    logger.debug(f'Database rebuilt: {summary}')
+    return summary
@@ -0,0 +1,134 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import threading
+
+import utilities.tools as tls
+
+# The columns by which the stories are grouped in a LibraryIndex
+_GROUPS = {'site': 2, 'author': 3, 'series': 13}
+
+
+class LibraryIndex:
+    """
+    The stories of the library, kept in memory to answer the questions the UI
+    asks all the time (is this url saved ? which stories belong to this site,
+    this series, this author ?) without querying the database nor going
+    through lists.
+
+    The database is read once, then the index follows its changes through
+    `DataHandler.subscribe()`, whichever DataHandler (or thread) makes them.
+    The rows are the same as in the stories table.
+    """
+    def __init__(self, database):
+        """
+        :param database: a DataHandler of the library
+        """
+        self.__logger = tls.setup_logging('LibraryIndex')
+        self.__logger.info('Indexing the library')
+
+        # The changes can come from other threads
+        self.__lock = threading.Lock()
+        self.__stories = {}
+        self.__groups = {group: {} for group in _GROUPS}
+
+        # Subscribed first, so no change is missed while loading: those made
+        # meanwhile wait for the loading to be done, then replace what was read
+        database.subscribe(self.__on_change)
+        with self.__lock:
+            for story in database.get_stories():
+                self.__remove(story[0])
+                self.__add(story)
+
+        self.__logger.debug(f'{len(self.__stories)} stories indexed')
+
+    def __contains__(self, url: str) -> bool:
+
+        return url in self.__stories
+
+    def __len__(self) -> int:
+
+        return len(self.__stories)
+
+    def get(self, url: str):
+        """
+        :param url: the url of a story
+        :return: its row, or None if it is not saved
+        """
+        return self.__stories.get(url)
+
+    def stories_by_site(self, site: str) -> list:
+        """
+        :param site: the site to check for
+        :return: the rows of the stories of the site, sorted by title
+        """
+        return sorted(self.__rows('site', site), key=lambda st: st[4])
+
+    def urls_by_series(self, series: str) -> list:
+        """
+        :param series: the series to check for
+        :return: the urls of the stories of the series, by position
+        """
+        return [story[0] for story in sorted(self.__rows('series', series),
+                                             key=lambda st: st[14])]
+
+    def urls_by_author(self, author: str) -> set:
+        """
+        :param author: the author to check for
+        :return: the urls of the stories of the author
+        """
+        with self.__lock:
+            return set(self.__groups['author'].get(author, ()))
+
+    def values(self, group: str) -> list:
+        """
+        :param group: 'site', 'author' or 'series'
+        :return: the different values of the group which have stories (the ''
+                 series, for the stories in no series, included)
+        """
+        with self.__lock:
+            return list(self.__groups[group])
+
+    def __rows(self, group: str, value) -> list:
+        """
+        :param group: 'site', 'author' or 'series'
+        :param value: the value wanted for the group
+        :return: the rows of the stories having this value
+        """
+        with self.__lock:
+            return [self.__stories[url]
+                    for url in self.__groups[group].get(value, ())]
+
+    def __on_change(self, url: str, story):
+        """
+        Called by the DataHandlers when a story changed
+
+        :param url: the url of the story
+        :param story: its new row, None if it was deleted
+        """
+        with self.__lock:
+            self.__remove(url)
+            if story is not None:
+                self.__add(story)
+
+    def __add(self, story: tuple):
+        """
+        :param story: the row of a story not indexed yet
+        """
+        self.__stories[story[0]] = story
+        for group, column in _GROUPS.items():
+            self.__groups[group].setdefault(story[column], set()).add(story[0])
+
+    def __remove(self, url: str):
+        """
+        :param url: the url of a story, indexed or not
+        """
+        story = self.__stories.pop(url, None)
+        if story is None:
+            return
+        for group, column in _GROUPS.items():
+            urls = self.__groups[group][story[column]]
+            urls.discard(url)
+            # A value without stories does not exist anymore
+            if len(urls) == 0:
+                del self.__groups[group][story[column]]
@@ -0,0 +1,278 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import re
+import zlib
+import json
+import hashlib
+import threading
+import mimetypes
+import collections
+import socketserver
+import http.server
+import urllib.error
+import urllib.parse
+
+import utilities.tools as tls
+import utilities.constants as cst
+import utilities.data_handler as dh
+import utilities.story_writer as sw
+import utilities.library as lb
+import utilities.storage as stg
+import utilities.chapter_store as cs
+import utilities.sync as sy
+
+# Only one chapter is written at a time: two readers asking for the same
+# missing chapter must not fetch it twice
+_WRITING_LOCK = threading.Lock()
+
+
+class ReadingRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serve the library as it is saved: the statistics, the informations and the
+    chapters, whether the story is packed or not (see utilities/storage.py).
+    Only the files of the stories registered in the database and those
+    matching `constants.RE_READING_SERVER_FILES` are served.
+
+    The pages are served as they were written, with their navigation links, so
+    nothing is computed when reading. A chapter which was not written yet (the
+    story was added without being downloaded, or only partly) is fetched and
+    written on its first reading, alone: the story is taken from the database.
+    The other chapters are left as they are.
+
+    The manifests and the stored texts of the library are served under /sync/
+    for other libraries to synchronize from this one (see utilities/sync.py).
+    """
+    server_version = f'{cst.APP_NAME.replace(" ", "-")}/{__version__}'
+
+    def do_GET(self):
+
+        logger = tls.setup_logging('ReadingServer')
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        path = path.lstrip('/')
+
+        if '..' in path.split('/'):
+            self.send_error(404)
+            return
+
+        if path == '':
+            self.__send(self.__index(), 'index.html')
+            return
+
+        if path in ('sync/manifest', 'sync/story'):
+            self.__send_manifest(path)
+            return
+
+        if path == 'sync/text':
+            self.__send_text()
+            return
+
+        name = path.rsplit('/', 1)[-1]
+        try:
+            content = self.__read(path)
+        except (OSError, ValueError, AttributeError):
+            self.send_error(404)
+        except urllib.error.URLError as err:
+            logger.error(f'Could not fetch "{path}": {err.reason}')
+            self.send_error(502, explain=str(err.reason))
+        else:
+            self.__send(content, name)
+
+    def log_message(self, format_: str, *args):
+
+        tls.setup_logging('ReadingServer').debug(format_ % args)
+
+    def __send(self, content: str, name: str):
+        """
+        Send a page, or only tell the browser its copy is still valid
+
+        :param content: the content of the page
+        :param name: the name of the file, used to guess the content type
+        """
+        data = content.encode('utf-8')
+        etag = f'"{hashlib.sha1(data).hexdigest()}"'
+
+        if name.endswith(('.css', '.js')):
+            cache = cst.READING_SERVER_STATIC_CACHE
+        else:
+            cache = cst.READING_SERVER_PAGE_CACHE
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache)
+            self.end_headers()
+            return
+
+        content_type = mimetypes.guess_type(name)[0] or 'text/plain'
+        self.send_response(200)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', cache)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def __send_manifest(self, path: str):
+        """
+        Send the manifest of the library, or of the story given by the 'url'
+        parameter
+
+        :param path: 'sync/manifest' or 'sync/story'
+        """
+        database = dh.DataHandler('0/data/ffndl_database.db')
+        try:
+            if path == 'sync/manifest':
+                manifest = sy.library_manifest(database)
+            else:
+                query = urllib.parse.parse_qs(
+                    urllib.parse.urlsplit(self.path).query)
+                manifest = sy.story_manifest(database,
+                                             query.get('url', [''])[0])
+        finally:
+            database.close()
+        self.__send(json.dumps(manifest), 'manifest.json')
+
+    def __send_text(self):
+        """
+        Send the stored text whose hash is given by the 'hash' parameter
+        """
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        content_hash = query.get('hash', [''])[0]
+        # Checked first: the hash is part of a path
+        if re.fullmatch(cst.RE_CONTENT_HASH, content_hash) is None:
+            self.send_error(404)
+            return
+
+        try:
+            text = cs.ChapterStore().get(content_hash)
+        except (OSError, zlib.error, UnicodeDecodeError):
+            self.send_error(404)
+            return
+        self.__send(text, f'{content_hash}.html')
+
+    @staticmethod
+    def __index() -> str:
+        """
+        :return: the home page, linking to the statistics of each site
+        """
+        database = dh.DataHandler('0/data/ffndl_database.db')
+        try:
+            counts = collections.Counter(database.get_column('site'))
+        finally:
+            database.close()
+        return cst.READING_SERVER_INDEX_TEMPLATE.format(
+            app_name=cst.APP_NAME,
+            sites=''.join(
+                cst.READING_SERVER_SITE_TEMPLATE.format(site=site, count=count)
+                for site, count in sorted(counts.items())
+            ),
+        )
+
+    @staticmethod
+    def __read(path: str) -> str:
+        """
+        :param path: the path of the file, from the save folder
+        :return: its content, the chapter being written first if needed
+        :raise: FileNotFoundError if it is not served, or does not exist and is
+                not a chapter of the story saved in its folder
+        """
+        if re.fullmatch(cst.RE_READING_SERVER_FILES, path) is not None:
+            return stg.LooseStorage('').read(path)
+
+        # Only {relative_path}/{story_dir}/{name}, for a registered story
+        if path.count('/') != 2:
+            raise FileNotFoundError(f'{path} is not served')
+        folder, name = path.rsplit('/', 1)
+        database = dh.DataHandler('0/data/ffndl_database.db', read_only=True)
+        try:
+            story = database.get_story_by_folder(f'{folder}/')
+        finally:
+            database.close()
+        if story is None:
+            raise FileNotFoundError(f'No story saved in {folder}')
+        folder = story[1].rsplit('/', 1)[0] + '/'
+
+        storage = stg.get_storage(folder)
+        try:
+            return storage.read(name)
+        except FileNotFoundError:
+            if re.fullmatch(r'(\d+)\.html', name) is None:
+                raise
+        finally:
+            storage.close()
+
+        with _WRITING_LOCK:
+            ReadingRequestHandler.__write_chapter(story, name)
+
+        storage = stg.get_storage(folder)
+        try:
+            return storage.read(name)
+        finally:
+            storage.close()
+
+    @staticmethod
+    def __write_chapter(story: tuple, name: str):
+        """
+        Fetch and write a chapter of a saved story. Nothing is fetched unless
+        the chapter is registered for the story: its number is in the chapters
+        of the database or, for a story registered without them, within its
+        chapter count. The name must be the one the pages of the story link to.
+        Only the chapter is fetched, the story is built from its row
+
+        :param story: the story's row in the stories table
+        :param name: the name of the chapter's file, '{number}.html'
+        :raise: FileNotFoundError if the story has no such chapter
+                Internet related errors if the connection fails
+        """
+        # The connection cannot be shared between the threads of the server
+        database = dh.DataHandler('0/data/ffndl_database.db')
+        local_story = None
+        writer = None
+        try:
+            chapter_num = int(name.split('.')[0])
+            chapter_count = story[5] or 0
+            chapters = database.get_chapters(story[0])
+            if len(chapters) != 0:
+                known = chapter_num in [chapter[0] for chapter in chapters]
+            else:
+                known = 0 < chapter_num <= chapter_count
+            length = len(str(chapter_count))
+            if not known or name != f'{str(chapter_num).zfill(length)}.html':
+                raise FileNotFoundError(f'No chapter {name} for {story[0]}')
+
+            local_story = lb.LocalStory(story, chapters, fetch=True)
+            writer = sw.StoryWriter(database)
+            writer.set_story(local_story)
+            writer.write_chapters((chapter_num,))
+        finally:
+            if local_story is not None:
+                local_story.storage.close()
+            if writer is not None and writer.storage is not None:
+                writer.storage.close()
+            database.close()
+
+
+class ReadingServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    The reading server, each request being handled in its own thread
+    """
+    daemon_threads = True
+
+
+def start_server(host=cst.READING_SERVER_BIND_ADDRESS,
+                 port=cst.READING_SERVER_PORT) -> ReadingServer:
+    """
+    Start the reading server in the background. The files are served from the
+    current working directory, which must be the save folder
+
+    :param host: the address to listen on
+    :param port: the port to listen on
+    :return: the server, to be stopped with `.shutdown()`
+    :raise: OSError if the port is already used
+    """
+    logger = tls.setup_logging('ReadingServer')
+    server = ReadingServer((host, port), ReadingRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f'Serving the library on http://{host}:{port}/')
+    return server
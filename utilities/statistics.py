@@ -0,0 +1,254 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import html
+import array
+import bisect
+import operator
+import itertools
+import collections
+
+import utilities.tools as tls
+import utilities.constants as cst
+
+# The columns of a Snapshot, as (name, SQL expression on the stories table)
+# The texts are encoded (see Snapshot), the numbers kept as they are
+_TEXTS = (
+    ('site', 'site'),
+    ('author', 'author'),
+    ('universe', 'universe'),
+    ('language', 'language'),
+    ('status', 'status'),
+)
+_NUMBERS = (
+    ('chapters', 'COALESCE(chapter_count, 0)'),
+    ('words', 'COALESCE(word_count, 0)'),
+    ('read', 'COALESCE(read, 0)!=0'),
+)
+# The type of the array of each column: the codes, the counts and the flags
+_TYPECODES = {'chapters': 'q', 'words': 'q', 'read': 'B'}
+
+
+class Snapshot:
+    """
+    The stories of the library as columns, the n-th story having the n-th
+    value of each column. Every column is an array: a number takes its 8 bytes
+    instead of being an object in the tuple of a row. The texts are encoded,
+    the column keeping the code of each value, its index in `.values[column]`.
+
+    The snapshot is filled by a single query, then each statistic is computed
+    by a pass over the columns it needs, done by the loops of the builtins
+    (`collections.Counter`, `itertools.compress`, `map`...) wherever they can
+    replace a loop in Python.
+    """
+    def __init__(self, database):
+        """
+        :param database: a DataHandler of the library
+        """
+        self.__logger = tls.setup_logging('Snapshot')
+        self.__logger.info('Reading the library')
+
+        self.columns = {name: array.array(_TYPECODES.get(name, 'I'))
+                        for name, _ in _TEXTS + _NUMBERS}
+        encodings = {}
+        for name, _ in _TEXTS:
+            encoding = collections.defaultdict()
+            # A value not seen yet gets the next code
+            encoding.default_factory = encoding.__len__
+            encodings[name] = encoding
+
+        for chunk in database.iter_columns(
+                [column for _, column in _TEXTS + _NUMBERS],
+                cst.STATISTICS_CHUNK_ROWS):
+            for (name, _), values in zip(_TEXTS + _NUMBERS, zip(*chunk)):
+                if name in encodings:
+                    values = map(encodings[name].__getitem__, values)
+                self.columns[name].extend(values)
+
+        # In the order of their codes
+        self.values = {name: list(encoding)
+                       for name, encoding in encodings.items()}
+        self.__logger.debug(f'{len(self)} stories read')
+
+    def __len__(self) -> int:
+
+        return len(self.columns['site'])
+
+    def mask(self, name: str, function) -> bytes:
+        """
+        :param name: the name of a column of texts
+        :param function: called with each value of the column, True for those
+                         wanted
+        :return: 1 for each story whose value is wanted, else 0
+        """
+        wanted = bytes(bool(function(value)) for value in self.values[name])
+        return bytes(map(wanted.__getitem__, self.columns[name]))
+
+    def counts(self, keys, mask=None) -> collections.Counter:
+        """
+        :param keys: the codes (or any key) of the stories, one for each
+        :param mask: the stories counted, 1 or 0 for each. All by default
+        :return: the number of stories, by key
+        """
+        if mask is not None:
+            keys = itertools.compress(keys, mask)
+        return collections.Counter(keys)
+
+    def totals(self, keys, name: str, mask=None) -> collections.Counter:
+        """
+        :param keys: the codes (or any key) of the stories, one for each
+        :param name: the name of a column of numbers
+        :param mask: the stories counted, 1 or 0 for each. All by default
+        :return: the sum of the numbers of the stories, by key
+        """
+        numbers = self.columns[name]
+        if mask is not None:
+            keys = itertools.compress(keys, mask)
+            numbers = itertools.compress(numbers, mask)
+        totals = collections.Counter()
+        for key, number in zip(keys, numbers):
+            totals[key] += number
+        return totals
+
+
+def _label(value) -> str:
+    """
+    :param value: a value of a column of texts
+    :return: how it is shown in the statistics
+    """
+    return 'Unknown' if value is None or value == '' else str(value)
+
+
+def _table(title: str, headers, rows) -> str:
+    """
+    :param title: the title of the table
+    :param headers: the header of each column
+    :param rows: the rows of the table, as the text of each cell
+    :return: the table, in a GENERAL_STATISTICS_TABLE_TEMPLATE. Every text is
+             escaped: the names come from the sites
+    """
+    return cst.GENERAL_STATISTICS_TABLE_TEMPLATE.format(
+        title=html.escape(title),
+        headers=''.join(f'<th>{html.escape(header)}</th>'
+                        for header in headers),
+        rows='\n'.join('<tr>{}</tr>'.format(''.join(
+            f'<td>{html.escape(cell)}</td>' for cell in row
+        )) for row in rows),
+    )
+
+
+def _breakdown(snapshot: Snapshot, name: str, complete: bytes,
+               unread: bytes) -> list:
+    """
+    :param snapshot: the stories
+    :param name: the name of a column of texts
+    :param complete: 1 for each complete story, else 0
+    :param unread: 1 for each unread story, else 0
+    :return: for each value of the column, by number of stories: the value,
+             its numbers of stories, chapters and words, its part of complete
+             stories, and its numbers of unread stories and words
+    """
+    codes = snapshot.columns[name]
+    stories = snapshot.counts(codes)
+    chapters = snapshot.totals(codes, 'chapters')
+    words = snapshot.totals(codes, 'words')
+    completed = snapshot.counts(codes, complete)
+    unread_stories = snapshot.counts(codes, unread)
+    backlog = snapshot.totals(codes, 'words', unread)
+    return [(snapshot.values[name][code], count, chapters[code], words[code],
+             completed[code] / count, unread_stories[code], backlog[code])
+            for code, count in stories.most_common()]
+
+
+def write_general_statistics(database, path: str) -> bool:
+    """
+    Compile the statistics of the whole library, all sites together, from a
+    Snapshot: the stories are read once, whatever the number of sites
+
+    :param database: a DataHandler of the library
+    :param path: the file to write
+    :return: False if there are no stories, so nothing was written
+    """
+    logger = tls.setup_logging('Statistics')
+    snapshot = Snapshot(database)
+    if len(snapshot) == 0:
+        logger.error('No stories saved')
+        return False
+
+    logger.info('Compiling the general statistics')
+    complete = snapshot.mask('status',
+                             lambda status: str(status).lower() == 'complete')
+    unread = bytes(map(operator.not_, snapshot.columns['read']))
+
+    tables = []
+    headers = ('Stories', 'Chapters', 'Words', 'Complete', 'Unread',
+               'Unread words')
+    # By site, universe and language
+    sites = _breakdown(snapshot, 'site', complete, unread)
+    for title, header, breakdown in (
+            ('Sites', 'Site', sorted(sites, key=lambda row: str(row[0]))),
+            ('Universes', 'Universe',
+             _breakdown(snapshot, 'universe', complete, unread)),
+            ('Languages', 'Language',
+             _breakdown(snapshot, 'language', complete, unread))):
+        tables.append(_table(
+            title,
+            (header,) + headers,
+            ((_label(value),) + tuple(f'{number:,}' for number in row[:3]) +
+             (f'{row[3]:.0%}',) + tuple(f'{number:,}' for number in row[4:])
+             for value, *row in breakdown)
+        ))
+
+    # The word counts, by range and site
+    bounds = (0,) + cst.STATISTICS_WORDS_BOUNDS
+    ranges = bytes(map(bisect.bisect_right,
+                       itertools.repeat(bounds),
+                       snapshot.columns['words']))
+    by_range = snapshot.counts(ranges)
+    by_site_range = snapshot.counts(zip(snapshot.columns['site'], ranges))
+    site_codes = sorted(range(len(snapshot.values['site'])),
+                        key=lambda code: str(snapshot.values['site'][code]))
+    tables.append(_table(
+        'Word counts',
+        ['Words'] + [_label(snapshot.values['site'][code])
+                     for code in site_codes] + ['All'],
+        ([f'{start:,} +' if end is None else f'{start:,} - {end - 1:,}'] +
+         [f'{by_site_range[code, i]:,}' for code in site_codes] +
+         [f'{by_range[i]:,}']
+         for i, (start, end) in enumerate(
+             itertools.zip_longest(bounds, bounds[1:]), 1))
+    ))
+
+    # The authors with the most stories, each site having its own
+    authors = snapshot.counts(zip(snapshot.columns['author'],
+                                  snapshot.columns['site']))
+    top = authors.most_common(cst.STATISTICS_TOP_AUTHORS)
+    authors_words = snapshot.totals(zip(snapshot.columns['author'],
+                                        snapshot.columns['site']), 'words')
+    tables.append(_table(
+        'Authors',
+        ('Author', 'Site', 'Stories', 'Words'),
+        ((_label(snapshot.values['author'][author]),
+          _label(snapshot.values['site'][site]),
+          f'{stories:,}', f'{authors_words[author, site]:,}')
+         for (author, site), stories in top)
+    ))
+
+    with tls.OutputFile(path) as f:
+        f.write(cst.GENERAL_STATISTICS_TEMPLATE.format(
+            sites=len(sites),
+            # The same name on two sites is counted once, as the universes
+            authors=len(snapshot.values['author']),
+            universes=len(snapshot.values['universe']),
+            chapters=sum(row[2] for row in sites),
+            words=sum(row[3] for row in sites),
+            stories=len(snapshot),
+            complete=f'{sum(complete) / len(snapshot):.0%}',
+            read=len(snapshot) - sum(unread),
+            unread=sum(unread),
+            backlog=sum(row[6] for row in sites),
+            tables=''.join(tables),
+        ))
+
+    logger.debug('Written')
+    return True
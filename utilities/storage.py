@@ -0,0 +1,372 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import os
+import zlib
+import hashlib
+import sqlite3 as sql
+
+import utilities.tools as tls
+import utilities.constants as cst
+
+
+class LooseStorage:
+    """
+    The files of a story (informations and chapters) saved as separate files
+    in the story's directory: `{relative_path}/{story_dir}/{name}`. It is the
+    historical layout, which can be read by a browser without the application.
+    """
+    def __init__(self, folder: str):
+        """
+        :param folder: the story's directory, ending with a '/'
+        """
+        self.folder = folder
+
+    def is_present(self) -> bool:
+        """
+        :return: True if the story has been saved
+        """
+        return os.path.isdir(self.folder)
+
+    def create(self):
+        """
+        Ensure the story can be saved
+        """
+        os.makedirs(self.folder, exist_ok=True)
+
+    def open(self, name: str) -> tls.OutputFile:
+        """
+        :param name: the name of the file to write
+        :return: the file to write, only replaced if its content changed
+        """
+        return tls.OutputFile(self.folder + name)
+
+    def read(self, name: str) -> str:
+        """
+        :param name: the name of the file
+        :return: its content
+        :raise: FileNotFoundError if the file does not exist
+        """
+        with open(self.folder + name, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def size(self, name: str) -> int:
+        """
+        :param name: the name of the file
+        :return: its size in bytes
+        :raise: FileNotFoundError if the file does not exist
+        """
+        return os.path.getsize(self.folder + name)
+
+    def exists(self, name: str) -> bool:
+        """
+        :param name: the name of the file
+        :return: True if the file exists
+        """
+        return os.path.isfile(self.folder + name)
+
+    def file_hash(self, name: str) -> str:
+        """
+        :param name: the name of the file
+        :return: the sha1 of its content, or an empty string if it does not
+                 exist
+        """
+        try:
+            return tls.file_hash(self.folder + name)
+        except FileNotFoundError:
+            return ''
+
+    def names(self) -> list:
+        """
+        :return: the names of all the files of the story, sorted
+        """
+        return sorted(os.listdir(self.folder))
+
+    def rename(self, old: str, new: str):
+        """
+        :param old: the current name of the file
+        :param new: its new name
+        """
+        os.replace(self.folder + old, self.folder + new)
+
+    def remove(self, name: str):
+        """
+        :param name: the name of the file to delete
+        """
+        os.remove(self.folder + name)
+
+    def delete(self):
+        """
+        Delete all the files of the story
+        :raise: FileNotFoundError if the story was not saved
+        """
+        for file in os.listdir(self.folder):
+            os.remove(self.folder + file)
+        os.rmdir(self.folder)
+
+    def move(self, destination: str):
+        """
+        Move all the files of the story at once, with a single rename
+
+        :param destination: the new path of the story's directory
+        :raise: FileNotFoundError if the story was not saved
+        """
+        os.replace(self.folder.rstrip('/'), destination)
+
+    def close(self):
+        """
+        Nothing to release for loose files
+        """
+
+
+class PackedFile:
+    """
+    A file to write in a PackedStorage. Like `tools.OutputFile`, the file is
+    only replaced when its new content differs from the saved one
+    """
+    def __init__(self, storage, name: str):
+
+        self.name = name
+        self.changed = False
+        self.size = 0
+
+        self.__storage = storage
+        self.__chunks = []
+        self.__compressor = None
+        self.__hash = None
+
+    def __enter__(self):
+
+        self.restart()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if exc_type is None and not self.is_identical():
+            self.__chunks.append(self.__compressor.flush())
+            self.__storage.save(self.name, self.__hash.hexdigest(), self.size,
+                                b''.join(self.__chunks))
+            self.changed = True
+
+        self.__chunks = []
+        return False
+
+    def write(self, text: str):
+        """
+        :param text: the text to add to the file
+        """
+        data = text.encode('utf-8')
+        self.__hash.update(data)
+        self.__chunks.append(self.__compressor.compress(data))
+        self.size += len(data)
+
+    def restart(self):
+        """
+        Discard everything written so far
+        """
+        self.__chunks = []
+        self.__compressor = zlib.compressobj()
+        self.__hash = hashlib.sha1()
+        self.size = 0
+
+    def is_identical(self) -> bool:
+        """
+        :return: True if what was written so far is exactly the content of the
+                 saved file
+        """
+        return self.__storage.file_hash(self.name) == self.__hash.hexdigest()
+
+
+class PackedStorage:
+    """
+    The files of a story packed in a single SQLite file,
+    `{relative_path}/{story_dir}.sqlite`, instead of one file per chapter.
+
+    Each file is compressed and indexed by its name (the primary key), so
+    accessing any chapter does not depend on the number of chapters and a
+    library of millions of chapters is only a few thousand files on disk.
+
+    The files can be exported to the loose layout (see `convert()`) to read
+    them in a browser.
+    """
+    def __init__(self, folder: str):
+        """
+        :param folder: the story's directory, ending with a '/'. It is not
+                       created: the packed file is next to it
+        """
+        self.folder = folder
+        self.path = folder.rstrip('/') + cst.PACKED_STORAGE_EXTENSION
+        self.__conn = None
+
+    def __connection(self) -> sql.Connection:
+        """
+        :return: the connection to the packed file, opened on first use
+        :raise: FileNotFoundError if the story was not saved
+        """
+        if self.__conn is None:
+            if not os.path.isfile(self.path):
+                raise FileNotFoundError(f'No such packed story: {self.path}')
+            self.__conn = sql.connect(self.path)
+        return self.__conn
+
+    # The methods below behave like those of LooseStorage
+
+    def is_present(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def create(self):
+        os.makedirs(self.path.rsplit('/', 1)[0], exist_ok=True)
+        conn = sql.connect(self.path)
+        conn.execute(cst.PACKED_FILES_TABLE_CREATION)
+        conn.commit()
+        conn.close()
+
+    def open(self, name: str) -> PackedFile:
+        return PackedFile(self, name)
+
+    def save(self, name: str, file_hash: str, size: int, data: bytes):
+        """
+        Save a compressed file. Used by PackedFile
+
+        :param name: the name of the file
+        :param file_hash: the sha1 of its content
+        :param size: the size of its content in bytes
+        :param data: the compressed content
+        """
+        with self.__connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO files VALUES (?,?,?,?)',
+                         (name, file_hash, size, data))
+
+    def file_hash(self, name: str) -> str:
+        """
+        :param name: the name of the file
+        :return: the sha1 of its content, or an empty string if it does not
+                 exist
+        """
+        row = self.__connection().execute(
+            'SELECT hash FROM files WHERE name=?', (name,)
+        ).fetchone()
+        return '' if row is None else row[0]
+
+    def read(self, name: str) -> str:
+        row = self.__connection().execute(
+            'SELECT data FROM files WHERE name=?', (name,)
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f'No such file: {self.path}:{name}')
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def size(self, name: str) -> int:
+        row = self.__connection().execute(
+            'SELECT size FROM files WHERE name=?', (name,)
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f'No such file: {self.path}:{name}')
+        return row[0]
+
+    def exists(self, name: str) -> bool:
+        return self.file_hash(name) != ''
+
+    def names(self) -> list:
+        return [row[0] for row in self.__connection().execute(
+            'SELECT name FROM files ORDER BY name'
+        )]
+
+    def rename(self, old: str, new: str):
+        with self.__connection() as conn:
+            conn.execute('DELETE FROM files WHERE name=?', (new,))
+            conn.execute('UPDATE files SET name=? WHERE name=?', (new, old))
+
+    def remove(self, name: str):
+        with self.__connection() as conn:
+            conn.execute('DELETE FROM files WHERE name=?', (name,))
+
+    def delete(self):
+        self.close()
+        os.remove(self.path)
+
+    def move(self, destination: str):
+        """
+        :param destination: the new path of the packed file, without its
+                            extension
+        """
+        self.close()
+        os.replace(self.path, destination + cst.PACKED_STORAGE_EXTENSION)
+
+    def close(self):
+        """
+        Close the connection to the packed file, if it was opened
+        """
+        if self.__conn is not None:
+            self.__conn.close()
+            self.__conn = None
+
+
+def get_storage(folder: str):
+    """
+    Get the storage of a story: the one in which it was saved or, if it was
+    never saved, the one chosen by constants.PACKED_STORAGE
+
+    :param folder: the story's directory, ending with a '/'
+    :return: a LooseStorage or a PackedStorage
+    """
+    packed = PackedStorage(folder)
+    if packed.is_present():
+        return packed
+
+    loose = LooseStorage(folder)
+    if loose.is_present() or not cst.PACKED_STORAGE:
+        return loose
+    return packed
+
+
+def story_folders() -> list:
+    """
+    Find every story saved in the save folder (the current working directory)
+    without using the database: the directory of each site (the relative_path
+    of its class, see constants.SITES) contains the stories' directories and
+    packed files. Any other directory is not the program's, and is left out
+
+    :return: the directories of the stories, ending with a '/', sorted
+    """
+    folders = set()
+    for relative_path in {site[0].relative_path for site in cst.SITES.values()}:
+        if not os.path.isdir(relative_path):
+            continue
+        for entry in os.scandir(relative_path):
+            if entry.is_dir():
+                folders.add(f'{relative_path}/{entry.name}/')
+            elif entry.name.endswith(cst.PACKED_STORAGE_EXTENSION):
+                name = entry.name[:-len(cst.PACKED_STORAGE_EXTENSION)]
+                folders.add(f'{relative_path}/{name}/')
+    return sorted(folders)
+
+
+def convert(folder: str, packed: bool):
+    """
+    Move the files of a saved story from one storage to the other. Packing a
+    story and exporting it back to loose files give the same files
+
+    :param folder: the story's directory, ending with a '/'
+    :param packed: True to pack the story, False to export it to loose files
+    :raise: FileNotFoundError if the story was not saved in the other storage
+    """
+    logger = tls.setup_logging('storage')
+
+    if packed:
+        source, destination = LooseStorage(folder), PackedStorage(folder)
+    else:
+        source, destination = PackedStorage(folder), LooseStorage(folder)
+
+    if not source.is_present():
+        raise FileNotFoundError(f'No story to convert in {folder}')
+
+    logger.info(f'Converting {folder} (packed: {packed})')
+    destination.create()
+    for name in source.names():
+        with destination.open(name) as f:
+            f.write(source.read(name))
+
+    source.delete()
+    destination.close()
+    logger.debug('Converted')
@@ -1,12 +1,14 @@
 __version__ = '2018.06.30'
 __author__ = 'Alexis BOURGET'
 
-import os
 import re
 import datetime
+import collections
 
 import utilities.tools as tls
 import utilities.constants as cst
+import utilities.chapter_store as cs
+import utilities.storage as stg
 
 ################################################################################
 # This part is to be updated each time a new site is added
@@ -62,14 +64,33 @@ class StoryWriter:
 
     The css corresponding to the action is automatically written in the `0/css/`
     directory.
-    """
 
-    def __init__(self):
+    The files of a story are written in its storage (`.storage`): either loose
+    files in its directory or a single packed file (see utilities/storage.py).
+
+    Each chapter written is registered in the database (see
+    `DataHandler.add_chapter()`), which is how `.update()` knows what is
+    missing without looking at the story's directory. Its text is kept in the
+    `ChapterStore`, which is how `library.render_library()` can write it
+    again without fetching it, and indexed for the search if
+    constants.SEARCH_CHAPTERS is set.
+    """
 
+    def __init__(self, database):
+        """
+        :param database: the DataHandler in which the chapters are registered.
+                         Can be None if only `.write_informations()` and
+                         `.render_chapter()` are used
+        """
         self.__logger = tls.setup_logging('StoryWriter')
+        self.__database = database
+        self.__store = cs.ChapterStore()
 
         self.story = None
         self.folder = ''
+        self.storage = None
+        # Bytes removed from the chapters by Story.sanitize_chapter(), by site
+        self.saved_bytes = collections.Counter()
 
     def set_url(self, url: str):
         """
@@ -91,26 +112,126 @@ class StoryWriter:
                 self.__logger.debug('Set')
                 break
 
+        self.set_story(self.story)
+
+    def set_story(self, story):
+        """
+        Set the story to use for the writer when it is already built
+
+        :param story: the new story to use, an object inheriting from the Story
+                      class
+        """
+        self.story = story
         folder = f'{self.story.relative_path}/{self.story.story_dir}/'
         self.folder = folder.lower()
 
-    def __write_chapters(self, frm: int, end: int):
+        if self.storage is not None:
+            self.storage.close()
+        self.storage = stg.get_storage(self.folder)
+
+    def __chapter_title(self, chapter_num: int) -> str:
         """
-        Write the chapters between the given limits (including those limits)
+        :param chapter_num: the number of the chapter
+        :return: the title used for this chapter
+        """
+        if len(self.story.chapters) == 0:
+            return self.story.title
+        return self.story.chapters[chapter_num - 1]
 
-        :param frm: the first chapter to be written
-        :param end: the last chapter to be written
+    def __navigation_links(self, chapter_num: int) -> tuple:
         """
-        self.__logger.info(f'Writing chapters from {frm} to {end}')
+        :param chapter_num: the number of the chapter
+        :return: the links to the previous and the next chapters
+        """
+        length = len(str(self.story.chapter_count))
 
-        # Writing the chapter's css
-        self.__logger.debug('Writing chapter css')
-        with open('0/css/chapter_style.css', 'w', encoding='utf-8') as f:
-            f.write(cst.CHAPTER_CSS)
+        # Links in case no previous or next chapter exists
+        previous_link = cst.NO_LINK_BASE.format('previous')
+        next_link = cst.NO_LINK_BASE.format('next')
+
+        # Chapters title are accessible
+        if len(self.story.chapters) != 0:
+            if chapter_num > 1:
+                previous_link = cst.LINK_BASE.format(
+                    'previous',
+                    str(chapter_num - 1).zfill(length),
+                    f'<< {chapter_num - 1} <<'
+                )
+            if chapter_num < self.story.chapter_count:
+                next_link = cst.LINK_BASE.format(
+                    'next',
+                    str(chapter_num + 1).zfill(length),
+                    f'>> {chapter_num + 1} >>'
+                )
+
+        return previous_link, next_link
+
+    def __chapter_files_length(self, chapter_num: int) -> int:
+        """
+        Find the length used to name an already written chapter's file: it is
+        the length of the chapter count at the time it was written
+
+        :param chapter_num: the number of the chapter
+        :return: the length, or 0 if the file does not exist
+        """
+        # No story has a million chapters
+        for length in range(len(str(chapter_num)), 7):
+            if self.storage.exists(f'{str(chapter_num).zfill(length)}.html'):
+                return length
+        return 0
 
-        if not 0 < frm <= end <= self.story.chapter_count:
-            raise ValueError(f'Invalid interval of chapters [{frm}:{end}]')
+    def __relink_chapters(self, chapters, old_length: int):
+        """
+        Update the already written chapters without fetching them again: their
+        files are renamed to the length of the current chapter count and their
+        links to the previous and next chapters are rewritten in place
+
+        :param chapters: the numbers of the chapters to relink
+        :param old_length: the length used to name their files
+        """
+        chapters = list(chapters)
+        self.__logger.info(f'Relinking {len(chapters)} chapters')
 
+        length = len(str(self.story.chapter_count))
+        sizes = {}
+
+        for chapter_num in chapters:
+            old_file = f'{str(chapter_num).zfill(old_length)}.html'
+            new_file = f'{str(chapter_num).zfill(length)}.html'
+
+            try:
+                text = self.storage.read(old_file)
+            # Manually deleted, it will be fetched again
+            except FileNotFoundError:
+                self.__logger.debug(f'Chapter {chapter_num} is missing')
+                continue
+
+            previous_link, next_link = self.__navigation_links(chapter_num)
+            # A function is used to avoid any interpretation of the links
+            text = re.sub(cst.RE_PREVIOUS_LINK, lambda _: previous_link, text)
+            text = re.sub(cst.RE_NEXT_LINK, lambda _: next_link, text)
+
+            with self.storage.open(new_file) as f:
+                f.write(text)
+            if old_file != new_file:
+                self.storage.remove(old_file)
+
+            sizes[chapter_num] = f.size
+
+        self.__database.set_chapters_size(self.story.url, sizes)
+        self.__logger.debug('Chapters relinked')
+
+    def render_chapter(self, chapter_num: int, chapter_text: str) -> int:
+        """
+        Write the file of a chapter from its text and the story's properties,
+        without any network access. The text is sanitized first (see
+        `Story.sanitize_chapter()`)
+
+        :param chapter_num: the number of the chapter
+        :param chapter_text: the text of the chapter, as returned by
+                             `Story.get_chapter()`
+        :return: the size of the file, in bytes, and whether it was changed
+        """
         length = len(str(self.story.chapter_count))
 
         # Link to the informations file, which is the same for each chapter
@@ -119,91 +240,155 @@ class StoryWriter:
             f'{self.story.get_informations_title()}_informations'.lower(),
             f'{self.story.title} by {self.story.author}'
         )
+        previous_link, next_link = self.__navigation_links(chapter_num)
 
-        for chapter_num in range(frm, end + 1):
+        sanitized_text = self.story.sanitize_chapter(chapter_text)
+        self.saved_bytes[self.story.site] += (
+            len(chapter_text.encode('utf-8')) -
+            len(sanitized_text.encode('utf-8'))
+        )
 
-            self.__logger.debug(f'Writing chapter {chapter_num}')
+        file_title = f'{str(chapter_num).zfill(length)}.html'
+        with self.storage.open(file_title) as f:
+            tls.write_template(
+                f,
+                cst.CHAPTER_TEMPLATE,
+                page_title=f'{self.story.title} | {chapter_num}',
+                previous_link=previous_link,
+                index_link=index_link,
+                next_link=next_link,
+                chapter_title=self.__chapter_title(chapter_num),
+                chapter_text=sanitized_text,
+            )
+
+        return f.size, f.changed
+
+    def __write_chapters(self, chapters, stored=None):
+        """
+        Write the given chapters, registering each of them in the database once
+        it is completely written
+
+        :param chapters: the numbers of the chapters to be written, in order
+        :param stored: the chapters whose text is stored and should not be
+                       fetched again, by number, as returned by
+                       `DataHandler.get_chapters()`
+        """
+        chapters = list(chapters)
+        stored = {} if stored is None else stored
+        self.__logger.info(f'Writing {len(chapters)} chapters')
+
+        # Writing the chapter's css
+        self.__logger.debug('Writing chapter css')
+        tls.write_file('0/css/chapter_style.css', cst.CHAPTER_CSS)
+
+        for chapter_num in chapters:
+            if not 0 < chapter_num <= self.story.chapter_count:
+                raise ValueError(f'Invalid chapter: {chapter_num}')
+
+        # If the writing is interrupted, those chapters will be written again
+        # during the next update
+        self.__database.mark_chapters_pending(self.story.url, chapters)
+        saved_bytes = self.saved_bytes[self.story.site]
+
+        for chapter_num in chapters:
 
-            # Link to the previous chapter in case none exists
-            previous_link = "<a class='previous'>Nothing more this way</a>"
-            # Link to the next chapter in case none exists
-            next_link = "<a class='next'>Nothing more this way</a>"
+            self.__logger.debug(f'Writing chapter {chapter_num}')
 
-            if len(self.story.chapters) == 0:
-                chapter_title = self.story.title
-            # Chapters title are accessible
+            try:
+                _, _, content_hash, _, fetched_at, _ = stored[chapter_num]
+                chapter_text = self.__store.get(content_hash)
+            except (KeyError, FileNotFoundError):
+                chapter_text = self.story.get_chapter(chapter_num)
+                content_hash = self.__store.add(chapter_text)
+                fetched_at = None
             else:
-                chapter_title = self.story.chapters[chapter_num - 1]
-
-                if chapter_num > 1:
-                    previous_link = cst.LINK_BASE.format(
-                        'previous',
-                        str(chapter_num - 1).zfill(length),
-                        f'<< {chapter_num - 1} <<'
-                    )
-                if chapter_num < self.story.chapter_count:
-                    next_link = cst.LINK_BASE.format(
-                        'next',
-                        str(chapter_num + 1).zfill(length),
-                        f'>> {chapter_num + 1} >>'
-                    )
-
-            file_title = f'{str(chapter_num).zfill(length)}.html'
-            with open(self.folder + file_title, 'w', encoding='utf-8') as f:
-                f.write(cst.CHAPTER_TEMPLATE.format(
-                    page_title=f'{self.story.title} | {chapter_num}',
-                    previous_link=previous_link,
-                    index_link=index_link,
-                    next_link=next_link,
-                    chapter_title=chapter_title,
-                    chapter_text=self.story.get_chapter(chapter_num),
-                ))
+                self.__logger.debug('Chapter text was stored')
+
+            if cst.SEARCH_CHAPTERS:
+                self.__database.index_chapter_text(
+                    content_hash,
+                    tls.html_to_text(chapter_text)
+                )
+
+            self.__database.add_chapter(
+                self.story.url,
+                chapter_num,
+                self.__chapter_title(chapter_num),
+                content_hash,
+                self.render_chapter(chapter_num, chapter_text)[0],
+                cst.CHAPTER_COMPLETE,
+                fetched_at,
+            )
 
             self.__logger.debug('Chapter written')
 
-        self.__logger.debug('Chapters written')
+        saved_bytes = self.saved_bytes[self.story.site] - saved_bytes
+        self.__logger.debug(f'Chapters written, {saved_bytes:,} bytes saved by '
+                            f'sanitizing them')
 
-    def write_informations(self):
+    def write_informations(self, css=True) -> bool:
         """
         Write the informations for the current story
+
+        :param css: False not to write the css, when it is written once for
+                    many stories (see library.render_library())
+        :return: True if the informations file was changed
         """
         self.__logger.info('Writing informations')
 
         # Writing the css
-        with open('0/css/informations_style.css', 'w', encoding='utf-8') as f:
-            f.write(cst.INFORMATIONS_CSS)
+        if css:
+            tls.write_file('0/css/informations_style.css',
+                           cst.INFORMATIONS_CSS)
 
         file_title = f'{self.story.get_informations_title()}_informations.html'
+        file_title = file_title.lower()
         date = datetime.datetime(1, 1, 1).today().strftime('%H:%M - %d %B %Y')
 
-        table_of_contents = ''
-
         length = len(str(self.story.chapter_count))
         if len(self.story.chapters) == 0:
             self.story.chapters = [self.story.title]
             length = 1
 
-        for i, chapter in enumerate(self.story.chapters):
-            table_of_contents += (
-                f"<a class='chapter' href='{str(i+1).zfill(length)}.html'>"
-                f"{self.story.chapters[i]}</a>\n"
-            )
-
-        with open(self.folder + file_title.lower(), 'w', encoding='utf-8') as f:
-            f.write(cst.INFORMATIONS_TEMPLATE.format(
-                story_title=self.story.title,
-                site=self.story.site,
-                author=self.story.get_author(),
-                writing_date=date,
-                universe=self.story.get_universe(),
-                url=self.story.url,
-                summary=self.story.summary,
-                tokens=self.story.tokens,
-                chapter_count=self.story.chapter_count,
-                table_of_contents=table_of_contents,
-            ))
+        # The date of the previous writing is kept if nothing else changed,
+        # else the file would be different each time
+        try:
+            dates = [re.search(cst.RE_WRITING_DATE,
+                               self.storage.read(file_title)).group(1)]
+        except (FileNotFoundError, AttributeError):
+            dates = []
+        dates.append(date)
+
+        with self.storage.open(file_title) as f:
+            for writing_date in dates:
+                f.restart()
+                # Generated line by line while writing: a story with thousands
+                # of chapters would otherwise need the whole table built in
+                # memory first
+                table_of_contents = (
+                    f"<a class='chapter' href='{str(i+1).zfill(length)}.html'>"
+                    f"{chapter}</a>\n"
+                    for i, chapter in enumerate(self.story.chapters)
+                )
+                tls.write_template(
+                    f,
+                    cst.INFORMATIONS_TEMPLATE,
+                    story_title=self.story.title,
+                    site=self.story.site,
+                    author=self.story.get_author(),
+                    writing_date=writing_date,
+                    universe=self.story.get_universe(),
+                    url=self.story.url,
+                    summary=self.story.summary,
+                    tokens=self.story.tokens,
+                    chapter_count=self.story.chapter_count,
+                    table_of_contents=table_of_contents,
+                )
+                if f.is_identical():
+                    break
 
         self.__logger.debug('Informations written')
+        return f.changed
 
     def download(self):
         """
@@ -211,92 +396,251 @@ class StoryWriter:
         """
         self.__logger.info("Downloading story")
 
-        try:
-            os.makedirs(self.story.relative_path.lower())
-        except FileExistsError:
-            self.__logger.debug('Site directory exists')
-        else:
-            self.__logger.debug(f'Created: {self.story.relative_path.lower()}')
-
-        try:
-            os.mkdir(self.folder)
-        except FileExistsError:
-            self.__logger.debug('Story directory existed: deleting it')
-            for file in os.listdir(self.folder):
-                os.remove(self.folder + file)
-            os.rmdir(self.folder)
-            os.mkdir(self.folder)
-            self.__logger.debug('Story directory deleted')
+        if self.storage.is_present():
+            self.__logger.debug('Story existed: overwriting it')
         else:
+            self.storage.create()
             self.__logger.debug(f'Created: {self.folder}')
 
+        self.__database.delete_chapters(self.story.url)
+
         self.write_informations()
-        self.__write_chapters(1, self.story.chapter_count)
+        self.__write_chapters(range(1, self.story.chapter_count + 1))
+
+        # The files are only rewritten when their content changed so the
+        # previous save is not deleted beforehand: only the files which are no
+        # longer part of the story are
+        length = len(str(self.story.chapter_count))
+        kept = {
+            f'{self.story.get_informations_title()}_informations.html'.lower()
+        }
+        kept.update(f'{str(chapter_num).zfill(length)}.html'
+                    for chapter_num in range(1, self.story.chapter_count + 1))
+        for file in self.storage.names():
+            if file not in kept:
+                self.storage.remove(file)
+                self.__logger.debug(f'Deleted: {file}')
 
         self.__logger.debug('Story downloaded')
 
+    def register(self):
+        """
+        Save the current story without any of its chapters: only its
+        informations are written. Its chapters can then be written on demand,
+        when needed, with `.write_chapters()`
+        """
+        self.__logger.info('Registering story')
+
+        if not self.storage.is_present():
+            self.storage.create()
+            self.__logger.debug(f'Created: {self.folder}')
+        self.write_informations()
+
+        self.__logger.debug('Story registered')
+
+    def write_chapters(self, chapter_nums):
+        """
+        Write some chapters of the current story, leaving the others as they
+        are, so a story can be read before (or without) being fully downloaded
+        and damaged chapters can be repaired alone. A chapter is only fetched if
+        its text is not stored.
+
+        The chapters already present are relinked if the chapter count changed
+        since they were written, exactly like during `.update()`
+
+        :param chapter_nums: the numbers of the chapters
+        :raise: ValueError if a chapter does not exist
+                Internet related errors if the connection fails
+        """
+        chapter_nums = list(chapter_nums)
+        self.__logger.info(f'Writing chapters {chapter_nums} on demand')
+
+        if not self.storage.is_present():
+            self.storage.create()
+            self.__logger.debug(f'Created: {self.folder}')
+
+        chapters = self.__database.get_chapters(self.story.url)
+
+        # Chapters removed from the site
+        if len(chapters) != 0 and chapters[-1][0] > self.story.chapter_count:
+            self.__database.delete_chapters(self.story.url,
+                                            self.story.chapter_count + 1)
+            chapters = [ch for ch in chapters
+                        if ch[0] <= self.story.chapter_count]
+
+        if len(chapters) != 0:
+            highest_chapter = chapters[-1][0]
+            length = len(str(self.story.chapter_count))
+            old_length = self.__chapter_files_length(highest_chapter)
+            if old_length not in (0, length):
+                self.__relink_chapters((ch[0] for ch in chapters), old_length)
+                chapters = self.__database.get_chapters(self.story.url)
+            # Its link to the next chapter may be missing
+            elif old_length == length and \
+                    highest_chapter < self.story.chapter_count:
+                self.__relink_chapters((highest_chapter,), length)
+
+        self.write_informations()
+
+        stored = {
+            chapter[0]: chapter for chapter in chapters
+            if chapter[5] == cst.CHAPTER_COMPLETE
+        }
+        self.__write_chapters(chapter_nums, stored)
+
+        self.__logger.debug('Chapters written on demand')
+
+    def __register_present_chapters(self):
+        """
+        Register in the database the chapters already present in the story's
+        directory. Only used for stories saved before the chapters were
+        registered in the database: their content hash is unknown
+        """
+        self.__logger.info('Registering the chapters already present')
+
+        # The files of the chapters, by number: sorted by name, 10.html would
+        # come before 2.html
+        files = {}
+        for file in self.storage.names():
+            result = re.fullmatch(r'(\d+).html', file)
+            if result is not None:
+                files[int(result.group(1))] = file
+
+        # Check at which chapter is the first discontinuity
+        highest_chapter = 0
+        for number in sorted(files):
+            # If there is no discontinuity, prepare the next check
+            if number == highest_chapter + 1:
+                highest_chapter += 1
+            else:
+                break
+
+        for chapter_num in range(1, highest_chapter + 1):
+            # The titles may have changed since but there is no way to know
+            if chapter_num <= self.story.chapter_count:
+                title = self.__chapter_title(chapter_num)
+            else:
+                title = ''
+            self.__database.add_chapter(
+                self.story.url,
+                chapter_num,
+                title,
+                '',
+                self.storage.size(files[chapter_num]),
+                cst.CHAPTER_COMPLETE,
+            )
+
+        self.__logger.debug(f'{highest_chapter} chapters registered')
+
     def update(self):
         """
         Update the current story, adding the missing content (if there is any)
         to any previous save of it or downloading it fully if it had not been
         saved before
 
+        The chapters to write are the ones missing from the database, those
+        whose writing was interrupted, those whose file was modified or deleted
+        and those whose title changed on the site
+
         If it has been downloaded and the site does not allow update, nothing is
         done
         """
         self.__logger.info('Updating story')
 
         # Story wasn't present already
-        if not os.path.isdir(self.folder):
+        if not self.storage.is_present():
             self.download()
             return
 
-        # Check at which chapter is the first discontinuity
-        # If there are none, highest_chapter is the number of chapter already
-        # downloaded
-        highest_chapter = 0
-        for file in sorted(os.listdir(self.folder)):
-            result = re.fullmatch(r'(\d*).html', file)
-            # If the file is a chapter
-            if result is not None:
-                # If there is no discontinuity, prepare the next check
-                if int(result.group(1)) == highest_chapter + 1:
-                    highest_chapter += 1
-                else:
-                    break
+        chapters = self.__database.get_chapters(self.story.url)
+        # The story was saved before the chapters were registered
+        if len(chapters) == 0:
+            self.__register_present_chapters()
+            chapters = self.__database.get_chapters(self.story.url)
+
+        # Chapters removed from the site
+        if len(chapters) != 0 and chapters[-1][0] > self.story.chapter_count:
+            self.__logger.info('Chapters were removed from the story')
+            self.__database.delete_chapters(self.story.url,
+                                            self.story.chapter_count + 1)
+            chapters = [ch for ch in chapters
+                        if ch[0] <= self.story.chapter_count]
 
         # The story was registered but no chapter has been downloaded or they
         # were manually deleted outside of the application
-        if highest_chapter == 0:
+        if len(chapters) == 0:
+            self.download()
+            return
+
+        highest_chapter = chapters[-1][0]
+
+        # The files are named using the chapter count at the time they were
+        # written, which is not always highest_chapter (interrupted download)
+        length = len(str(self.story.chapter_count))
+        old_length = self.__chapter_files_length(highest_chapter)
+
+        # The chapters files were manually deleted outside of the application
+        if old_length == 0:
             self.download()
             return
-        else:
-            self.__logger.debug(f'{highest_chapter} chapters already present')
 
         # Passed a number like 9->10, 99->100, 999->1000 and so changed all
-        # the internal links. Easier to update them by downloading all again
-        # Yes, that's laziness but it shouldn't happen that often except for
-        # the 9->10 which is not that costly to do
-        if len(str(highest_chapter)) < len(str(self.story.chapter_count)):
+        # the internal links: the files already present are renamed and their
+        # links updated locally, only the new chapters will be fetched
+        if old_length != length:
             self.__logger.info(
                 f'{highest_chapter} chapters are present and story has '
                 f'currently {self.story.chapter_count} chapters'
             )
-            self.download()
-            return
+            self.__relink_chapters((ch[0] for ch in chapters), old_length)
+            chapters = self.__database.get_chapters(self.story.url)
         else:
-            self.__logger.debug('No re-download due to 9->10 like change')
+            self.__logger.debug('No relinking due to 9->10 like change')
 
         # Update the informations
         self.write_informations()
 
+        # Only the chapters completely written, whose title did not change and
+        # whose file still has the size it had when written are kept
+        registered = {chapter[0]: chapter for chapter in chapters}
+        to_write = []
+        for chapter_num in range(1, self.story.chapter_count + 1):
+            try:
+                _, title, _, byte_size, _, status = registered[chapter_num]
+                file_size = self.storage.size(
+                    f'{str(chapter_num).zfill(length)}.html'
+                )
+            # Never written or manually deleted
+            except (KeyError, FileNotFoundError):
+                to_write.append(chapter_num)
+                continue
+            if status != cst.CHAPTER_COMPLETE or file_size != byte_size or \
+                    title != self.__chapter_title(chapter_num):
+                to_write.append(chapter_num)
+        self.__logger.debug(
+            f'{self.story.chapter_count - len(to_write)} chapters already '
+            f'present'
+        )
+
         # Story already up-to-date
-        if highest_chapter == self.story.chapter_count:
+        if len(to_write) == 0:
             self.__logger.info('Story already up-to-date')
             return
 
-        # Always rewrite the last correct chapter to ensure the link to the next
+        # Always relink the last correct chapter to ensure the link to the next
         # one is correct
-        self.__write_chapters(highest_chapter, self.story.chapter_count)
+        if highest_chapter < self.story.chapter_count and \
+                highest_chapter not in to_write and old_length == length:
+            self.__relink_chapters((highest_chapter,), length)
+
+        # Chapters only needing to be written again (new title, modified file)
+        # are not fetched if their text is stored. Those whose writing was
+        # interrupted are, since it is unknown if it was the update of their
+        # text which was interrupted
+        stored = {
+            chapter[0]: chapter for chapter in chapters
+            if chapter[5] == cst.CHAPTER_COMPLETE
+        }
+        self.__write_chapters(to_write, stored)
 
         self.__logger.debug('Story updated')
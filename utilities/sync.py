@@ -0,0 +1,285 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import os
+import re
+import json
+import ntpath
+import hashlib
+import posixpath
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import utilities.tools as tls
+import utilities.constants as cst
+import utilities.data_handler as dh
+import utilities.chapter_store as cs
+import utilities.storage as stg
+
+
+def library_manifest(database) -> dict:
+    """
+    Describe the library using only the database: each story has a version,
+    which changes as soon as its row (save for the read status, series and
+    position, which belong to each library) or any of its chapters changes
+
+    :param database: the DataHandler of the library
+    :return: the version of each story, by url
+    """
+    all_chapters = database.get_all_chapters()
+    all_characters = database.get_all_characters()
+    manifest = {}
+    for story in database.get_stories():
+        version = hashlib.sha1(json.dumps([
+            story[:12] + story[15:],
+            all_chapters.get(story[0], []),
+            all_characters.get(story[0], []),
+        ]).encode())
+        manifest[story[0]] = version.hexdigest()
+    return manifest
+
+
+def story_manifest(database, url: str, root='') -> dict:
+    """
+    Describe a story completely: its row, its chapters and the hash of each
+    of its files
+
+    :param database: the DataHandler of the library
+    :param url: the url of the story
+    :param root: the save folder of the library, if it is not the current
+                 working directory
+    :return: the story's 'row', 'chapters', 'characters' and 'files', or None
+             if the story is not in the database
+    """
+    story = database.get_story(url)
+    if story is None:
+        return None
+
+    folder = f"{story[1].rsplit('/', 1)[0]}/"
+    storage = stg.get_storage(os.path.join(root, folder))
+    try:
+        files = {name: storage.file_hash(name) for name in storage.names()}
+    except (FileNotFoundError, NotADirectoryError):
+        files = {}
+    finally:
+        storage.close()
+
+    return {
+        'row': list(story),
+        'chapters': [list(chapter) for chapter in database.get_chapters(url)],
+        'characters': [list(character)
+                       for character in database.get_characters(url)],
+        'files': files,
+    }
+
+
+def _is_inside(path: str) -> bool:
+    """
+    :param path: a path sent by another library, relative to the save folder
+    :return: False if it is empty, absolute (on any system) or goes up a
+             directory: it would be written outside of the save folder
+    """
+    return path != '' and \
+        not posixpath.isabs(path) and \
+        not ntpath.isabs(path) and \
+        ntpath.splitdrive(path)[0] == '' and \
+        '..' not in re.split(r'[\\/]', path)
+
+
+class DirectoryPeer:
+    """
+    Another library reachable as a directory (a mounted drive, a shared
+    folder, ...). Its database is only read: it is neither created nor
+    migrated, and must be of the same version as this library's
+    """
+    def __init__(self, root: str):
+        """
+        :param root: the save folder of the other library
+        :raise: sqlite3.DatabaseError if its database is missing or unusable
+                ValueError if its database is of another version
+        """
+        self.root = os.path.abspath(root)
+        self.__database = dh.DataHandler(
+            os.path.join(self.root, '0/data/ffndl_database.db'),
+            read_only=True
+        )
+        if self.__database.get_version() != len(cst.DATABASE_MIGRATIONS):
+            self.__database.close()
+            raise ValueError(f'The library in "{self.root}" must be opened '
+                             f'by this version of {cst.APP_NAME} first')
+        self.__store = cs.ChapterStore(
+            os.path.join(self.root, cst.RAW_CHAPTERS_FOLDER)
+        )
+
+    def manifest(self) -> dict:
+        return library_manifest(self.__database)
+
+    def story_manifest(self, url: str) -> dict:
+        return story_manifest(self.__database, url, self.root)
+
+    def read(self, folder: str, name: str) -> str:
+        storage = stg.get_storage(os.path.join(self.root, folder))
+        try:
+            return storage.read(name)
+        finally:
+            storage.close()
+
+    def read_text(self, content_hash: str) -> str:
+        return self.__store.get(content_hash)
+
+    def close(self):
+        self.__database.close()
+
+
+class HttpPeer:
+    """
+    Another library served by its reading server (see
+    utilities/reading_server.py)
+    """
+    def __init__(self, address: str):
+        """
+        :param address: the address of the reading server, like
+                        http://192.168.1.2:8000
+        """
+        self.address = address.rstrip('/')
+
+    def __get(self, path: str) -> str:
+        """
+        :param path: the path to get from the server
+        :return: the content sent by the server, exactly as it is
+        """
+        with urllib.request.urlopen(f'{self.address}/{path}',
+                                    timeout=30) as page:
+            return page.read().decode('utf-8')
+
+    def manifest(self) -> dict:
+        return json.loads(self.__get('sync/manifest'))
+
+    def story_manifest(self, url: str) -> dict:
+        return json.loads(self.__get(
+            f'sync/story?{urllib.parse.urlencode({"url": url})}'
+        ))
+
+    def read(self, folder: str, name: str) -> str:
+        return self.__get(urllib.parse.quote(f'{folder}{name}'))
+
+    def read_text(self, content_hash: str) -> str:
+        try:
+            return self.__get(
+                f'sync/text?{urllib.parse.urlencode({"hash": content_hash})}'
+            )
+        except urllib.error.HTTPError as err:
+            if err.code == 404:
+                raise FileNotFoundError(content_hash) from err
+            raise
+
+    def close(self):
+        pass
+
+
+def pull(database, peer, progress=None) -> dict:
+    """
+    Bring the library up to date with another one: only the stories whose
+    version differs are looked at, and only their files whose hash differs
+    are transferred. The stories missing from the other library are kept,
+    and so are the read status, series and position of the local ones
+
+    The stored text of each chapter is transferred too, if it is not already
+    stored: a chapter whose text the other library does not have is not
+    registered, and is fetched again by the next update. A story whose
+    directory or files are not inside the save folder is rejected
+
+    :param database: the DataHandler of the library
+    :param peer: the other library, a DirectoryPeer or an HttpPeer
+    :param progress: a function called with (done, total) each time a story
+                     is synchronized
+    :return: a summary with the number of 'stories' synchronized, 'rejected'
+             and which 'failed', of 'files' transferred and 'deleted', of
+             stored 'texts' transferred, and of 'bytes' transferred
+    """
+    logger = tls.setup_logging('sync')
+    logger.info('Synchronizing the library')
+
+    local = library_manifest(database)
+    remote = peer.manifest()
+    changed = sorted(url for url, version in remote.items()
+                     if local.get(url) != version)
+    logger.info(f'{len(changed)} stories to synchronize')
+
+    store = cs.ChapterStore()
+    summary = {'stories': 0, 'rejected': 0, 'failed': 0, 'files': 0,
+               'deleted': 0, 'texts': 0, 'bytes': 0}
+    for done, url in enumerate(changed, 1):
+        logger.debug(f'Synchronizing "{url}"')
+        storage = None
+        try:
+            theirs = peer.story_manifest(url)
+            if theirs is None:
+                continue
+            ours = story_manifest(database, url) or {'files': {}}
+
+            folder = f"{theirs['row'][1].rsplit('/', 1)[0]}/"
+            if not all(_is_inside(path) for path in
+                       [theirs['row'][1]] +
+                       [f'{folder}{name}' for name in theirs['files']]):
+                logger.error(f'Rejected "{url}": a path is outside of the '
+                             f'save folder')
+                summary['rejected'] += 1
+                continue
+
+            chapters = []
+            for chapter in theirs['chapters']:
+                content_hash = chapter[2]
+                if content_hash and not store.has(content_hash):
+                    try:
+                        # Checked first: the hash is part of a path
+                        if re.fullmatch(cst.RE_CONTENT_HASH,
+                                        content_hash) is None:
+                            raise ValueError(f'Not a hash: {content_hash}')
+                        text = peer.read_text(content_hash)
+                        if cs.ChapterStore.text_hash(text) != content_hash:
+                            raise ValueError(f'Wrong text for {content_hash}')
+                    except (FileNotFoundError, ValueError) as err:
+                        logger.error(f'Chapter {chapter[0]} of "{url}" not '
+                                     f'registered: {err}')
+                        continue
+                    store.add(text)
+                    summary['texts'] += 1
+                    summary['bytes'] += len(text.encode('utf-8'))
+                chapters.append(chapter)
+
+            storage = stg.get_storage(folder)
+            if not storage.is_present():
+                storage.create()
+
+            for name, file_hash in theirs['files'].items():
+                if ours['files'].get(name) != file_hash:
+                    text = peer.read(folder, name)
+                    with storage.open(name) as f:
+                        f.write(text)
+                    summary['files'] += 1
+                    summary['bytes'] += f.size
+            for name in ours['files'].keys() - theirs['files'].keys():
+                storage.remove(name)
+                summary['deleted'] += 1
+
+            # Written last: an interrupted synchronization is done again
+            database.save_story_row(tuple(theirs['row']),
+                                    theirs.get('characters', []))
+            database.set_chapters(url, chapters)
+            summary['stories'] += 1
+        # The connection failed or the other library changed meanwhile (a file
+        # it listed is gone...): the story is left as it was, the others are
+        # still synchronized. URLError and HTTPError are OSErrors
+        except (OSError, ValueError, KeyError) as err:
+            logger.error(f'Could not synchronize "{url}": {err}')
+            summary['failed'] += 1
+        finally:
+            if storage is not None:
+                storage.close()
+            if progress is not None:
+                progress(done, len(changed))
+
+    logger.debug(f'Library synchronized: {summary}')
+    return summary
@@ -1,8 +1,13 @@
 __version__ = '2018.06.30'
 __author__ = 'Alexis BOURGET'
 
+import os
 import re
+import html
+import string
+import hashlib
 import logging
+import tempfile
 import urllib.request
 import urllib.parse
 import tkinter as tk
@@ -99,3 +104,286 @@ def clean(text: str) -> str:
     text = urllib.parse.unquote(text, errors='strict').translate(trans)
     _logger.debug('Text cleaned')
     return text
+
+
+# A comment or a tag: what sanitize_html() looks at
+_RE_HTML_TOKEN = re.compile(r'<!--.*?-->|<(/?)([a-zA-Z][a-zA-Z0-9]*)([^>]*)>',
+                            re.DOTALL)
+_RE_WHITESPACES = re.compile(r'\s{2,}')
+_RE_HTML_ATTRIBUTE = re.compile(
+    r"""([a-zA-Z][\w:-]*)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+)))?"""
+)
+
+
+def sanitize_html(text: str, attributes=None, styles=None) -> str:
+    """
+    Remove the presentation markup of an HTML text while keeping everything
+    needed to read it: the comments, the attributes and style declarations
+    which are not kept, the <span> and <font> left without attributes (and
+    their closing tag) and the runs of whitespaces.
+
+    The text is read twice (tag by tag, then for the whitespaces left) so it
+    takes a time proportional to its length. Sanitizing a sanitized text
+    changes nothing.
+
+    :param text: the HTML text
+    :param attributes: the attributes to keep, constants.SANITIZE_ATTRIBUTES by
+                       default ('style' is handled separately)
+    :param styles: the style properties to keep, constants.SANITIZE_STYLES by
+                   default
+    :return: the sanitized text
+    """
+    attributes = cst.SANITIZE_ATTRIBUTES if attributes is None else attributes
+    styles = cst.SANITIZE_STYLES if styles is None else styles
+    # For each <span> or <font> opened, whether it was removed
+    removed = []
+
+    def sanitize(match) -> str:
+
+        if match.group(2) is None:
+            return ''
+
+        name = match.group(2).lower()
+        if match.group(1):
+            if name in cst.SANITIZE_UNWRAPPED and len(removed) != 0:
+                return '' if removed.pop() else f'</{name}>'
+            return f'</{name}>'
+
+        kept = []
+        for attribute in _RE_HTML_ATTRIBUTE.finditer(match.group(3)):
+            key = attribute.group(1).lower()
+            value = next((v for v in attribute.group(2, 3, 4) if v is not None),
+                         None)
+            if key == 'style' and value is not None:
+                value = ';'.join(
+                    declaration.strip() for declaration in value.split(';')
+                    if declaration.split(':', 1)[0].strip().lower() in styles
+                )
+                if value == '':
+                    continue
+            elif key not in attributes:
+                continue
+            if value is None:
+                kept.append(f' {key}')
+            elif '"' in value:
+                kept.append(f" {key}='{value}'")
+            else:
+                kept.append(f' {key}="{value}"')
+
+        if name in cst.SANITIZE_UNWRAPPED:
+            removed.append(len(kept) == 0)
+            if len(kept) == 0:
+                return ''
+        return f'<{name}{"".join(kept)}>'
+
+    text = _RE_HTML_TOKEN.sub(sanitize, text)
+    return _RE_WHITESPACES.sub(
+        lambda match: '\n' if '\n' in match.group(0) else ' ', text
+    ).strip()
+
+
+def html_to_text(text: str) -> str:
+    """
+    :param text: an HTML text
+    :return: its text only: without tags nor comments, the entities replaced and
+             the whitespaces collapsed
+    """
+    text = _RE_HTML_TOKEN.sub(' ', text)
+    return html.unescape(_RE_WHITESPACES.sub(' ', text)).strip()
+
+
+def snippet(text: str, searched: str, words=None) -> str:
+    """
+    Extract the part of a text where the first searched word is, the words
+    searched being put in brackets like in the snippets of SQLite
+
+    :param text: the text, without HTML
+    :param searched: the words searched, as typed by the user
+    :param words: the number of words to extract, constants.SEARCH_SNIPPET_WORDS
+                  by default
+    :return: the words around what was found, the beginning of the text if
+             nothing was
+    """
+    words = cst.SEARCH_SNIPPET_WORDS if words is None else words
+    searched = [word.lower() for word in searched.split()]
+    tokens = text.split()
+
+    def is_searched(token: str) -> bool:
+
+        return any(word in token.lower() for word in searched)
+
+    first = next((i for i, token in enumerate(tokens) if is_searched(token)),
+                 None)
+    start = 0 if first is None else max(first - words // 2, 0)
+    end = start + words
+    extract = ' '.join(f'[{token}]' if is_searched(token) else token
+                       for token in tokens[start:end])
+
+    return (f'{"…" if start > 0 else ""}{extract}'
+            f'{"…" if end < len(tokens) else ""}')
+
+
+# Templates already split in (literal, field, format_spec, conversion) parts by
+# write_template(), since parsing them again for each file is wasteful
+_PARSED_TEMPLATES = {}
+_FORMATTER = string.Formatter()
+
+# The permissions the files created by the process get, given to the temporary
+# files of OutputFile (created readable by their owner only) before they
+# replace the files. Reading it means setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def write_template(file, template: str, **values):
+    """
+    Write a 'format-able' template to an opened file, one segment at a time.
+
+    It produces the same result as `file.write(template.format(**values))`
+    without ever building the whole formatted string in memory: the literal
+    parts of the template and each value are written directly to the file.
+
+    A value which is an iterator (a generator for example) is consumed and
+    each of its pieces written in turn, which allows streaming huge contents
+    like a table of contents. Since it can only be consumed once, such a value
+    must appear only once in the template.
+
+    :param file: the file (opened in text mode) in which to write
+    :param template: the 'format-able' string to use
+    :param values: the values for the fields of the template
+    """
+    try:
+        parsed = _PARSED_TEMPLATES[template]
+    except KeyError:
+        parsed = list(_FORMATTER.parse(template))
+        _PARSED_TEMPLATES[template] = parsed
+
+    for literal, field, format_spec, conversion in parsed:
+        if literal:
+            file.write(literal)
+        if field is None:
+            continue
+
+        value = _FORMATTER.get_field(field, (), values)[0]
+        value = _FORMATTER.convert_field(value, conversion)
+
+        if isinstance(value, str) and not format_spec:
+            file.write(value)
+        elif hasattr(value, '__next__'):
+            for piece in value:
+                file.write(piece)
+        else:
+            file.write(format(value, format_spec))
+
+
+def file_hash(path: str) -> str:
+    """
+    :param path: the file to hash
+    :return: the sha1 of the file's content, read by chunks
+    """
+    file_sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            file_sha.update(chunk)
+    return file_sha.hexdigest()
+
+
+class OutputFile:
+    """
+    A file to write which is only replaced when its new content differs from
+    the old one: writing byte-identical content leaves the file (and its
+    modification time) untouched, which spares the synchronisation and backup
+    tools a useless upload.
+
+    It is used like `open(path, 'w', encoding='utf-8')`:
+
+        with OutputFile(path) as f:
+            f.write(text)
+
+    The content is written to a temporary file next to the final one while
+    being hashed, then compared to the existing file when closed. The
+    temporary file either replaces the existing one or is deleted, meaning
+    an interrupted writing never leaves a truncated file behind. Its name is
+    unique, so several processes can write the same file at once.
+
+    After closing, `.changed` tells if the file was written and `.size` gives
+    its size in bytes.
+    """
+    def __init__(self, path: str):
+
+        self.path = path
+        self.changed = False
+        self.size = 0
+
+        self.__temp_path = None
+        self.__file = None
+        self.__hash = None
+
+    def __enter__(self):
+
+        directory, name = os.path.split(self.path)
+        descriptor, self.__temp_path = tempfile.mkstemp(
+            suffix='.tmp', prefix=f'{name}.', dir=directory or '.'
+        )
+        os.chmod(self.__temp_path, 0o666 & ~_UMASK)
+        self.__file = os.fdopen(descriptor, 'wb')
+        self.__hash = hashlib.sha1()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        identical = exc_type is None and self.is_identical()
+        self.__file.close()
+
+        # Nothing is replaced if the writing failed
+        if exc_type is not None or identical:
+            os.remove(self.__temp_path)
+        else:
+            os.replace(self.__temp_path, self.path)
+            self.changed = True
+
+        return False
+
+    def write(self, text: str):
+        """
+        :param text: the text to add to the file
+        """
+        data = text.encode('utf-8')
+        self.__hash.update(data)
+        self.__file.write(data)
+        self.size += len(data)
+
+    def restart(self):
+        """
+        Discard everything written so far
+        """
+        self.__file.seek(0)
+        self.__file.truncate()
+        self.__hash = hashlib.sha1()
+        self.size = 0
+
+    def is_identical(self) -> bool:
+        """
+        :return: True if what was written so far is exactly the content of the
+                 existing file
+        """
+        self.__file.flush()
+        try:
+            if os.path.getsize(self.path) != self.size:
+                return False
+        except FileNotFoundError:
+            return False
+        return file_hash(self.path) == self.__hash.hexdigest()
+
+
+def write_file(path: str, text: str) -> bool:
+    """
+    Write a text to a file unless the file already contains exactly this text
+
+    :param path: the file to write
+    :param text: the text to write in it
+    :return: True if the file was written
+    """
+    with OutputFile(path) as f:
+        f.write(text)
+    return f.changed
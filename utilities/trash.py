@@ -0,0 +1,157 @@
+__version__ = '2018.07.23'
+__author__ = 'Alexis BOURGET'
+
+import os
+import time
+import uuid
+import threading
+
+import utilities.tools as tls
+import utilities.constants as cst
+import utilities.storage as stg
+import utilities.data_handler as dh
+import utilities.chapter_store as cs
+
+
+class Trash:
+    """
+    Delete stories without making the user wait: their files are moved to
+    the trash folder with a single rename and actually deleted by a
+    background thread, by small batches to never monopolize the disk.
+
+    Everything in the trash folder is to be deleted, so a deletion
+    interrupted by closing the application is resumed the next time the
+    trash is emptied. The stored texts are the exception: they are only listed
+    by hash, and deleted if no chapter uses them when the trash is emptied.
+    """
+    def __init__(self, database_file: str, folder=cst.TRASH_FOLDER,
+                 store_folder=cst.RAW_CHAPTERS_FOLDER):
+        """
+        The paths are used as absolute paths, so the current working directory
+        can change meanwhile
+
+        :param database_file: the database of the library, telling which
+                              stored texts are still used
+        :param folder: the trash folder
+        :param store_folder: the folder of the chapter store
+        """
+        self.__logger = tls.setup_logging('Trash')
+        self.folder = os.path.abspath(folder)
+        self.__database_file = os.path.abspath(database_file)
+        self.__store = cs.ChapterStore(os.path.abspath(store_folder))
+
+        self.__wake_up = threading.Event()
+        self.__thread = None
+
+    def add_story(self, folder: str) -> bool:
+        """
+        Move a story to the trash, whether it is packed or not
+
+        :param folder: the story's directory, ending with a '/'
+        :return: False if the story was saved nowhere
+        """
+        # Unique in the trash even if a story is deleted twice
+        destination = (f'{self.folder}/{uuid.uuid4().hex}_'
+                       f'{os.path.basename(folder.rstrip("/"))}')
+
+        moved = False
+        for storage in (stg.PackedStorage(folder), stg.LooseStorage(folder)):
+            if storage.is_present():
+                storage.move(destination)
+                moved = True
+
+        self.__logger.debug(f'Trashed: {folder} ({moved})')
+        return moved
+
+    def add_texts(self, hashes):
+        """
+        Mark stored texts to be deleted, without moving them. The same text may
+        be stored again for another chapter before the trash is emptied: it is
+        then kept
+
+        :param hashes: the content hashes of the texts
+        """
+        hashes = list(hashes)
+        if len(hashes) == 0:
+            return
+
+        # Written next to it then renamed, so the trash never contains a
+        # partial list
+        path = f'{self.folder}/{uuid.uuid4().hex}.texts'
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(hashes))
+        os.replace(f'{path}.tmp', path)
+
+        self.__logger.debug(f'{len(hashes)} stored texts trashed')
+
+    def empty(self) -> int:
+        """
+        Delete everything in the trash, pausing after each batch of files
+
+        :return: the number of files deleted
+        """
+        self.__logger.info('Emptying the trash')
+        removed = 0
+
+        def remove(path: str):
+
+            nonlocal removed
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            removed += 1
+            if removed % cst.TRASH_BATCH_SIZE == 0:
+                time.sleep(cst.TRASH_PAUSE)
+
+        # Only opened if there are stored texts to delete. The trash is
+        # emptied in its own thread, which needs its own DataHandler
+        database = None
+        try:
+            for entry in os.scandir(self.folder):
+                try:
+                    if entry.is_dir():
+                        for file in os.scandir(entry.path):
+                            remove(file.path)
+                        os.rmdir(entry.path)
+                    elif entry.name.endswith('.texts'):
+                        if database is None:
+                            database = dh.DataHandler(self.__database_file)
+                        with open(entry.path, 'r', encoding='utf-8') as f:
+                            hashes = f.read().split('\n')
+                        # Checked again right before each batch is deleted
+                        for i in range(0, len(hashes), cst.TRASH_BATCH_SIZE):
+                            for content_hash in database.get_unused_hashes(
+                                    hashes[i:i + cst.TRASH_BATCH_SIZE]):
+                                remove(self.__store.path(content_hash))
+                        os.remove(entry.path)
+                    else:
+                        remove(entry.path)
+                except OSError as err:
+                    self.__logger.error(
+                        f'Could not delete {entry.path}: {err}')
+        finally:
+            if database is not None:
+                database.close()
+
+        self.__logger.debug(f'Trash emptied: {removed} files deleted')
+        return removed
+
+    def __run(self):
+        """
+        Empty the trash each time it is woken up
+        """
+        while True:
+            self.__wake_up.wait()
+            self.__wake_up.clear()
+            self.empty()
+
+    def wake_up(self):
+        """
+        Empty the trash in the background, starting the thread doing it if
+        needed
+        """
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__run, daemon=True)
+            self.__thread.start()
+        self.__wake_up.set()